@@ -14,7 +14,6 @@ import os
 import errno
 import sys, argparse
 import uuid
-import hashlib 
 
 from loguru         import logger
 from rich_argparse  import RichHelpFormatter
@@ -22,11 +21,9 @@ from rich_argparse  import RichHelpFormatter
 
 
 def get_hash( path : str) -> str:
-    hasher = hashlib.sha256()
-    with open(path, 'rb') as f:
-        while chunk := f.read(8192):
-            hasher.update(chunk)
-    return hasher.hexdigest()
+    """Return the sha256 digest of a file, through the digest service of this process."""
+    from maestro_lightning.storage.digest import get_digest_service
+    return get_digest_service().digest(path)
 
 def get_argparser_formatter():
     RichHelpFormatter.styles["argparse.args"]     = "green"
@@ -71,6 +68,10 @@ def symlink(target, linkpath):
 from . import backends 
 __all__.extend( backends.__all__ )
 from .backends import *
+
+from . import storage
+__all__.extend( storage.__all__ )
+from .storage import *
  
 from . import models
 __all__.extend( models.__all__ )
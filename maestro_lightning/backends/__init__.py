@@ -1,9 +1,17 @@
 __all__ = []
 
+from . import sampler
+__all__.extend( sampler.__all__ )
+from .sampler import *
+
 from . import process
 __all__.extend( process.__all__ )
 from .process import *
 
 from . import slurm 
 __all__.extend( slurm.__all__ )
-from .slurm import *
\ No newline at end of file
+from .slurm import *
+
+from . import local
+__all__.extend( local.__all__ )
+from .local import *
\ No newline at end of file
@@ -0,0 +1,143 @@
+__all__ = ["Pool"]
+
+import os
+import subprocess
+
+from typing import Any, Dict, List, Tuple
+from loguru import logger
+from time   import sleep
+
+
+class Pool:
+    """
+    Bounded pool of local processes with CPU slot accounting.
+
+    Each process claims a number of CPUs when it is started and releases them
+    when it exits, so the sum of the CPUs of the running processes never goes
+    over the size of the pool. The pool waits for processes to exit with
+    waitid, without reaping them, instead of polling each one with a sleep.
+
+    When pinned, each process is also bound to its own set of cores, taken
+    from the cores this process is allowed to run on (e.g. the cores of a
+    SLURM allocation), so concurrent processes do not compete for them.
+    """
+
+    def __init__(self, cpus : int=os.cpu_count(), pin : bool=False):
+        """
+        Initializes the pool.
+
+        Parameters:
+        ----------
+        cpus : int
+            The number of CPUs shared by all processes of the pool.
+        pin : bool
+            Bind each process to the cores of its CPU slots.
+        """
+        self.cpus    = cpus
+        self.running = {}
+        self.cores   = sorted(os.sched_getaffinity(0))[:cpus] if pin else None
+        if self.cores is not None:
+            self.cpus = len(self.cores)
+
+    @property
+    def used(self) -> int:
+        return sum(cpus for _, cpus, _ in self.running.values())
+
+    @property
+    def free(self) -> int:
+        return self.cpus - self.used
+
+    def __len__(self) -> int:
+        return len(self.running)
+
+    def submit(self,
+               key     : Any,
+               command : str,
+               cpus    : int=1,
+               envs    : Dict[str, str]={},
+               stdout  : str=None,
+               stderr  : str=None,
+        ) -> bool:
+        """
+        Start a process if there are enough free CPUs.
+
+        Parameters:
+        ----------
+        key : Any
+            The key used to report the process when it exits.
+        command : str
+            The shell command to be executed.
+        cpus : int
+            The number of CPUs claimed by the process. Processes larger than the
+            pool are started alone, with the whole pool.
+        envs : Dict[str, str]
+            Extra environment variables for the process.
+        stdout, stderr : str
+            Optional files receiving the process output.
+
+        Returns:
+            bool: True if the process was started.
+        """
+        cpus = min(cpus, self.cpus)
+        if cpus > self.free:
+            return False
+        env = dict(os.environ)
+        env.update(envs)
+        env["MAESTRO_CPUS"] = str(cpus)
+        # NOTE: processes of the pool share the cgroup of this process, so they do not sample it
+        env["MAESTRO_POOL"] = "1"
+        cores = None
+        if self.cores is not None:
+            cores = self.cores[:cpus]
+            self.cores = self.cores[cpus:]
+        out = open(stdout, 'w') if stdout else None
+        err = open(stderr, 'w') if stderr else None
+        try:
+            preexec = (lambda: os.sched_setaffinity(0, cores)) if cores else None
+            proc = subprocess.Popen(command, env=env, shell=True, stdout=out, stderr=err, preexec_fn=preexec)
+        except:
+            if cores:
+                self.cores = sorted(self.cores + cores)
+            raise
+        finally:
+            for f in [out, err]:
+                if f:
+                    f.close()
+        logger.debug(f"started process {proc.pid} for {key} with {cpus} cpus (cores {cores}).")
+        self.running[key] = (proc, cpus, cores)
+        return True
+
+    def wait(self) -> List[Tuple[Any, int]]:
+        """
+        Block until at least one process exits.
+
+        Returns:
+            List[Tuple[Any, int]]: The key and exit code of each finished process.
+        """
+        if not self.running:
+            return []
+        try:
+            # NOTE: WNOWAIT leaves the child to be reaped by its Popen object below
+            os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            pass
+        done = []
+        for key, (proc, _, cores) in list(self.running.items()):
+            if proc.poll() is not None:
+                done.append((key, proc.returncode))
+                del self.running[key]
+                if cores:
+                    self.cores = sorted(self.cores + cores)
+        if not done:
+            # NOTE: another child of this process exited; avoid spinning on it
+            sleep(0.1)
+        return done
+
+    def kill(self):
+        """Kill every running process."""
+        for proc, _, cores in self.running.values():
+            proc.kill()
+            proc.wait()
+            if cores:
+                self.cores = sorted(self.cores + cores)
+        self.running = {}
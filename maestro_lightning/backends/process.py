@@ -1,6 +1,7 @@
-__all__ = ["Popen"]
+__all__ = ["Popen", "Heartbeat"]
 
 
+import os
 import nvsmi
 import psutil
 import traceback
@@ -8,7 +9,9 @@ import threading
 import subprocess
 
 from loguru import logger
-from time   import sleep, time
+from time   import time
+from typing import Callable
+from maestro_lightning.backends.sampler import Sampler
 
 
 
@@ -20,99 +23,155 @@ def get_gpu_processes():
       
 
 class Monitor(threading.Thread):
+    """
+    Thread collecting the resource usage of a process through a `Sampler`.
+
+    The sampling interval adapts to the job: it grows while memory and CPU
+    usage are stable, falls back to the minimum when they change, and never
+    gets so short that the sampler itself uses more than `budget` of a core.
+    Averages are weighted by the time between samples.
+    """
    
-    def __init__(self, process , max_retry : int=5):
-      threading.Thread.__init__(self)
-      self.__proc     = process
-      retry=0
-      self.proc_stat=None
-      while retry<max_retry:
-        try:
-          self.proc_stat = psutil.Process(process.pid)
-          break
-        except:
-           sleep(0.01)
-           self.proc_stat=None
-           retry+=1
-
-      self.__lock     = threading.Lock()
+    def __init__(self, 
+                 process, 
+                 interval     : float=1.0, 
+                 max_interval : float=30.0, 
+                 budget       : float=0.01,
+        ):
+      threading.Thread.__init__(self, daemon=True)
+      self.__proc       = process
+      self.sampler      = Sampler(process.pid)
+      self.min_interval = interval
+      self.max_interval = max_interval
+      self.interval     = interval
+      self.budget       = budget
+      self.__stop       = threading.Event()
+      self.__lock       = threading.Lock()
       self.__cpu_percent_avg     = 0
       self.__cpu_percent_peak    = 0
       self.__gpu_memory_mb_avg   = 0
       self.__gpu_memory_mb_peak  = 0
       self.__sys_memory_mb_avg   = 0
       self.__sys_memory_mb_peak  = 0
+      self.__cpu_time            = 0
+      self.__io_read_mb          = 0
+      self.__io_write_mb         = 0
       self.__exec_time           = 0
+      self.__weight              = 0
+      self.start_time            = time()
  
 
     def run(self):
         self.start_time = time()
-        loop_num = 1
-        self.update(loop_num)
         def is_alive(proc) -> bool:
           return (True if (proc and proc.poll() is None) else False) if type(proc) == subprocess.Popen else proc.is_alive()
-        # NOTE: only start the monitoring if we are able to get the process
-        if self.__proc:
-          while is_alive(self.__proc):
-              self.__lock.acquire()
-              self.update(loop_num)
-              sleep(1)
-              self.__lock.release()
-        else:
-           logger.warning("the constructor not be able to get the process from the reference pid. We will not be able to monitor it.")
+        last_time, last_cpu_time = self.start_time, None
+        final = False
+        while True:
+            values = self.sampler.sample()
+            if final:
+              # NOTE: the process is gone, so the last sample only brings the totals kept by the cgroup
+              with self.__lock:
+                self.__cpu_time    = max(values["cpu_time"], self.__cpu_time)
+                self.__io_read_mb  = max(values["io_read"]/1024**2, self.__io_read_mb)
+                self.__io_write_mb = max(values["io_write"]/1024**2, self.__io_write_mb)
+              break
+            now = time()
+            cpu_percent = 100 * (values["cpu_time"] - last_cpu_time) / (now - last_time) if last_cpu_time is not None and now > last_time else 0
+            # NOTE: processes found late by the cached tree bring all their cpu time into a single interval
+            cpu_percent = min(cpu_percent, 100 * len(os.sched_getaffinity(0)))
+            with self.__lock:
+              self.update(values, cpu_percent, now - last_time if last_cpu_time is not None else 0)
+            self.adapt(values, cpu_percent)
+            last_time, last_cpu_time = now, values["cpu_time"]
+            if not is_alive(self.__proc):
+              break
+            # NOTE: stop() wakes the thread up as soon as the process ends, for a last sample
+            final = self.__stop.wait(self.interval)
         self.__exec_time = time() - self.start_time
-        
+        logger.debug(f"monitor took {self.sampler.samples} samples using {self.sampler.overhead:.3f}s of cpu.")
 
-    def update(self, loop_num):
 
-        def get_average(curr_avg, new_sample, num) -> float:
-            return (curr_avg * (num-1) + new_sample) / num
+    def stop(self):
+        self.__stop.set()
 
-        try:
-          children = self.proc_stat.children(recursive=True)
-          # NOTE: if not children, use the parent for measurements...
-          if len(children)==0:
-            children=[self.proc_stat]
-          else:
-            children=[psutil.Process(child.pid) for child in children]
-
-          gpu_children = get_gpu_processes()
-          sys_used_memory_mb = 0; cpu_percent = 0; gpu_used_memory_mb = 0
-
-          for child in children:
-            sys_used_memory_mb += child.memory_info().rss/1024**2
-            cpu_percent += child.cpu_percent()
-            for gpu_child in gpu_children:
-              gpu_used_memory_mb += (gpu_child.used_memory/1024**2) if gpu_child.pid==child.pid else 0
-
-            self.__cpu_percent_avg     = get_average( self.__cpu_percent_avg   , cpu_percent       , loop_num)
-            self.__sys_memory_mb_avg   = get_average( self.__sys_memory_mb_avg , sys_used_memory_mb, loop_num)
-            self.__gpu_memory_mb_avg   = get_average( self.__gpu_memory_mb_avg , gpu_used_memory_mb, loop_num)
-            self.__cpu_percent_peak    = cpu_percent if cpu_percent > self.__cpu_percent_peak else self.__cpu_percent_peak
-            self.__sys_memory_mb_peak  = sys_used_memory_mb if sys_used_memory_mb > self.__sys_memory_mb_peak else self.__sys_memory_mb_peak
-            self.__gpu_memory_mb_peak  = gpu_used_memory_mb if gpu_used_memory_mb > self.__gpu_memory_mb_peak else self.__gpu_memory_mb_peak
-            self.__exec_time           = time() - self.start_time
-        except:
-          #traceback.print_exc()
-          logger.debug("proc stat not available anymore.")
+
+    def update(self, values, cpu_percent, dt):
+
+        def get_average(curr_avg, new_sample) -> float:
+            return (curr_avg * (self.__weight - dt) + new_sample * dt) / self.__weight if self.__weight > 0 else new_sample
+
+        sys_used_memory_mb = values["memory"]/1024**2
+        gpu_used_memory_mb = values["gpu_memory_mb"]
+        self.__weight             += dt
+        self.__cpu_percent_avg     = get_average( self.__cpu_percent_avg   , cpu_percent       )
+        self.__sys_memory_mb_avg   = get_average( self.__sys_memory_mb_avg , sys_used_memory_mb)
+        self.__gpu_memory_mb_avg   = get_average( self.__gpu_memory_mb_avg , gpu_used_memory_mb)
+        self.__cpu_percent_peak    = max( cpu_percent, self.__cpu_percent_peak )
+        self.__sys_memory_mb_peak  = max( values["memory_peak"]/1024**2, sys_used_memory_mb, self.__sys_memory_mb_peak )
+        self.__gpu_memory_mb_peak  = max( gpu_used_memory_mb, self.__gpu_memory_mb_peak )
+        self.__cpu_time            = values["cpu_time"]
+        self.__io_read_mb          = values["io_read"]/1024**2
+        self.__io_write_mb         = values["io_write"]/1024**2
+        self.__exec_time           = time() - self.start_time
+
+
+    def adapt(self, values, cpu_percent):
+        """Stretch the sampling interval while the job is stable, within the cpu budget."""
+        memory = values["memory"]/1024**2
+        stable = abs(memory - self.__sys_memory_mb_avg) <= 0.05 * max(self.__sys_memory_mb_avg, 1) and \
+                 abs(cpu_percent - self.__cpu_percent_avg) <= 10
+        self.interval = min(self.interval * 1.5, self.max_interval) if stable else self.min_interval
+        cost = self.sampler.overhead / max(self.sampler.samples, 1)
+        self.interval = min(max(self.interval, cost / self.budget), self.max_interval)
 
 
     def __call__(self):
         # NOTE: using lock to avoid access this region at same writting time in the monitor loop...
-        self.__lock.acquire()
-        metrics = {
-            "exec_time"           : self.__exec_time            ,     
+        with self.__lock:
+          exec_time = self.__exec_time if not self.is_alive() else time() - self.start_time
+          metrics = {
+            "exec_time"           : exec_time                   ,     
             "cpu_percent_avg"     : self.__cpu_percent_avg      ,
             "cpu_percent_peak"    : self.__cpu_percent_peak     ,
             "sys_memory_mb_avg"   : self.__sys_memory_mb_avg    ,
             "sys_memory_mb_peak"  : self.__sys_memory_mb_peak   ,
             "gpu_memory_mb_avg"   : self.__gpu_memory_mb_avg    ,
             "gpu_memory_mb_peak"  : self.__gpu_memory_mb_peak   ,
-        }
-        self.__lock.release()
+            "cpu_time"            : self.__cpu_time             ,
+            "io_read_mb"          : self.__io_read_mb           ,
+            "io_write_mb"         : self.__io_write_mb          ,
+            "monitor_cpu_fraction": self.sampler.overhead / exec_time if exec_time > 0 else 0,
+          }
         return metrics
 
 
+class Heartbeat(threading.Thread):
+    """
+    Thread calling `beat` every `interval` seconds until it is stopped.
+
+    The job runner uses it to refresh the last time of its job record, so a
+    reaper can tell a running job from one whose node died.
+    """
+
+    def __init__(self, beat : Callable[[], None], interval : float=60.0):
+      threading.Thread.__init__(self, daemon=True)
+      self.beat     = beat
+      self.interval = interval
+      self.__stop   = threading.Event()
+
+    def run(self):
+      while not self.__stop.wait(self.interval):
+        try:
+          self.beat()
+        except Exception as e:
+          # NOTE: a missed beat (e.g. a slow shared filesystem) must not stop the next ones
+          logger.warning(f"heartbeat failed: {e}")
+
+    def stop(self):
+      self.__stop.set()
+
+
 class Popen:
 
   def __init__(self, 
@@ -120,7 +179,7 @@ class Popen:
                envs          : dict={},
                ):
 
-    self.command     = "sleep 2\n"+command
+    self.command     = command
     self.__pending   = True
     self.__broken    = False
     self.__killed    = False
@@ -170,17 +229,38 @@ class Popen:
             "sys_memory_mb_peak"  : 0 ,
             "gpu_memory_mb_avg"   : 0 ,
             "gpu_memory_mb_peak"  : 0 ,
+            "cpu_time"            : 0 ,
+            "io_read_mb"          : 0 ,
+            "io_write_mb"         : 0 ,
+            "monitor_cpu_fraction": 0 ,
         }
          return metrics
    
    
-  def join(self):
-    while self.is_alive():
-      sleep(5)
+  def oom_kills(self) -> int:
+    return self.__mon_thread.sampler.oom_kills() if self.__mon_thread else 0
+
+
+  def join(self, timeout : float=None) -> int:
+    """
+    Block until the process exits, without polling, and stop the monitor.
+
+    Returns:
+      int: The exit code of the process.
+    """
+    if self.__proc:
+      self.__proc.wait(timeout)
+    if self.__mon_thread:
+      self.__mon_thread.stop()
+      self.__mon_thread.join()
+    return self.exitcode
 
 
   def is_alive(self):
-    return True if (self.__proc and self.__proc.poll() is None) else False
+    alive = True if (self.__proc and self.__proc.poll() is None) else False
+    if not alive and self.__mon_thread:
+      self.__mon_thread.stop()
+    return alive
 
 
   def kill(self):
@@ -0,0 +1,238 @@
+__all__ = ["Sampler"]
+
+import os
+import re
+import shutil
+
+from typing import Dict, Set, Union
+from loguru import logger
+from time   import thread_time
+
+
+page_size  = os.sysconf("SC_PAGE_SIZE")
+clock_tick = os.sysconf("SC_CLK_TCK")
+
+
+def has_gpus() -> bool:
+    """Check once, without running nvidia-smi, whether this node has NVIDIA GPUs."""
+    return shutil.which("nvidia-smi") is not None and os.path.exists("/dev/nvidiactl")
+
+
+def get_cgroup(pid : int) -> Union[str, None]:
+    """
+    Return the cgroup v2 directory of a process if it is dedicated to a SLURM job.
+
+    The cgroup is only used when it is a batch or srun step of the current
+    SLURM job (e.g. '.../job_123/step_0') running this job alone. Jobs started
+    by a local pool (MAESTRO_POOL, e.g. packed jobs) share the step with the
+    other jobs of the pool, and interactive steps (salloc) or sessions outside
+    of a job allocation hold other processes of the user, so those jobs are
+    sampled from /proc.
+    """
+    job_id = os.environ.get("SLURM_JOB_ID", None)
+    if not job_id or os.environ.get("MAESTRO_POOL", None):
+        return None
+    step = re.compile(rf"/job_{job_id}/step_(batch|\d+)(/|$)")
+    try:
+        with open(f"/proc/{pid}/cgroup", 'r') as f:
+            for line in f:
+                if line.startswith("0::"):
+                    path = line[3:].strip()
+                    folder = f"/sys/fs/cgroup{path}"
+                    if step.search(path) and os.path.exists(f"{folder}/cpu.stat"):
+                        return folder
+    except OSError:
+        pass
+    return None
+
+
+class Sampler:
+    """
+    Low overhead resource sampler for a process and all its descendants.
+
+    Each call to `sample` returns the current memory, the accumulated CPU time
+    and the accumulated I/O of the job. When the process runs in a cgroup v2
+    dedicated to the SLURM job, the values are read from a few cgroup files
+    ('memory.current', 'memory.peak', 'cpu.stat', 'io.stat'), which also
+    account for processes that already exited. Otherwise they are read from
+    '/proc/<pid>/stat', 'statm' and 'io' of every process of the tree.
+
+    The process tree is cached and only rebuilt every `refresh` samples or
+    when a known process exits, instead of walking '/proc' on every sample.
+    GPUs are detected once and nvidia-smi is never called on nodes without
+    them. The CPU time spent by the sampler itself is kept in `overhead`.
+    """
+
+    def __init__(self, pid : int, refresh : int=5, gpu_every : int=5):
+        """
+        Initializes the sampler.
+
+        Parameters:
+        ----------
+        pid : int
+            The root process of the job.
+        refresh : int
+            The number of samples between two rebuilds of the process tree.
+        gpu_every : int
+            The number of samples between two GPU queries, which are expensive.
+        """
+        self.pid       = pid
+        self.refresh   = refresh
+        self.gpu_every = gpu_every
+        self.cgroup    = get_cgroup(pid)
+        self.gpus      = has_gpus()
+        self.pids      = {pid}
+        self.samples   = 0
+        self.overhead  = 0.0
+        self.__age     = 0
+        self.gpu_memory_mb = 0.0
+        # NOTE: last cpu time and io of every process seen, kept after it exits (for /proc sampling)
+        self.__cpu_time = {}
+        self.__io       = {}
+        logger.debug(f"sampling process {pid} from {self.cgroup or '/proc'} (gpus: {self.gpus}).")
+
+    #
+    # process tree
+    #
+
+    def _tree(self) -> Set[int]:
+        """Find every descendant of the root process with a single pass over /proc."""
+        parents = {}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{name}/stat", 'rb') as f:
+                    stat = f.read()
+                # NOTE: the command name may hold spaces, so fields are split after its closing parenthesis
+                ppid = int(stat[stat.rindex(b')') + 2:].split()[1])
+                parents.setdefault(ppid, []).append(int(name))
+            except (OSError, ValueError):
+                continue
+        pids, pending = set(), [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.add(pid)
+            pending.extend(parents.get(pid, []))
+        return pids
+
+    #
+    # readers
+    #
+
+    def _read_proc(self) -> Dict[str, float]:
+        rss = 0; io_read = 0; io_write = 0
+        alive = set()
+        for pid in self.pids:
+            try:
+                with open(f"/proc/{pid}/stat", 'rb') as f:
+                    fields = f.read()
+                fields = fields[fields.rindex(b')') + 2:].split()
+                # NOTE: utime and stime are the 14th and 15th fields of stat
+                self.__cpu_time[pid] = (int(fields[11]) + int(fields[12])) / clock_tick
+                with open(f"/proc/{pid}/statm", 'rb') as f:
+                    rss += int(f.read().split()[1]) * page_size
+                alive.add(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            try:
+                read = write = 0
+                with open(f"/proc/{pid}/io", 'rb') as f:
+                    for line in f:
+                        if line.startswith(b"read_bytes:"):
+                            read = int(line.split()[1])
+                        elif line.startswith(b"write_bytes:"):
+                            write = int(line.split()[1])
+                self.__io[pid] = (read, write)
+            except (OSError, ValueError):
+                # NOTE: io is only readable by the owner of the process
+                pass
+        for read, write in self.__io.values():
+            io_read += read; io_write += write
+        cpu_time = sum(self.__cpu_time.values())
+        if alive != self.pids:
+            # NOTE: a process exited, so its children may have been adopted by another process
+            self.__age = 0
+        return { "memory" : rss, "memory_peak" : rss, "cpu_time" : cpu_time, "io_read" : io_read, "io_write" : io_write }
+
+    def _read_cgroup(self) -> Dict[str, float]:
+        def read_int(name : str) -> int:
+            with open(f"{self.cgroup}/{name}", 'r') as f:
+                return int(f.read().strip())
+        memory = read_int("memory.current")
+        try:
+            memory_peak = read_int("memory.peak")
+        except OSError:
+            # NOTE: memory.peak only exists on kernels >= 5.19
+            memory_peak = memory
+        cpu_time = 0
+        with open(f"{self.cgroup}/cpu.stat", 'r') as f:
+            for line in f:
+                if line.startswith("usage_usec"):
+                    cpu_time = int(line.split()[1]) / 1e6
+                    break
+        io_read = 0; io_write = 0
+        try:
+            with open(f"{self.cgroup}/io.stat", 'r') as f:
+                for line in f:
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition("=")
+                        if key == "rbytes":
+                            io_read += int(value)
+                        elif key == "wbytes":
+                            io_write += int(value)
+        except OSError:
+            pass
+        return { "memory" : memory, "memory_peak" : memory_peak, "cpu_time" : cpu_time, "io_read" : io_read, "io_write" : io_write }
+
+    def _read_gpu(self) -> float:
+        from maestro_lightning.backends.process import get_gpu_processes
+        pids = self.pids if not self.cgroup else self._tree()
+        return sum( process.used_memory/1024**2 for process in get_gpu_processes() if process.pid in pids )
+
+    def oom_kills(self) -> int:
+        """
+        Return the number of processes killed by the memory limit of the job cgroup.
+
+        Returns:
+            int: The 'oom_kill' count of 'memory.events', zero when sampling from /proc.
+        """
+        if not self.cgroup:
+            return 0
+        try:
+            with open(f"{self.cgroup}/memory.events", 'r') as f:
+                for line in f:
+                    if line.startswith("oom_kill "):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def sample(self) -> Dict[str, float]:
+        """
+        Take a sample of the job resources.
+
+        Returns:
+            Dict[str, float]: 'memory' and 'memory_peak' in bytes, 'cpu_time' in
+            seconds and 'io_read'/'io_write' in bytes (all accumulated since the
+            job started, except memory) and 'gpu_memory_mb'.
+        """
+        start = thread_time()
+        if self.cgroup:
+            try:
+                values = self._read_cgroup()
+            except OSError:
+                logger.debug(f"cgroup {self.cgroup} not readable anymore, falling back to /proc.")
+                self.cgroup = None
+                self.__age  = 0
+        if not self.cgroup:
+            if self.__age % self.refresh == 0:
+                self.pids = self._tree()
+            self.__age += 1
+            values = self._read_proc()
+        if self.gpus and self.samples % self.gpu_every == 0:
+            self.gpu_memory_mb = self._read_gpu()
+        values["gpu_memory_mb"] = self.gpu_memory_mb
+        self.samples  += 1
+        self.overhead += thread_time() - start
+        return values
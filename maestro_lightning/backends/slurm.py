@@ -1,12 +1,16 @@
 __all__ = [
-    "sbatch"
+    "sbatch",
+    "array_ranges",
+    "split_array",
+    "scancel",
+    "squeue",
 ]
 
 import os
 import subprocess
 import shlex
 
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple, Union
 from loguru import logger
 
 
@@ -70,6 +74,54 @@ slurm_opts = {
     "EXCLUSIVE"             : (False, "--exclusive"),            
 }
 
+def array_ranges(ids : List[int]) -> str:
+    """
+    Compress array indices into a SLURM array spec (e.g. '0-999,1204,1300-1400').
+
+    Args:
+        ids (List[int]): The array indices, in any order.
+
+    Returns:
+        str: The comma separated list of ranges.
+    """
+    ids = sorted(set(ids))
+    ranges = []
+    for index in ids:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ",".join( f"{first}-{last}" if first != last else f"{first}" for first, last in ranges )
+
+
+def split_array(ids        : List[int], 
+                max_size   : int=1001, 
+                max_length : int=10000,
+    ) -> List[Tuple[str, Union[List[int], None]]]:
+    """
+    Split job ids into SLURM array submissions within the cluster limits.
+
+    When the largest id is below max_size (the SLURM MaxArraySize, which bounds
+    the array index) and the compressed spec fits in max_length characters,
+    the ids are used directly as array indices in a single submission.
+    Otherwise they are split into chunks of at most max_size ids, each one
+    submitted as a dense '0-(n-1)' array whose index is mapped to the job id
+    through an indirection list.
+
+    Returns:
+        List[Tuple[str, Union[List[int], None]]]: The array spec of each
+        submission and the job id of each array index, or None when the array
+        indices are the job ids.
+    """
+    ids = sorted(set(ids))
+    if not ids:
+        return []
+    spec = array_ranges(ids)
+    if ids[-1] < max_size and len(spec) <= max_length:
+        return [(spec, None)]
+    return [ (f"0-{len(chunk)-1}", chunk) for chunk in [ ids[i:i+max_size] for i in range(0, len(ids), max_size) ] ]
+
+
 class sbatch:
     def __init__(self, 
                  path : str,
@@ -160,3 +212,55 @@ class sbatch:
             logger.error(f"An unexpected error occurred: {e}")
             return None
 
+
+def scancel(job_ids : List[int]) -> bool:
+    """
+    Cancel SLURM jobs, e.g. the part of a flow submitted before a submission failed.
+
+    Parameters:
+    ----------
+    job_ids : List[int]
+        The job IDs to be canceled.
+
+    Returns:
+        bool: True if scancel accepted all jobs.
+    """
+    if not job_ids:
+        return True
+    command = f"scancel {' '.join(str(job_id) for job_id in job_ids)}"
+    logger.info(f"Canceling jobs: {command}")
+    try:
+        subprocess.run(shlex.split(command), capture_output=True, text=True, check=True)
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error canceling jobs (Exit Code {e.returncode}): {e.stderr.strip()}")
+    except FileNotFoundError:
+        logger.error("Error: 'scancel' command not found. Is Slurm installed and in your PATH?")
+    return False
+
+
+def squeue(job_ids : List[int]) -> List[int]:
+    """
+    Return the SLURM jobs (or arrays) still pending or running.
+
+    Parameters:
+    ----------
+    job_ids : List[int]
+        The job IDs to be checked.
+
+    Returns:
+        List[int]: The IDs still in the queue. Jobs unknown to SLURM, which already left it, are not returned.
+    """
+    if not job_ids:
+        return []
+    command = f"squeue -h -o %F -j {','.join(str(job_id) for job_id in job_ids)}"
+    try:
+        result = subprocess.run(shlex.split(command), capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError:
+        # NOTE: squeue fails when none of the jobs is known anymore
+        return []
+    except FileNotFoundError:
+        logger.error("Error: 'squeue' command not found. Is Slurm installed and in your PATH?")
+        return []
+    queued = { int(line) for line in result.stdout.split() if line.isdigit() }
+    return [ job_id for job_id in job_ids if job_id in queued ]
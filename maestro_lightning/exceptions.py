@@ -41,6 +41,10 @@ class ImageExistsError(Exception):
         """Set the error message with the image name."""
         message = f"Image '{name}' already exists in the group of images."
         super().__init__(message)
-        
-        
-        
\ No newline at end of file
+
+class TransferError(Exception):
+    """Raised when a file could not be copied and verified."""
+    def __init__(self, source, target, reason):
+        """Set the error message with the source and target paths."""
+        message = f"Could not copy {source} to {target}: {reason}."
+        super().__init__(message)
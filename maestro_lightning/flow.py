@@ -3,20 +3,34 @@ __all__ = [
     "Session",
     "dump",
     "load",
+    "diff",
     "print_datasets",
     "print_images",
     "print_tasks",
+    "print_plan",
 ]
 
 import os
 import json
-import tempfile
+import shutil
+import hashlib
 
 from loguru import logger
 from tabulate import tabulate
-from typing import Dict
+from typing import Dict, Union
 from maestro_lightning.models import Context, Dataset, Image, Task, State
-from maestro_lightning import get_context, get_hash, setup_logs
+from maestro_lightning import get_context, setup_logs
+
+
+#
+# NOTE: how each task of an existing flow is handled when the flow is run again
+#
+NEW         = "new"         # not in the flow yet, appended
+CHANGED     = "changed"     # its structure changed, reset and run again
+INVALIDATED = "invalidated" # reads the outputs of a changed task, reset and run again
+UPDATED     = "updated"     # only its scheduling parameters changed, kept
+UNCHANGED   = "unchanged"   # kept
+REMOVED     = "removed"     # no longer defined, its folder is left on disk
 
 
 
@@ -29,6 +43,11 @@ class Flow:
                  path           : str = f"{os.getcwd()}/tasks",
                  level          : str="INFO",
                  partition      : str="cpu",
+                 backend        : str="slurm",
+                 cpus           : int=None,
+                 dag            : bool=False,
+                 stream         : bool=False,
+                 max_array_size : int=1001,
         ):
             """
             Initializes a new instance of the class.
@@ -41,6 +60,23 @@ class Flow:
                 The file path where tasks are located. Defaults to the current working directory followed by '/tasks'.
             virtualenv : str, optional
                 The path to the virtual environment. Defaults to the value of the environment variable 'VIRTUAL_ENV'.
+            backend : str, optional
+                Where the jobs are executed: "slurm" submits each task as a job array, "local"
+                runs all jobs of the flow in a process pool on the current machine. Defaults to "slurm".
+            cpus : int, optional
+                The number of CPUs shared by the jobs when using the local backend. Defaults to
+                all CPUs of the machine running the flow.
+            dag : bool, optional
+                When using the slurm backend, submit the arrays and finalizers of all tasks at once,
+                chained with SLURM dependencies, instead of submitting each task when the previous
+                one ends. Defaults to False.
+            stream : bool, optional
+                Start each job of a task reading the outputs of another task as soon as the
+                matching upstream job ends, instead of waiting for the whole upstream task.
+                Used by the local backend and by the dag mode. Defaults to False.
+            max_array_size : int, optional
+                The MaxArraySize of the SLURM cluster. Larger or sparse job arrays are split into
+                several submissions. Defaults to 1001, the SLURM default.
 
             Attributes:
             ----------
@@ -57,7 +93,12 @@ class Flow:
             self.extra_params = {
                 "virtualenv": virtualenv,
                 "condaenv": condaenv,
-                "partition": partition
+                "partition": partition,
+                "backend": backend,
+                "cpus": cpus,
+                "dag": dag,
+                "stream": stream,
+                "max_array_size": max_array_size,
             }
             setup_logs( name = f"Flow:{self.name}", level=level )
         
@@ -96,38 +137,130 @@ class Session:
             [image.mkdir() for image in ctx.images.values()]
             [dataset.mkdir() for dataset in ctx.datasets.values()]
             [task.mkdir() for task in ctx.tasks.values()]
-            # Execute tasks with no dependencies as entry points
-            for task in ctx.tasks.values():
-                if len(task.prev) == 0:
-                    logger.info(f"Preparing task {task.name} for execution.")
-                    command = f"maestro run task -t {self.path}/flow.json -i {task.task_id}"
-                    command+=" --dry-run" if dry_run else ""
-                    print(command)
-                    os.system(command)
-            
-          
+            self.launch(dry_run=dry_run)
         else:
-            # Create a temporary file
-            logger.info("Existing tasks found, verifying integrity before execution.")
-            with tempfile.NamedTemporaryFile(delete=True) as temp_file:
-                temp_file_path = temp_file.name
-                dump(ctx, temp_file_path)
-                temp_hash = get_hash(temp_file_path)
-            original_hash = get_hash(f"{self.path}/flow.json")
-
-            # Compare hashes
-            if original_hash != temp_hash:
-                raise Exception("Tasks have changed, you can not proceed with execution. Please create a new Flow instance or delete the current flow directory or rename it.")
-            else:
-                logger.info("No changes detected in tasks.")
-            logger.info(f"Executing tasks in flow located at {self.path}.")
-            #self.print_tasks()
+            logger.info("Existing tasks found, comparing them with the flow definition.")
+            self.extend(dry_run=dry_run)
         
         print("🚨 Please do not remove or move the flow directory or any dataset paths!\n"
               "🚨 Any changes may break the program and lead to unexpected behavior.")
            
         self.print()
             
+    def extend(self, dry_run : bool=False):
+        """
+        Apply the flow definition on top of the existing flow.
+
+        Tasks keep the id they got when they were first added, new tasks are
+        appended after them, and each task is compared with its stored version
+        through its structural signature (what its jobs compute). Changed tasks
+        and all tasks reading their outputs are reset and run again, with the
+        files of their output datasets removed, while unchanged tasks, and the
+        jobs they completed, are kept. The execution plan is printed first.
+
+        Parameters:
+        ----------
+        dry_run : bool
+            Only print the execution plan.
+
+        Raises:
+            Exception: If a task to be reset is running, or if a new task feeds an existing one.
+        """
+        ctx = get_context()
+        with open(f"{self.path}/flow.json", 'r') as f:
+            stored = json.load(f)
+
+        # NOTE: tasks are numbered by creation order, but scripts of a running flow refer to the stored ids
+        ids     = { data["name"] : int(data["task_id"]) for data in stored["tasks"].values() }
+        next_id = max(ids.values(), default=-1) + 1
+        for task in ctx.tasks.values():
+            if task.name in ids:
+                task.task_id = ids[task.name]
+            else:
+                task.task_id = next_id
+                next_id += 1
+        for task in ctx.tasks.values():
+            for prev in task.prev:
+                if prev.task_id > task.task_id:
+                    raise Exception(f"Task {prev.name} is new but feeds the existing task {task.name}. New tasks can only be added downstream.")
+
+        actions = diff(stored, flow_dict(ctx))
+        reset   = [ task for task in ctx.tasks.values() if actions[task.name] in [CHANGED, INVALIDATED] ]
+        print_plan(ctx, actions, { data["name"] : int(data["task_id"]) for data in stored["tasks"].values() })
+        if all( action in [UNCHANGED, UPDATED, REMOVED] for action in actions.values() ):
+            logger.info("No changes detected in the tasks.")
+            if not dry_run:
+                dump( ctx, f"{self.path}/flow.json" )
+            return
+        if dry_run:
+            logger.info("Dry run: the flow is not changed.")
+            return
+        for task in reset:
+            if task.status == State.RUNNING:
+                raise Exception(f"Task {task.name} must be reset but it is running. Wait for it to end or cancel it first.")
+        if ctx.extra_params.get("backend", "slurm") == "local" or ctx.extra_params.get("dag", False):
+            # NOTE: these backends dispatch every task not ended yet, so running tasks would be started twice
+            running = [ task.name for task in ctx.tasks.values() if task.status == State.RUNNING ]
+            if running:
+                raise Exception(f"Tasks {', '.join(running)} are running. Wait for the flow to end before extending it.")
+        for name, action in actions.items():
+            if action == REMOVED:
+                logger.warning(f"Task {name} is no longer defined. Its folder is kept at {self.path}/tasks/{name}.")
+
+        dump( ctx, f"{self.path}/flow.json" )
+        logger.info(f"Tasks saved to {self.path}/flow.json")
+        for image in ctx.images.values():
+            if stored["images"].get(image.name) != image.to_dict():
+                image.mkdir()
+        for dataset in ctx.datasets.values():
+            if dataset.from_task:
+                dataset.mkdir()
+            elif stored["datasets"].get(dataset.name) != dataset.to_dict():
+                # NOTE: links to the files of the old path are dropped
+                shutil.rmtree(f"{self.path}/datasets/{dataset.name}", ignore_errors=True)
+                dataset.mkdir()
+        for task in reset:
+            logger.info(f"Resetting task {task.name} ({actions[task.name]}).")
+            task.reset(delete_workarea=True, delete_outputs=True)
+        for task in ctx.tasks.values():
+            if actions[task.name] in [NEW, CHANGED, INVALIDATED]:
+                task.mkdir()
+        self.launch(dry_run=dry_run)
+
+    def launch(self, dry_run : bool=False):
+        """
+        Start the execution of the flow with its backend.
+
+        With the chained slurm backend, only the tasks which are still to be run
+        and whose upstream tasks already ended are started. The others are
+        started by the closing script of their upstream tasks.
+        """
+        ctx = get_context()
+        if ctx.extra_params.get("backend", "slurm") == "local":
+            # The whole graph is scheduled by a single local process pool
+            logger.info("Running all tasks in the local process pool.")
+            command = f"maestro run flow -t {self.path}/flow.json"
+            command+=" --dry-run" if dry_run else ""
+            print(command)
+            os.system(command)
+        elif ctx.extra_params.get("dag", False):
+            # All tasks are submitted at once, chained through SLURM dependencies
+            logger.info("Submitting all tasks of the flow with SLURM dependencies.")
+            command = f"maestro run dag -t {self.path}/flow.json"
+            command+=" --dry-run" if dry_run else ""
+            print(command)
+            os.system(command)
+        else:
+            # Execute tasks whose dependencies already ended as entry points
+            ended = [State.COMPLETED, State.FINALIZED]
+            for task in ctx.tasks.values():
+                if task.status == State.ASSIGNED and all( prev.status in ended for prev in task.prev ):
+                    logger.info(f"Preparing task {task.name} for execution.")
+                    command = f"maestro run task -t {self.path}/flow.json -i {task.task_id}"
+                    command+=" --dry-run" if dry_run else ""
+                    print(command)
+                    os.system(command)
+
     def print(self):
         print_images( get_context() )
         print_datasets( get_context() )
@@ -137,27 +270,93 @@ class Session:
 # read and write functions
 #
         
-def dump( ctx : Context, path : str):
-    
-    with open(path, 'w') as f:
-        d = {
+def flow_dict( ctx : Context) -> Dict:
+    """Return the raw representation of the flow, as stored in flow.json."""
+    d = {
             "datasets":{},
             "images":{},
             "tasks":{},
             "path":ctx.path,
             "extra_params": ctx.extra_params
         }
-        # step 1: dump all datasets which are not from tasks
-        for dataset in ctx.datasets.values():
-            if not dataset.from_task:
-                d['datasets'][ dataset.name ] = dataset.to_dict()
-        # step 2: dump all images
-        for images in ctx.images.values():
-            d['images'][ images.name ] = images.to_dict()  
-        # step 3: dump all tasks
-        for task in ctx.tasks.values():
-            d[ 'tasks' ][ task.task_id ] = task.to_dict()
-        json.dump( d , f , indent=2 )
+    # step 1: dump all datasets which are not from tasks
+    for dataset in ctx.datasets.values():
+        if not dataset.from_task:
+            d['datasets'][ dataset.name ] = dataset.to_dict()
+    # step 2: dump all images
+    for images in ctx.images.values():
+        d['images'][ images.name ] = images.to_dict()  
+    # step 3: dump all tasks
+    for task in ctx.tasks.values():
+        d[ 'tasks' ][ task.task_id ] = task.to_dict()
+    return d
+
+def dump( ctx : Context, path : str):
+    # NOTE: written aside and renamed, so scripts of a running flow never read a partial file
+    with open(f"{path}.{os.getpid()}", 'w') as f:
+        json.dump( flow_dict(ctx) , f , indent=2 )
+    os.replace(f"{path}.{os.getpid()}", path)
+
+def signature( data : Dict, task : Dict) -> str:
+    """
+    Structural fingerprint of a task of a raw flow: what its jobs compute.
+
+    It covers the command, the outputs, the binds, the environment and the
+    paths of the image and of the external datasets. Datasets written by other
+    tasks are identified by name, since a change upstream invalidates the task
+    anyway. Scheduling parameters (partition, cpus, retries, caches...) are left out.
+    """
+    def dataset(name : str) -> str:
+        return data["datasets"][name]["path"] if name in data["datasets"] else name
+    fields = {
+        "command"        : task["command"],
+        "image"          : data["images"][task["image"]]["path"] if task["image"] else None,
+        "input_data"     : dataset(task["input_data"]),
+        "outputs"        : task["outputs"],
+        "secondary_data" : { key : dataset(name) for key, name in task["secondary_data"].items() },
+        "binds"          : task["binds"],
+        "envs"           : task["envs"],
+    }
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:16]
+
+def diff( stored : Dict, current : Dict) -> Dict[str, str]:
+    """
+    Compare two raw flows task by task.
+
+    Parameters:
+    ----------
+    stored : Dict
+        The flow on disk.
+    current : Dict
+        The flow being defined.
+
+    Returns:
+        Dict[str, str]: The action for each task name (new, changed, invalidated,
+        updated, unchanged or removed).
+    """
+    old     = { task["name"] : task for task in stored["tasks"].values() }
+    new     = { task["name"] : task for task in current["tasks"].values() }
+    actions = {}
+    for name, task in new.items():
+        if name not in old:
+            actions[name] = NEW
+        elif signature(stored, old[name]) != signature(current, task):
+            actions[name] = CHANGED
+        else:
+            skip = ["task_id", "next", "prev"]
+            same = { k : v for k, v in old[name].items() if k not in skip } == { k : v for k, v in task.items() if k not in skip }
+            actions[name] = UNCHANGED if same else UPDATED
+    # NOTE: everything reading the outputs of a changed task, directly or not, must run again
+    queue = [ name for name, action in actions.items() if action == CHANGED ]
+    while queue:
+        for name in new[queue.pop()]["next"]:
+            if actions[name] in [UNCHANGED, UPDATED]:
+                actions[name] = INVALIDATED
+                queue.append(name)
+    for name in old:
+        if name not in new:
+            actions[name] = REMOVED
+    return actions
     
 def load( path : str, ctx : Context):
     
@@ -179,7 +378,8 @@ def print_datasets( ctx : Context):
     logger.info("Current datasets in the flow:")       
     rows  = []
     for dataset in ctx.datasets.values():
-        row = [dataset.name, len(dataset)]
+        # NOTE: outputs of tasks not created yet (e.g. in a dry run plan) have no folder
+        row = [dataset.name, len(dataset) if os.path.exists(dataset.path) else 0]
         rows.append(row)
     cols = ['dataset', 'num_files']
     table = tabulate(rows ,headers=cols, tablefmt="psql")
@@ -196,12 +396,42 @@ def print_images( ctx : Context):
     table = tabulate(rows ,headers=cols, tablefmt="psql")
     print(table)   
         
-def print_tasks(ctx : Context):
+def print_plan(ctx : Context, actions : Dict[str, str], removed_ids : Dict[str, int]={}):
+    """
+    Print what running the flow again does to each task and how many jobs will run.
+
+    Jobs of tasks reading the outputs of a task still to be run are only known
+    once their input files exist.
+    """
+    logger.info("Execution plan:")
+    ended = [State.COMPLETED, State.FINALIZED]
+    reset = [CHANGED, INVALIDATED, NEW]
+    def jobs(task : Task) -> Union[int, str]:
+        upstream = task.input_data.from_task
+        if actions[task.name] not in reset and task.status in ended:
+            return 0
+        if upstream and (actions[upstream.name] in reset or upstream.status not in ended):
+            return f"after {upstream.name}"
+        if actions[task.name] in reset:
+            return len(task.input_data)
+        return task.count()[State.ASSIGNED.value]
+    rows = []
+    for task in sorted(ctx.tasks.values(), key=lambda task: task.task_id):
+        status = State.ASSIGNED.value if actions[task.name] in reset else task.status.value
+        rows.append([task.name, task.task_id, actions[task.name], status, jobs(task)])
+    for name, action in actions.items():
+        if action == REMOVED:
+            rows.append([name, removed_ids.get(name, "-"), action, "-", 0])
+    cols = ['taskname', 'task_id', 'change', 'status', 'jobs_to_run']
+    table = tabulate(rows, headers=cols, tablefmt="psql")
+    print(table)
+
+def print_tasks(ctx : Context, recount : bool=False):
     logger.info("Current tasks in the flow:")
     rows  = []
     for task in ctx.tasks.values():
         row = [task.name, task.task_id]
-        count = task.count()
+        count = task.count(recount=recount)
         row.extend( [value for value in count.values()])
         row.extend([task.status.value])
         rows.append(row)
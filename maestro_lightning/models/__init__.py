@@ -34,6 +34,30 @@ from . import status
 __all__.extend( status.__all__ )
 from .status import *
 
+from . import table
+__all__.extend( table.__all__ )
+from .table import *
+
+from . import metrics
+__all__.extend( metrics.__all__ )
+from .metrics import *
+
+from . import profile
+__all__.extend( profile.__all__ )
+from .profile import *
+
+from . import history
+__all__.extend( history.__all__ )
+from .history import *
+
+from . import index
+__all__.extend( index.__all__ )
+from .index import *
+
+from . import manifest
+__all__.extend( manifest.__all__ )
+from .manifest import *
+
 from . import dataset
 __all__.extend( dataset.__all__ )
 from .dataset import *
@@ -3,14 +3,20 @@ __all__ = [
 ]
 
 import os
+import json
+import time
+import hashlib
+import tempfile
 
-from typing import List, Dict, Union
+from typing import Dict, Iterator, List, Tuple, Union
 from expand_folders import expand_folders
 from maestro_lightning import symlink
 from maestro_lightning.models import get_context
 from maestro_lightning.exceptions import DatasetExistsError
 
 class Dataset:
+
+    manifest_version = 2
     
     def __init__(self, 
                  name: str,
@@ -104,26 +110,236 @@ class Dataset:
                     linkpath = f"{dirpath}/{filename}"
                     symlink(target, linkpath)
 
-    def __iter__(self) -> List[str]:
+    @property
+    def manifest_path(self) -> Union[str, None]:
+        """
+        The location of the cached manifest, '<flow>/datasets/<name>/.maestro/manifest.json'.
+
+        The manifest is kept in a hidden folder so it is never listed as part
+        of the dataset, and so rewriting it does not move the mtime of the
+        dataset folder itself (output datasets live in '<flow>/datasets/<name>').
+        Returns None when there is no flow directory to keep it in.
+        """
+        ctx = get_context()
+        if not ctx.path or not os.path.isdir(f"{ctx.path}/datasets"):
+            return None
+        return f"{ctx.path}/datasets/{self.name}/.maestro/manifest.json"
+
+    def _scan_folder(self, folder : str) -> Dict:
+        """List a single folder, keeping the size and modification time of each file."""
+        mtime = os.stat(folder).st_mtime_ns
+        entry = {
+            # NOTE: some filesystems (e.g. NFS) keep mtimes with one second resolution, so a
+            # folder changed right now could change again without moving its mtime. Those
+            # folders are stored without mtime to be scanned again on the next validation.
+            "mtime"   : mtime if time.time_ns() - mtime > 2e9 else 0,
+            "files"   : [],
+            "folders" : [],
+        }
+        with os.scandir(folder) as entries:
+            for item in entries:
+                if item.name.startswith('.'):
+                    continue
+                if item.is_dir():
+                    entry["folders"].append(item.name)
+                else:
+                    try:
+                        stat = item.stat()
+                        entry["files"].append([item.name, stat.st_size, stat.st_mtime_ns])
+                    except OSError:
+                        # NOTE: broken symlinks are kept, as expand_folders does
+                        entry["files"].append([item.name, 0, 0])
+        entry["files"].sort()
+        entry["folders"].sort()
+        return entry
+
+    def _read_manifest(self) -> Iterator[Dict]:
+        """Stream the folder records of the cached manifest, if it is valid for this dataset."""
+        if not (self.manifest_path and os.path.exists(self.manifest_path)):
+            return
+        with open(self.manifest_path, 'r') as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != self.manifest_version or header.get("path") != self.path:
+                return
+            for line in f:
+                record = json.loads(line)
+                if "folder" in record:
+                    yield record
+
+    def _read_summary(self) -> Union[Dict, None]:
+        """
+        Read the last line of the cached manifest, with the number of files and
+        the mtime of each folder, if the manifest is valid for this dataset.
+        """
+        if not (self.manifest_path and os.path.exists(self.manifest_path)):
+            return None
+        with open(self.manifest_path, 'rb') as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != self.manifest_version or header.get("path") != self.path:
+                return None
+            size   = f.seek(0, os.SEEK_END)
+            offset = size
+            tail   = b""
+            # NOTE: the file is read backwards, by blocks, up to the start of the last line
+            while offset > 0 and tail.rstrip(b"\n").count(b"\n") == 0:
+                offset = max(0, offset - 65536)
+                f.seek(offset)
+                tail = f.read(size - offset)
+        record = json.loads(tail.rstrip(b"\n").rsplit(b"\n", 1)[-1] or "{}")
+        return record if "count" in record and "folders" in record else None
+
+    def _validate_summary(self) -> Union[Dict, None]:
+        """Return the manifest summary when the mtime of every folder did not move since it was written."""
+        summary = self._read_summary()
+        if summary is None:
+            return None
+        for relpath, mtime in summary["folders"]:
+            try:
+                if not mtime or os.stat(os.path.normpath(f"{self.path}/{relpath}")).st_mtime_ns != mtime:
+                    return None
+            except OSError:
+                return None
+        return summary
+
+    @staticmethod
+    def _hash_folders(folders : List[Tuple[str, int]]) -> str:
+        hasher = hashlib.sha256()
+        for relpath, mtime in folders:
+            hasher.update(f"{relpath}:{mtime};".encode())
+        return hasher.hexdigest()
+
+    def walk(self) -> Iterator[Tuple[str, Dict]]:
+        """
+        Stream the validated folders of the dataset.
+
+        Folders are yielded in a deterministic order without a global sort:
+        each folder is listed and sorted on its own, and its subfolders are
+        visited depth first in name order, so paths come out ordered by their
+        components (files of a folder before its subfolders).
+
+        The manifest in '<flow>/datasets/<name>/.maestro/manifest.json' keeps one
+        line per folder, in this same order, with the folder mtime and the
+        name, size and mtime of its files. While walking, the cached record of
+        each folder is reused if the folder mtime did not move and the folder
+        is listed again otherwise. Since both sequences share the same order,
+        the old manifest is merged lazily and the new one is written as the
+        walk goes; it only replaces the cached file when something changed.
+        Its last line keeps the number of files and the mtime of each folder,
+        so `len` and `stamp` only check the folders while nothing changed.
+
+        Yields:
+            Tuple[str, Dict]: The folder path relative to the dataset path and
+            its record with 'mtime', 'files' and 'folders'.
+        """
+        key = lambda relpath: tuple() if relpath == "." else tuple(relpath.split('/'))
+        old = self._read_manifest()
+        old_record = next(old, None)
+        changed = old_record is None or self._read_summary() is None
+
+        output = None
+        if self.manifest_path:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            output = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(self.manifest_path), delete=False)
+            output.write(json.dumps({"version" : self.manifest_version, "path" : self.path}) + "\n")
+
+        count   = 0
+        folders = []
+        try:
+            pending = ["."]
+            while pending:
+                relpath = pending.pop()
+                folder  = os.path.normpath(f"{self.path}/{relpath}")
+                # NOTE: drop the cached folders which do not exist anymore
+                while old_record and key(old_record["folder"]) < key(relpath):
+                    old_record, changed = next(old, None), True
+                entry = None
+                if old_record and old_record["folder"] == relpath:
+                    if old_record["mtime"] and old_record["mtime"] == os.stat(folder).st_mtime_ns:
+                        entry = old_record
+                    old_record = next(old, None)
+                if entry is None:
+                    entry   = self._scan_folder(folder)
+                    changed = True
+                entry["folder"] = relpath
+                if output:
+                    output.write(json.dumps(entry) + "\n")
+                count += len(entry["files"])
+                folders.append([relpath, entry["mtime"]])
+                pending.extend(os.path.normpath(f"{relpath}/{name}") for name in reversed(entry["folders"]))
+                yield relpath, entry
+            changed = changed or old_record is not None
+
+            self._count = count
+            self._stamp = self._hash_folders(folders) if all( mtime for _, mtime in folders ) else None
+            if output:
+                output.write(json.dumps({"count" : count, "folders" : folders}) + "\n")
+                output.close()
+                if changed:
+                    os.chmod(output.name, 0o664)
+                    os.replace(output.name, self.manifest_path)
+        finally:
+            if output:
+                output.close()
+                if os.path.exists(output.name):
+                    os.remove(output.name)
+
+    def __iter__(self) -> Iterator[str]:
         """ 
-        Retrieve a sorted list of file paths from the specified directory.
+        Stream the file paths of the dataset.
         
-        This method expands the folders in the given path and returns 
-        a sorted list of all files found within those folders.
+        Folders are enumerated through `walk`, so paths are produced as each
+        folder is read, in a deterministic order, and the full list is never
+        kept in memory. Paths that are not folders (e.g. glob patterns) are
+        expanded with expand_folders and sorted.
         
-        Returns:
-            List[str]: A sorted list of file paths.
+        Yields:
+            str: The path of each file in the dataset.
         """
-        self.index = 0
-        self.files = sorted(expand_folders(self.path))
-        return self
-    
-    def __next__(self):
-        if self.index >= len(self.files):
-            raise StopIteration
-        path = self.files[self.index]
-        self.index += 1
-        return path
+        if os.path.isdir(self.path):
+            for relpath, entry in self.walk():
+                folder = os.path.normpath(f"{self.path}/{relpath}")
+                for name, _, _ in entry["files"]:
+                    yield f"{folder}/{name}"
+        else:
+            yield from sorted(expand_folders(self.path))
 
     def __len__(self):
-        return len( expand_folders(self.path) )
\ No newline at end of file
+        if os.path.isdir(self.path):
+            summary = self._validate_summary()
+            if summary is not None:
+                return summary["count"]
+            for _ in self.walk():
+                pass
+            return self._count
+        return len( expand_folders(self.path) )
+
+    def stamp(self, scan : bool=True) -> Union[str, None]:
+        """
+        Compute a cheap signature of the dataset contents.
+
+        The signature is built from the modification time of every folder in
+        the validated manifest, which changes whenever a file is added, removed
+        or renamed inside it. While no folder moved, it is computed from the
+        manifest summary without reading the file records.
+
+        Parameters:
+        ----------
+        scan : bool
+            Walk the dataset when the manifest summary is not valid anymore.
+            Otherwise None is returned in this case.
+
+        Returns:
+            Union[str, None]: The signature or None if the dataset path is not
+            a directory (e.g. a glob pattern or a single file) or if a folder
+            changed too recently for its modification time to be trusted.
+        """
+        if not os.path.isdir(self.path):
+            return None
+        summary = self._validate_summary()
+        if summary is not None:
+            return self._hash_folders(summary["folders"])
+        if not scan:
+            return None
+        for _ in self.walk():
+            pass
+        return self._stamp
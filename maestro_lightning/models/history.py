@@ -0,0 +1,92 @@
+__all__ = ["History", "get_history"]
+
+import os
+import json
+
+from typing import Dict, Iterable, List
+from filelock import FileLock
+
+
+class History:
+    """
+    Append-only log with one record per finished attempt of each job.
+
+    The status table only keeps the last attempt of a job, so the job runner
+    also appends here what each attempt asked for and how it ended (status,
+    failure reason, exit code, requested memory and time). Retries read it
+    back to escalate the resources of the next attempt.
+    """
+
+    def __init__(self, path : str):
+        """
+        Initializes the history.
+
+        Parameters:
+        ----------
+        path : str
+            The file path of the log. The file is created on the first append.
+        """
+        self.path      = path
+        self.lock_path = f"{path}.lock"
+
+    def append(self, record : Dict):
+        """Append the record of a finished attempt. It must hold a 'job_id' key."""
+        line = json.dumps(record) + "\n"
+        with FileLock(self.lock_path):
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def read(self, job_id : int=None) -> List[Dict]:
+        """
+        Read the attempts, oldest first.
+
+        Parameters:
+        ----------
+        job_id : int
+            Only return the attempts of this job. Defaults to all jobs.
+
+        Returns:
+            List[Dict]: The attempt records.
+        """
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # NOTE: a writer killed in the middle of a line leaves a partial record
+                    continue
+                if job_id is None or record["job_id"] == job_id:
+                    records.append(record)
+        return records
+
+    def by_job(self, job_ids : Iterable[int]) -> Dict[int, List[Dict]]:
+        """
+        Read the attempts of several jobs in a single pass over the log.
+
+        Returns:
+            Dict[int, List[Dict]]: The attempt records of each job, oldest first.
+        """
+        attempts = { job_id : [] for job_id in job_ids }
+        for record in self.read():
+            if record["job_id"] in attempts:
+                attempts[record["job_id"]].append(record)
+        return attempts
+
+    def clear(self):
+        """Remove the log from disk."""
+        with FileLock(self.lock_path):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+__histories__ = {}
+
+def get_history(task_path : str) -> History:
+    """Return the attempt history of the task located at task_path, cached per process."""
+    global __histories__
+    if task_path not in __histories__:
+        __histories__[task_path] = History(f"{task_path}/jobs/history.jsonl")
+    return __histories__[task_path]
@@ -4,8 +4,9 @@ __all__ = [
 
 import os
 
-from typing import Dict
+from typing import Dict, Union
 from maestro_lightning import symlink
+from maestro_lightning.storage.digest import get_digest_service
 from maestro_lightning.models import get_context
 from maestro_lightning.exceptions import ImageExistsError
 
@@ -55,7 +56,51 @@ class Image:
         image_name = self.path.split('/')[-1]
         linkpath = f"{dirpath}/{image_name}"
         symlink(self.path, linkpath)
-    
+
+    def digest_path(self, basepath : str) -> str:
+        """The file keeping the sha256 digest of the image inside the flow at basepath."""
+        return f"{basepath}/images/{self.name}/{self.path.split('/')[-1]}.sha256"
+
+    def digest(self, basepath : str) -> Union[str, None]:
+        """
+        Read the digest written by prestage.
+
+        Returns:
+            Union[str, None]: The digest, or None if missing or older than the image file.
+        """
+        path = self.digest_path(basepath)
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(self.path):
+            return None
+        with open(path, 'r') as f:
+            return f.read().strip()
+
+    def prestage(self, basepath : str) -> str:
+        """
+        Hash the image once, before its jobs start.
+
+        Jobs staging the image into a node-local cache check their copy
+        against this digest, so a copy of an image changed or corrupted
+        after the task was initialized is never used.
+
+        Parameters:
+        ----------
+        basepath : str
+            The flow folder.
+
+        Returns:
+            str: The sha256 digest of the image.
+        """
+        digest = self.digest(basepath)
+        if digest is None:
+            digest = get_digest_service().digest(self.path)
+            path = self.digest_path(basepath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # NOTE: several jobs may hash the image at once, so the file is replaced atomically
+            with open(f"{path}.{os.getpid()}", 'w') as f:
+                f.write(digest + "\n")
+            os.replace(f"{path}.{os.getpid()}", path)
+        return digest
+
 
     def to_dict(self) -> Dict:
         """
@@ -0,0 +1,119 @@
+__all__ = ["JobIndex"]
+
+import os
+
+from typing import List, Union
+from filelock import FileLock
+
+
+class JobIndex:
+    """
+    Persistent mapping between input files and job ids of a task.
+
+    The index is stored as a plain text file (``jobs/index``) with one input
+    path per line, where the line number is the job id. New inputs are only
+    ever appended, so the id of a job never changes when files are added to
+    the dataset out of sort order. The file is loaded once into a hash map.
+
+    Next to it, ``jobs/index.hwm`` keeps the high-water mark of the last scan:
+    the stamp of the input dataset at that time. While the dataset stamp does
+    not change there is nothing new to be indexed and the scan is skipped.
+
+    Both files are written under ``lock``, which is reentrant, so new job ids
+    can be allocated and appended as a single step (see `refresh`).
+    """
+
+    def __init__(self, path : str):
+        """
+        Initializes the job index.
+
+        Parameters:
+        ----------
+        path : str
+            The file path of the index. The file is created on the first append.
+        """
+        self.path      = path
+        self.hwm_path  = f"{path}.hwm"
+        self.lock_path = f"{path}.lock"
+        self.lock      = FileLock(self.lock_path)
+        self.paths     = []
+        self.ids       = {}
+        self.offset    = 0
+        self.refresh()
+
+    def refresh(self):
+        """Read the paths appended to the index, by any process, since it was last read."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # NOTE: a line still being written is read next time
+                    break
+                self.offset += len(line)
+                self._insert(line.decode().rstrip('\n'))
+
+    def _insert(self, path : str) -> int:
+        job_id = len(self.paths)
+        self.paths.append(path)
+        self.ids[path] = job_id
+        return job_id
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path : str) -> bool:
+        return path in self.ids
+
+    def get(self, path : str) -> Union[int, None]:
+        return self.ids.get(path)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def add(self, paths : List[str]) -> List[int]:
+        """
+        Append new input paths to the index.
+
+        Parameters:
+        ----------
+        paths : List[str]
+            The input paths, in the order their job ids must be assigned.
+
+        Returns:
+            List[int]: The job id assigned to each path.
+        """
+        if not paths:
+            return []
+        with self.lock:
+            self.refresh()
+            job_ids = [self._insert(path) for path in paths]
+            data    = "".join(f"{path}\n" for path in paths).encode()
+            with open(self.path, 'ab') as f:
+                f.write(data)
+            self.offset += len(data)
+        return job_ids
+
+    @property
+    def hwm(self) -> Union[str, None]:
+        if not os.path.exists(self.hwm_path):
+            return None
+        with open(self.hwm_path, 'r') as f:
+            return f.read().strip() or None
+
+    @hwm.setter
+    def hwm(self, stamp : Union[str, None]):
+        with self.lock:
+            with open(self.hwm_path, 'w') as f:
+                f.write(stamp or "")
+
+    def clear(self):
+        """Remove the index and its high-water mark from disk."""
+        with self.lock:
+            for path in [self.path, self.hwm_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.paths  = []
+        self.ids    = {}
+        self.offset = 0
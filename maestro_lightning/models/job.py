@@ -1,19 +1,33 @@
 __all__ = [
     "Job",
+    "JobTable",
     "Status",
     "State",
 ]
 
 import os
 import json
+import hashlib
+import numpy as np
 
-from pprint import pprint
-from typing import Dict, Tuple
-from filelock import FileLock
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple, Union
 from maestro_lightning.models import get_context
-from maestro_lightning.models.status import State, Status
+from maestro_lightning.models.status import State, Status, Reason
+from maestro_lightning.models.table import get_status_table, state_codes
+from maestro_lightning.models.metrics import get_metrics_table
+from maestro_lightning.models.history import get_history
+from maestro_lightning.models.manifest import JobManifest, get_job_manifest
 from maestro_lightning.models.dataset import Dataset
 from maestro_lightning.models.image import Image
+from maestro_lightning.storage.results import ResultCache
+from maestro_lightning.storage.digest import path_digest
+
+
+# NOTE: the digest of the fields shared by the jobs of a task, computed once per process
+__result_digests__ = {}
 
 
 class Job:
@@ -62,7 +76,7 @@ class Job:
             self.command = command
             self.binds = binds
             self.envs = envs
-            self.job_status_path = f"{self.task_path}/jobs/status/job_{self.job_id}"
+            self.table = get_status_table(self.task_path)
 
         
     def to_dict(self) -> Dict:
@@ -107,21 +121,20 @@ class Job:
     def from_dict(cls, data: Dict):
         
         ctx = get_context()
-        outputs = data["outputs"]
-        for key, (_, dataset) in outputs.items():
+        # NOTE: data is not modified in place, since it may be shared by several jobs
+        outputs = {}
+        for key, (filename, dataset) in data["outputs"].items():
             if dataset["name"] not in ctx.datasets:
-                dataset = Dataset.from_dict( dataset )
-                outputs[key][1]=dataset
+                outputs[key] = [filename, Dataset.from_dict( dataset )]
             else:
-                outputs[key][1]=ctx.datasets[ outputs[key][1]["name"] ]
+                outputs[key] = [filename, ctx.datasets[ dataset["name"] ]]
                 
-        secondary_data = data["secondary_data"]
-        for key in secondary_data.keys():
-            if secondary_data[key]["name"] not in ctx.datasets:
-                dataset = Dataset.from_dict( secondary_data[key] )
-                secondary_data[key]=dataset
+        secondary_data = {}
+        for key, dataset in data["secondary_data"].items():
+            if dataset["name"] not in ctx.datasets:
+                secondary_data[key] = Dataset.from_dict( dataset )
             else:
-                secondary_data[key]=ctx.datasets[ secondary_data[key]["name"] ]
+                secondary_data[key] = ctx.datasets[ dataset["name"] ]
         
         image = data["image"]
         if image:
@@ -142,74 +155,302 @@ class Job:
             envs           = data["envs"],
         )
              
-    def dump(self):
+    def dump(self, with_status : bool=True):
             """
-            Dumps the job's data to JSON files.
-            This method creates two JSON files:
+            Dumps the job's data into the task files.
+            This method writes the job into two places:
             
-            1. A file containing the job's input data, saved at 
-                'jobs/inputs/job_{job_id}.json'.
-            2. A file containing the job's status, saved at 
-                'jobs/status/job_{job_id}.json'.
+            1. A record in the task job manifest, saved at 'jobs/manifest'.
+            2. The job's status record, written into the task status table
+                at 'jobs/status.table'.
             
             The job's input data is obtained by calling the `to_dict` method,
             while the status is represented by an instance of the `Status` class
-            initialized with the `ASSIGNED` status.
+            initialized with the `ASSIGNED` status. Callers creating many jobs
+            at once should use `JobManifest.append` and `StatusTable.extend`
+            instead, which write all records in a single call.
             Note: Ensure that the directories exist before calling this method.
             """
-            with open( f"{self.task_path}/jobs/inputs/job_{self.job_id}.json", 'w') as f:
-                    pprint(self.to_dict())
-                    json.dump( self.to_dict() , f , indent=2)
-            with open( f"{self.job_status_path}.json", 'w') as f:
-                    json.dump(Status(State.ASSIGNED).to_dict(), f, indent=2)
+            get_job_manifest(self.task_path).append([self.to_dict()])
+            if with_status:
+                self.table.set(self.job_id, Status(State.ASSIGNED))
     
+    @classmethod
+    def from_manifest(cls, path : str, job_id : int) -> 'Job':
+        """
+        Load a single job from a task job manifest, seeking to its record.
+
+        Parameters:
+            path (str): The path of the manifest ('<task>/jobs/manifest').
+            job_id (int): The id of the job to be loaded.
+
+        Returns:
+            Job: The job instance.
+        """
+        raw = JobManifest(path).read(job_id)
+        if raw is None:
+            raise ValueError(f"job {job_id} not found in manifest {path}.")
+        return cls.from_dict(raw)
 
     @property 
     def status(self) -> State:
-        
-        if os.path.exists( f"{self.job_status_path}.json" ):
-            with FileLock( f"{self.job_status_path}.json.lock" ):
-                with open( f"{self.job_status_path}.json", 'r') as f:
-                    data = json.load(f)
-                    return Status.from_dict(data).status
-        else:
-            return State.UNKNOWN
+        status = self.table.get(self.job_id)
+        return status.status if status else State.UNKNOWN
     
     @status.setter
     def status(self, new_status: State):
-        status = Status(new_status)
-        with FileLock( f"{self.job_status_path}.json.lock" ):
-            with open( f"{self.job_status_path}.json", 'r') as f:
-                data = json.load(f)
-                status = Status.from_dict(data)
-            status.status=new_status
-            with open( f"{self.job_status_path}.json", 'w') as f:
-                json.dump( status.to_dict() , f , indent=2)
+        self.table.update(self.job_id, status=new_status)
      
                    
+    @property
+    def metrics(self) -> Union[Dict[str, float], None]:
+        return get_metrics_table(self.task_path).get(self.job_id)
+
+    @metrics.setter
+    def metrics(self, metrics : Dict[str, float]):
+        get_metrics_table(self.task_path).set(self.job_id, metrics)
+
+    @property
+    def history(self) -> List[Dict]:
+        """The records of the finished attempts of this job, oldest first."""
+        return get_history(self.task_path).read(self.job_id)
+
+    @property
+    def attempt(self) -> int:
+        status = self.table.get(self.job_id)
+        return status.attempt if status else 0
+
+    def fail(self, reason : Reason, exit_code : int=1):
+        """Mark the job as FAILED, recording why it failed."""
+        self.table.update(self.job_id, status=State.FAILED, reason=reason, exit_code=exit_code)
+
     def ping(self):
-        if os.path.exists( f"{self.job_status_path}.json" ):
-            with FileLock( f"{self.job_status_path}.json.lock" ):
-                with open( f"{self.job_status_path}.json", 'r') as f:
-                    status = Status.from_dict(json.load(f))
-                    status.ping()
-                with open( f"{self.job_status_path}.json", 'w') as f:
-                    json.dump(status.to_dict(), f, indent=2)
+        self.table.touch(self.job_id)
+
+    def output_files(self) -> Dict[str, str]:
+        """Return the storage path of each output of the job, by output name."""
+        files = {}
+        for key, (filename, dataset) in self.outputs.items():
+            filename, extension = os.path.splitext(filename)
+            files[key] = f"{dataset.path}/{filename}.{self.job_id}{extension}"
+        return files
+
+    def result_key(self, basepath : str) -> Union[str, None]:
+        """
+        Digest everything the outputs of the job depend on: the command template,
+        the output names, the image content, the binds, the environment and the
+        content of the input file and of the secondary data.
+
+        Parameters:
+        ----------
+        basepath : str
+            The flow folder, which keeps the digest of the image.
+
+        Returns:
+            Union[str, None]: The key or None if the input file does not exist yet.
+        """
+        if not os.path.exists(self.input_file):
+            return None
+        data = {
+            "command"        : self.command,
+            "outputs"        : sorted(self.outputs.keys()),
+            "image"          : self.image.path if self.image else None,
+            "secondary_data" : { key : value.path for key, value in self.secondary_data.items() },
+            "binds"          : self.binds,
+            "envs"           : self.envs,
+        }
+        fields = json.dumps(data, sort_keys=True)
+        if fields not in __result_digests__:
+            data["image"]          = self.image.prestage(basepath) if self.image else None
+            data["secondary_data"] = { key : path_digest(value.path) for key, value in self.secondary_data.items() }
+            __result_digests__[fields] = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        return hashlib.sha256(f"{__result_digests__[fields]}:{path_digest(self.input_file)}".encode()).hexdigest()
+
+    def reuse(self, cache : ResultCache, basepath : str) -> Union[Dict, None]:
+        """
+        Complete the job with the outputs of an identical job found in the result cache.
+
+        Returns:
+            Union[Dict, None]: The cache entry or None on a miss.
+        """
+        key  = self.result_key(basepath)
+        meta = cache.get(key) if key else None
+        if meta is None or set(meta["outputs"]) != set(self.outputs.keys()):
+            return None
+        try:
+            cache.restore(meta, self.output_files())
+        except Exception:
+            # NOTE: the entry may be evicted while its files are linked
+            return None
+        self.status = State.COMPLETED
+        get_history(self.task_path).append({
+            "job_id"    : self.job_id,
+            "attempt"   : self.attempt,
+            "status"    : State.COMPLETED.value,
+            "reason"    : Reason.NONE.value,
+            "exit_code" : 0,
+            "end_time"  : datetime.now().isoformat(),
+            "cached"    : True,
+            "cpu_hours" : meta["cpu_hours"],
+        })
+        return meta
+
+    def store(self, cache : ResultCache, basepath : str, cpu_hours : float=0) -> bool:
+        """Store the outputs of the completed job in the result cache."""
+        key = self.result_key(basepath)
+        return cache.put(key, self.output_files(), cpu_hours) if key else False
                     
     def is_alive(self) -> bool:
-        if os.path.exists( f"{self.job_status_path}.json" ):
-            with FileLock( f"{self.job_status_path}.json.lock" ):
-                with open( f"{self.job_status_path}.json", 'r') as f:
-                    status = Status.from_dict(json.load(f))
-                    return status.is_alive()
-        else:
-            return False
+        status = self.table.get(self.job_id)
+        return status.is_alive() if status else False
         
     def reset(self):
-        if os.path.exists( f"{self.job_status_path}.json" ):
-            with FileLock( f"{self.job_status_path}.json.lock" ):
-                with open( f"{self.job_status_path}.json", 'r') as f:
-                    status = Status.from_dict(json.load(f))
-                    status.reset()
-                with open( f"{self.job_status_path}.json", 'w') as f:
-                    json.dump(status.to_dict(), f, indent=2)
\ No newline at end of file
+        status = self.table.get(self.job_id)
+        if status:
+            status.reset()
+            self.table.set(self.job_id, status)
+
+
+
+class JobTable:
+    """
+    Compact, array-backed collection of the jobs of a task.
+
+    Instead of one Job object per job, with its own copies of the outputs,
+    secondary data, binds and envs, the table keeps:
+
+    - the fields shared by all jobs of the task, stored once;
+    - the job ids, in an integer array;
+    - the input paths, split into an interned folder table (one integer per
+      job) and the file names packed into a single byte buffer with offsets.
+
+    Job states are not copied: they are read as a vectorized column from the
+    task status table. Job objects are lightweight views created on access.
+    """
+
+    def __init__(self, 
+                 task_path      : str,
+                 outputs        : Dict[str, Tuple[str, Dataset]],
+                 secondary_data : Dict[str, Dataset],
+                 image          : Image,
+                 command        : str,
+                 binds          : Dict[str, str]={},
+                 envs           : Dict[str, str]={},
+        ):
+        """
+        Initializes an empty job table with the fields shared by all jobs.
+
+        Parameters:
+        ----------
+        task_path : str
+            The path to the task associated with the jobs.
+        outputs, secondary_data, image, command, binds, envs :
+            The fields shared by all jobs, as in `Job`.
+        """
+        self.task_path      = task_path
+        self.outputs        = outputs
+        self.secondary_data = secondary_data
+        self.image          = image
+        self.command        = command
+        self.binds          = binds
+        self.envs           = envs
+        self._ids           = array('Q')
+        self._folders       = []
+        self._folder_ids    = {}
+        self._folder        = array('I')
+        self._names         = bytearray()
+        self._offsets       = array('Q', [0])
+        # NOTE: jobs whose fields differ from the shared ones (e.g. hand edited) are kept apart
+        self._overrides     = {}
+
+    @classmethod
+    def from_manifest(cls, manifest : 'JobManifest') -> 'JobTable':
+        """
+        Build the table from a task job manifest in a single pass.
+
+        The manifest header is resolved into datasets and images only once.
+        """
+        if not manifest.exists():
+            return None
+        header = manifest.header
+        shared = Job.from_dict(dict(header, job_id=-1, input_file=""))
+        table  = cls(task_path      = shared.task_path,
+                     outputs        = shared.outputs,
+                     secondary_data = shared.secondary_data,
+                     image          = shared.image,
+                     command        = shared.command,
+                     binds          = shared.binds,
+                     envs           = shared.envs)
+        for record in manifest.records():
+            table.append(record["job_id"], record["input_file"])
+            if len(record) > 2:
+                table._overrides[record["job_id"]] = dict(header, **record)
+        return table
+
+    def append(self, job_id : int, input_file : str):
+        """Add a job to the table. Jobs must be appended in increasing job id order."""
+        folder, name = os.path.split(input_file)
+        if folder not in self._folder_ids:
+            self._folder_ids[folder] = len(self._folders)
+            self._folders.append(folder)
+        self._ids.append(job_id)
+        self._folder.append(self._folder_ids[folder])
+        self._names.extend(name.encode())
+        self._offsets.append(len(self._names))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _position(self, job_id : int) -> int:
+        pos = job_id if job_id < len(self._ids) and self._ids[job_id] == job_id else bisect_left(self._ids, job_id)
+        if pos >= len(self._ids) or self._ids[pos] != job_id:
+            raise KeyError(f"job {job_id} not found in task {self.task_path}.")
+        return pos
+
+    def input_file(self, job_id : int) -> str:
+        pos  = self._position(job_id)
+        name = self._names[self._offsets[pos]:self._offsets[pos+1]].decode()
+        return os.path.join(self._folders[self._folder[pos]], name)
+
+    def __getitem__(self, job_id : int) -> Job:
+        """Create a Job view for job_id, sharing the task-level fields."""
+        if job_id in self._overrides:
+            return Job.from_dict(self._overrides[job_id])
+        return Job(task_path      = self.task_path,
+                   job_id         = job_id,
+                   input_file     = self.input_file(job_id),
+                   outputs        = self.outputs,
+                   secondary_data = self.secondary_data,
+                   image          = self.image,
+                   command        = self.command,
+                   binds          = self.binds,
+                   envs           = self.envs)
+
+    def __iter__(self) -> Iterator[Job]:
+        for job_id in self._ids:
+            yield self[job_id]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return np.frombuffer(self._ids, dtype=np.uint64).astype(np.int64) if len(self._ids) else np.zeros(0, dtype=np.int64)
+
+    def codes(self) -> np.ndarray:
+        """Return the state code of each job of the table, aligned with `ids`."""
+        codes = get_status_table(self.task_path).codes()
+        ids   = self.ids
+        out   = np.zeros(len(ids), dtype=np.uint8)
+        valid = ids < len(codes)
+        out[valid] = codes[ids[valid]]
+        return out
+
+    def filter(self, states : Union[State, List[State]]) -> List[int]:
+        """Return the ids of the jobs in any of the given states."""
+        states = states if type(states) == list else [states]
+        mask = np.isin(self.codes(), [state_codes.index(state) for state in states])
+        return self.ids[mask].tolist()
+
+    def count(self) -> Dict[State, int]:
+        """Count the jobs in each state with a single vectorized pass."""
+        counts = np.bincount(self.codes(), minlength=len(state_codes))
+        return { state : int(counts[code]) for code, state in enumerate(state_codes) }
+
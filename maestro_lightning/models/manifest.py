@@ -0,0 +1,176 @@
+__all__ = ["JobManifest", "get_job_manifest"]
+
+import os
+import json
+import struct
+
+from typing import Dict, Iterator, List, Union
+from concurrent.futures import ThreadPoolExecutor
+from filelock import FileLock
+from loguru import logger
+
+
+class JobManifest:
+    """
+    Single per-task file holding the description of every job.
+
+    The manifest (``jobs/manifest``) is a JSON lines file. The first line is a
+    header with the fields shared by all jobs of the task (command, image,
+    binds, envs, outputs and secondary data) and each following line is a job
+    record with only the fields that differ from the header (at least the job
+    id and the input file). A fixed-width offset index (``jobs/manifest.idx``)
+    stores the byte offset of the record of each job id, so a single job can be
+    read by seeking instead of parsing the whole manifest.
+    """
+    offset = struct.Struct("<Q")
+
+    def __init__(self, path : str):
+        """
+        Initializes the job manifest.
+
+        Parameters:
+        ----------
+        path : str
+            The file path of the manifest. The offset index is kept at '<path>.idx'.
+        """
+        self.path      = path
+        self.idx_path  = f"{path}.idx"
+        self.lock_path = f"{path}.lock"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.idx_path):
+            return 0
+        return os.path.getsize(self.idx_path) // self.offset.size
+
+    @property
+    def header(self) -> Dict:
+        with open(self.path, 'r') as f:
+            return json.loads(f.readline())
+
+    def append(self, raws : List[Dict]):
+        """
+        Append job records to the manifest.
+
+        Parameters:
+        ----------
+        raws : List[Dict]
+            The jobs, as returned by `Job.to_dict`. The header is created from
+            the first job when the manifest does not exist yet.
+        """
+        if not raws:
+            return
+        # NOTE: normalize tuples into lists, as they are read back from the header
+        raws = json.loads(json.dumps(raws))
+        with FileLock(self.lock_path):
+            if not os.path.exists(self.path):
+                header = { key : value for key, value in raws[0].items() if key not in ["job_id", "input_file"] }
+                with open(self.path, 'w') as f:
+                    f.write(json.dumps(header) + "\n")
+            header = self.header
+            offsets = {}
+            with open(self.path, 'ab') as f:
+                for raw in raws:
+                    record = { key : value for key, value in raw.items() if header.get(key, None) != value }
+                    offsets[raw["job_id"]] = f.tell()
+                    f.write((json.dumps(record) + "\n").encode())
+            # NOTE: offsets are only published after the records are on disk
+            fd = os.open(self.idx_path, os.O_RDWR | os.O_CREAT, 0o664)
+            try:
+                for job_id, offset in offsets.items():
+                    os.pwrite(fd, self.offset.pack(offset), job_id * self.offset.size)
+            finally:
+                os.close(fd)
+
+    def read(self, job_id : int) -> Union[Dict, None]:
+        """
+        Read a single job by seeking to its record.
+
+        Returns:
+            Union[Dict, None]: The job in the `Job.to_dict` format or None if the
+            job is not in the manifest.
+        """
+        if job_id >= len(self):
+            return None
+        with open(self.idx_path, 'rb') as f:
+            offset, = self.offset.unpack(os.pread(f.fileno(), self.offset.size, job_id * self.offset.size))
+        if offset == 0:
+            return None
+        with open(self.path, 'rb') as f:
+            header = json.loads(f.readline())
+            f.seek(offset)
+            header.update(json.loads(f.readline()))
+        return header
+
+    def records(self) -> Iterator[Dict]:
+        """Stream the raw job records of the manifest, without merging the header."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            f.readline()
+            for line in f:
+                yield json.loads(line)
+
+    def scan(self) -> Iterator[Dict]:
+        """Stream all jobs of the manifest, in the `Job.to_dict` format."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            header = json.loads(f.readline())
+            for line in f:
+                raw = dict(header)
+                raw.update(json.loads(line))
+                yield raw
+
+    def migrate(self, inputs_dir : str) -> int:
+        """
+        One-shot import of the legacy ``jobs/inputs/job_N.json`` files.
+
+        The legacy files are left in place so they can still be given to
+        'maestro run job'.
+
+        Returns:
+            int: The number of imported jobs.
+        """
+        paths = [ entry.path for entry in os.scandir(inputs_dir) if entry.name.startswith("job_") and entry.name.endswith(".json") ]
+        if not paths:
+            return 0
+
+        def parse( path : str ) -> Dict:
+            with open( path, 'r' ) as f:
+                return json.load(f)
+
+        # NOTE: reading many small files from a shared filesystem is latency bound
+        with ThreadPoolExecutor( max_workers=min(32, len(paths)) ) as pool:
+            raws = list( pool.map( parse, paths ) )
+        self.append(sorted(raws, key=lambda raw: raw["job_id"]))
+        logger.info(f"imported {len(raws)} job files from {inputs_dir} into {self.path}.")
+        return len(raws)
+
+    def clear(self):
+        """Remove the manifest and its offset index from disk."""
+        with FileLock(self.lock_path):
+            for path in [self.path, self.idx_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+__manifests__ = {}
+
+def get_job_manifest(task_path : str) -> JobManifest:
+    """
+    Return the job manifest of the task located at task_path.
+
+    Manifests are cached per process. The first time a task without manifest
+    is opened, any legacy per-job input file is imported into the manifest.
+    """
+    global __manifests__
+    if task_path not in __manifests__:
+        manifest = JobManifest(f"{task_path}/jobs/manifest")
+        inputs_dir = f"{task_path}/jobs/inputs"
+        if not manifest.exists() and os.path.isdir(inputs_dir) and os.listdir(inputs_dir):
+            manifest.migrate(inputs_dir)
+        __manifests__[task_path] = manifest
+    return __manifests__[task_path]
@@ -0,0 +1,110 @@
+__all__ = ["MetricsTable", "get_metrics_table", "metric_names"]
+
+import os
+import struct
+import numpy as np
+
+from typing import Dict, Union
+from filelock import FileLock
+
+
+#
+# NOTE: the fields of each record, in order. They match the keys of the
+# metrics returned by the process monitor plus the number of cpus allocated
+# to the job, which is needed to compute its cpu efficiency.
+#
+metric_names = ["exec_time",
+                "cpu_time",
+                "cpu_percent_avg",
+                "cpu_percent_peak",
+                "sys_memory_mb_avg",
+                "sys_memory_mb_peak",
+                "gpu_memory_mb_avg",
+                "gpu_memory_mb_peak",
+                "io_read_mb",
+                "io_write_mb",
+                "cpus"]
+
+
+class MetricsTable:
+    """
+    Fixed-width table with the final resource metrics of each job.
+
+    The table lives next to the status table (``jobs/metrics.table``) and
+    follows the same layout: record ``job_id`` is stored at
+    ``job_id * record.size``, so each job runner writes its own record in
+    place and reports read the whole task as numpy columns. The first byte of
+    a record tells whether it was written, since tables grow with zeros.
+    """
+    record = struct.Struct("<B7x" + "d" * len(metric_names))
+
+    def __init__(self, path : str):
+        """
+        Initializes the metrics table.
+
+        Parameters:
+        ----------
+        path : str
+            The file path of the table. The file is created on the first write.
+        """
+        self.path      = path
+        self.lock_path = f"{path}.lock"
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.record.size
+
+    def set(self, job_id : int, metrics : Dict[str, float]):
+        """Write the metrics of a single job. Missing metrics are stored as zero."""
+        raw = self.record.pack(1, *[float(metrics.get(name, 0) or 0) for name in metric_names])
+        with FileLock(self.lock_path):
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664)
+            try:
+                os.pwrite(fd, raw, job_id * self.record.size)
+            finally:
+                os.close(fd)
+
+    def get(self, job_id : int) -> Union[Dict[str, float], None]:
+        """
+        Read the metrics of a single job.
+
+        Returns:
+            Union[Dict[str, float], None]: The metrics or None if the job has no record.
+        """
+        if job_id >= len(self):
+            return None
+        with open(self.path, 'rb') as f:
+            valid, *values = self.record.unpack(os.pread(f.fileno(), self.record.size, job_id * self.record.size))
+        return dict(zip(metric_names, values)) if valid else None
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        Read every written record as numpy columns.
+
+        Returns:
+            Dict[str, np.ndarray]: One array per metric plus 'job_id', aligned
+            and restricted to the jobs with a record.
+        """
+        dtype = np.dtype([("valid", np.uint8), ("pad", np.uint8, 7)] + [(name, np.float64) for name in metric_names])
+        data  = np.fromfile(self.path, dtype=dtype, count=len(self)) if len(self) else np.zeros(0, dtype=dtype)
+        mask  = data["valid"] == 1
+        columns = { name : data[name][mask] for name in metric_names }
+        columns["job_id"] = np.flatnonzero(mask)
+        return columns
+
+    def clear(self):
+        """Remove the table from disk."""
+        with FileLock(self.lock_path):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+__tables__ = {}
+
+def get_metrics_table(task_path : str) -> MetricsTable:
+    """Return the metrics table of the task located at task_path, cached per process."""
+    global __tables__
+    if task_path not in __tables__:
+        __tables__[task_path] = MetricsTable(f"{task_path}/jobs/metrics.table")
+    return __tables__[task_path]
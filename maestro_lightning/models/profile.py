@@ -0,0 +1,131 @@
+__all__ = ["Profile", "get_profile_store"]
+
+import os
+import json
+import math
+import numpy as np
+
+from typing import Dict, Union
+from filelock import FileLock
+from maestro_lightning.models.metrics import MetricsTable
+
+
+class Profile:
+    """
+    Resource profile of the jobs of a task, learned from their metrics.
+
+    The profile keeps the largest peak memory, the number of cpus actually
+    used (the average parallelism, cpu time over runtime) and the longest
+    runtime seen among the measured jobs. It is turned into SLURM requests
+    with some headroom, instead of asking for exclusive nodes.
+    """
+
+    def __init__(self,
+                 mem_mb  : float,
+                 cpus    : int,
+                 time_s  : float,
+                 samples : int,
+        ):
+        """
+        Initializes the profile.
+
+        Parameters:
+        ----------
+        mem_mb : float
+            The peak resident memory of a job, in MB.
+        cpus : int
+            The number of cpus used by a job.
+        time_s : float
+            The runtime of a job, in seconds.
+        samples : int
+            The number of jobs the profile was learned from.
+        """
+        self.mem_mb  = mem_mb
+        self.cpus    = cpus
+        self.time_s  = time_s
+        self.samples = samples
+
+    def to_dict(self) -> Dict:
+        return {
+            "mem_mb"  : self.mem_mb,
+            "cpus"    : self.cpus,
+            "time_s"  : self.time_s,
+            "samples" : self.samples,
+        }
+
+    @classmethod
+    def from_dict(cls, data : Dict) -> 'Profile':
+        return cls(
+            mem_mb  = data["mem_mb"],
+            cpus    = data["cpus"],
+            time_s  = data["time_s"],
+            samples = data["samples"],
+        )
+
+    @classmethod
+    def learn(cls, metrics : MetricsTable) -> Union['Profile', None]:
+        """
+        Learn the profile from the metrics of the jobs which already ran.
+
+        Returns:
+            Union[Profile, None]: The profile or None if no job has metrics.
+        """
+        columns = metrics.columns()
+        if len(columns["job_id"]) == 0:
+            return None
+        runtime = np.maximum(columns["exec_time"], 1e-3)
+        return cls(
+            mem_mb  = float(columns["sys_memory_mb_peak"].max()),
+            cpus    = max(1, math.ceil(float((columns["cpu_time"] / runtime).max()))),
+            time_s  = float(runtime.max()),
+            samples = len(runtime),
+        )
+
+    def slurm_opts(self, headroom : float=1.5) -> Dict[str, str]:
+        """
+        Build the SLURM requests for a job of this profile.
+
+        Parameters:
+        ----------
+        headroom : float
+            The factor applied to the measured memory and runtime.
+
+        Returns:
+            Dict[str, str]: The MEM, CPUS_PER_TASK and TIME options.
+        """
+        return {
+            "MEM"           : f"{max(1, math.ceil(self.mem_mb * headroom))}M",
+            "CPUS_PER_TASK" : str(self.cpus),
+            "TIME"          : str(max(1, math.ceil(self.time_s * headroom / 60))),
+        }
+
+
+class ProfileStore:
+    """
+    Directory of learned profiles shared between flows.
+
+    Profiles are kept in one JSON file per task fingerprint, so a task running
+    the same command with the same image and secondary data in a later flow
+    starts from what was learned before. The location is given by the
+    MAESTRO_PROFILES environment variable (default '~/.maestro/profiles').
+    """
+
+    def __init__(self, path : str):
+        self.path = path
+
+    def get(self, key : str) -> Union[Profile, None]:
+        path = f"{self.path}/{key}.json"
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return Profile.from_dict(json.load(f))
+
+    def put(self, key : str, profile : Profile):
+        os.makedirs(self.path, exist_ok=True)
+        with FileLock(f"{self.path}/{key}.json.lock"):
+            with open(f"{self.path}/{key}.json", 'w') as f:
+                json.dump(profile.to_dict(), f, indent=2)
+
+
+def get_profile_store() -> ProfileStore:
+    return ProfileStore(os.environ.get("MAESTRO_PROFILES", os.path.expanduser("~/.maestro/profiles")))
@@ -1,4 +1,4 @@
-__all__ = ["State", "Status", "job_status"]
+__all__ = ["State", "Reason", "Status", "job_status", "retryable"]
 
 from enum import Enum
 from typing import Dict
@@ -13,6 +13,21 @@ class State(Enum):
     COMPLETED= "completed"
     FAILED   = "failed"
     FINALIZED= "finalized"
+    CANCELED = "canceled"
+
+
+class Reason(Enum):
+    NONE     = ""
+    EXIT     = "exit"       # the command exited with a non-zero code
+    SIGNAL   = "signal"     # killed by a signal (e.g. preemption, node failure, scancel)
+    OOM      = "oom"        # killed by the memory limit
+    TIMEOUT  = "timeout"    # killed by the time limit
+    LOST     = "lost"       # stopped sending heartbeats (e.g. the node died)
+    TRANSFER = "transfer"   # the outputs could not be copied out and verified
+
+
+# NOTE: failures which may succeed on a new attempt, with more resources when needed
+retryable = [Reason.SIGNAL, Reason.OOM, Reason.TIMEOUT, Reason.LOST, Reason.TRANSFER]
     
 
 job_status = [State.ASSIGNED.value,
@@ -25,18 +40,28 @@ job_status = [State.ASSIGNED.value,
 class Status:
     def __init__(self, 
                  status: State, 
-                 start_time : datetime=datetime.now(),
-                 last_time  : datetime=datetime.now()
+                 start_time : datetime=None,
+                 last_time  : datetime=None,
+                 exit_code  : int=0,
+                 attempt    : int=0,
+                 reason     : Reason=Reason.NONE,
     ):
         self.status = status
-        self.start_time = start_time
-        self.last_time = last_time
+        # NOTE: defaults are taken at creation time, not when the module is imported
+        self.start_time = start_time or datetime.now()
+        self.last_time = last_time or self.start_time
+        self.exit_code = exit_code
+        self.attempt = attempt
+        self.reason = reason
     
     def to_dict(self) -> Dict:
         return {
             "status"     : self.status.value,
             "last_time"  : self.last_time.isoformat(),
             "start_time" : self.start_time.isoformat(),
+            "exit_code"  : self.exit_code,
+            "attempt"    : self.attempt,
+            "reason"     : self.reason.value,
         }
         
     @classmethod
@@ -44,18 +69,23 @@ class Status:
         return cls(
             status = State(data["status"]),
             start_time = datetime.fromisoformat(data["start_time"]),
-            last_time = datetime.fromisoformat(data["last_time"])
+            last_time = datetime.fromisoformat(data["last_time"]),
+            exit_code = data.get("exit_code", 0),
+            attempt = data.get("attempt", 0),
+            reason = Reason(data.get("reason", "")),
         )
         
     def ping(self):
-        self.time = datetime.now()
+        self.last_time = datetime.now()
         
-    def is_alive(self, minutes : int=5) -> bool:
+    def is_alive(self, minutes : float=5) -> bool:
         return datetime.now() - self.last_time < timedelta(minutes=minutes)
       
     def reset(self):
         self.start_time = datetime.now()
         self.last_time = datetime.now()
+        self.exit_code = 0
+        self.reason = Reason.NONE
 
 
 
@@ -0,0 +1,431 @@
+__all__ = ["StatusTable", "get_status_table", "state_codes", "reason_codes"]
+
+import os
+import json
+import mmap
+import struct
+import numpy as np
+
+from typing import Dict, Iterator, List, Tuple, Union
+from datetime import datetime
+from filelock import FileLock
+from loguru import logger
+from maestro_lightning.models.status import State, Status, Reason
+
+
+#
+# NOTE: the state is stored as a single byte. The code zero is reserved for
+# records that were allocated (e.g. by growing the table) but never written,
+# which is the same as an unknown job.
+#
+state_codes = [State.UNKNOWN,
+               State.ASSIGNED,
+               State.PENDING,
+               State.RUNNING,
+               State.COMPLETED,
+               State.FAILED,
+               State.FINALIZED,
+               State.CANCELED]
+
+# NOTE: the failure reason takes the byte after the state, which was padding, so older tables read as no reason
+reason_codes = [Reason.NONE,
+                Reason.EXIT,
+                Reason.SIGNAL,
+                Reason.OOM,
+                Reason.TIMEOUT,
+                Reason.LOST,
+                Reason.TRANSFER]
+
+
+class StatusTable:
+    """
+    Fixed-width status table with one record per job id.
+
+    The table lives in a single file per task (``jobs/status.table``). Each
+    record is stored at ``header_size + job_id * record.size`` and holds the
+    job state, the failure reason, the attempt number, the exit code, the
+    start time and the last heartbeat. Writers update their own record in place under the task lock
+    while readers scan the whole table through a single memory map.
+
+    The header also keeps a rollup with the number of records in each state.
+    It is updated under the same lock as the record, on every state
+    transition, so per-state counts can be read without touching the records.
+    """
+    magic       = b"MLST"
+    version     = 2
+    header      = struct.Struct("<4sHH")    # magic, version, record size
+    counters    = struct.Struct("<14I")     # number of records per state code
+    header_size = 64
+    record      = struct.Struct("<BBHidd")  # state, reason, attempt, exit code, start time, last time
+
+    def __init__(self, path : str):
+        """
+        Initializes the status table.
+
+        Parameters:
+        ----------
+        path : str
+            The file path of the table. The file is created on the first write.
+        """
+        self.path      = path
+        self.lock_path = f"{path}.lock"
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return max(0, os.path.getsize(self.path) - self.header_size) // self.record.size
+
+    #
+    # record (de)serialization
+    #
+
+    def _pack(self, status : Status) -> bytes:
+        return self.record.pack(
+            state_codes.index(status.status),
+            reason_codes.index(status.reason),
+            status.attempt,
+            status.exit_code,
+            status.start_time.timestamp(),
+            status.last_time.timestamp(),
+        )
+
+    def _unpack(self, raw : bytes) -> Status:
+        return self._status(self.record.unpack(raw))
+
+    def _status(self, fields : Tuple) -> Status:
+        code, reason, attempt, exit_code, start_time, last_time = fields
+        return Status(
+            status     = state_codes[code] if code < len(state_codes) else State.UNKNOWN,
+            start_time = datetime.fromtimestamp(start_time),
+            last_time  = datetime.fromtimestamp(last_time),
+            exit_code  = exit_code,
+            attempt    = attempt,
+            reason     = reason_codes[reason] if reason < len(reason_codes) else Reason.NONE,
+        )
+
+    def _offset(self, job_id : int) -> int:
+        return self.header_size + job_id * self.record.size
+
+    def _open(self) -> int:
+        """Open the table for writing, creating or upgrading the header when needed. Must hold the lock."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664)
+        if os.fstat(fd).st_size < self.header_size:
+            header = self.header.pack(self.magic, self.version, self.record.size)
+            os.pwrite(fd, header.ljust(self.header_size, b"\0"), 0)
+        else:
+            _, version, _ = self.header.unpack(os.pread(fd, self.header.size, 0))
+            if version < self.version:
+                # NOTE: tables written before the rollup existed have no counters.
+                logger.info(f"upgrading status table {self.path} to version {self.version}.")
+                os.pwrite(fd, self.header.pack(self.magic, self.version, self.record.size), 0)
+                self._write_counters(fd, self._recount(fd))
+        return fd
+
+    def _read_counters(self, fd : int) -> List[int]:
+        return list(self.counters.unpack(os.pread(fd, self.counters.size, self.header.size)))
+
+    def _write_counters(self, fd : int, counters : List[int]):
+        os.pwrite(fd, self.counters.pack(*[max(0, value) for value in counters]), self.header.size)
+
+    def _recount(self, fd : int) -> List[int]:
+        counters = [0] * len(self.counters.unpack(bytes(self.counters.size)))
+        size = os.fstat(fd).st_size
+        if size > self.header_size:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                end = self.header_size + ((size - self.header_size) // self.record.size) * self.record.size
+                codes = mm[self.header_size:end:self.record.size]
+            for code in range(len(counters)):
+                counters[code] = codes.count(code)
+        return counters
+
+    def _write(self, fd : int, counters : List[int], job_id : int, status : Status):
+        """Write a record and move it between state counters. Must hold the lock."""
+        nrecords = max(0, os.fstat(fd).st_size - self.header_size) // self.record.size
+        if job_id >= nrecords:
+            # NOTE: growing the table allocates zeroed (unknown) records up to job_id
+            counters[0] += job_id - nrecords + 1
+            old_code = 0
+        else:
+            old_code = os.pread(fd, 1, self._offset(job_id))[0]
+        new_code = state_codes.index(status.status)
+        os.pwrite(fd, self._pack(status), self._offset(job_id))
+        counters[old_code] -= 1
+        counters[new_code] += 1
+
+    #
+    # single record access
+    #
+
+    def get(self, job_id : int) -> Union[Status, None]:
+        """
+        Read the status of a single job.
+
+        Returns:
+            Union[Status, None]: The job status or None if the job has no record.
+        """
+        if job_id >= len(self):
+            return None
+        with open(self.path, 'rb') as f:
+            raw = os.pread(f.fileno(), self.record.size, self._offset(job_id))
+        return self._unpack(raw) if len(raw) == self.record.size else None
+
+    def set(self, job_id : int, status : Status):
+        """Write the status of a single job in place, growing the table if needed."""
+        with FileLock(self.lock_path):
+            fd = self._open()
+            try:
+                counters = self._read_counters(fd)
+                self._write(fd, counters, job_id, status)
+                self._write_counters(fd, counters)
+            finally:
+                os.close(fd)
+
+    def update(self, job_id : int, **fields) -> Status:
+        """
+        Atomically read, modify and write back the status of a single job.
+
+        Parameters:
+        ----------
+        job_id : int
+            The job record to be updated.
+        fields :
+            The Status attributes to be replaced (e.g. ``status=State.RUNNING``).
+
+        Returns:
+            Status: The status written into the table.
+        """
+        with FileLock(self.lock_path):
+            fd = self._open()
+            try:
+                raw = os.pread(fd, self.record.size, self._offset(job_id))
+                status = self._unpack(raw) if len(raw) == self.record.size else Status(State.UNKNOWN, datetime.now(), datetime.now())
+                for key, value in fields.items():
+                    setattr(status, key, value)
+                counters = self._read_counters(fd)
+                self._write(fd, counters, job_id, status)
+                self._write_counters(fd, counters)
+            finally:
+                os.close(fd)
+        return status
+
+    def extend(self, statuses : Dict[int, Status]):
+        """Write several records under a single lock acquisition."""
+        if not statuses:
+            return
+        with FileLock(self.lock_path):
+            fd = self._open()
+            try:
+                counters = self._read_counters(fd)
+                for job_id, status in statuses.items():
+                    self._write(fd, counters, job_id, status)
+                self._write_counters(fd, counters)
+            finally:
+                os.close(fd)
+
+    def claim(self, count : int, state : State=State.ASSIGNED, new_state : State=State.PENDING) -> List[int]:
+        """
+        Atomically take up to count jobs in a given state.
+
+        The jobs are moved to new_state under the task lock, so concurrent
+        callers (e.g. several packed array elements) never get the same job.
+
+        Returns:
+            List[int]: The ids of the claimed jobs, lowest first.
+        """
+        if count <= 0 or len(self) == 0:
+            return []
+        with FileLock(self.lock_path):
+            fd = self._open()
+            try:
+                size = os.fstat(fd).st_size
+                end  = self.header_size + ((size - self.header_size) // self.record.size) * self.record.size
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                    column = np.frombuffer(mm, dtype=np.uint8, count=end - self.header_size, offset=self.header_size)
+                    job_ids = np.flatnonzero(column[::self.record.size] == state_codes.index(state))[:count].tolist()
+                    del column
+                counters = self._read_counters(fd)
+                for job_id in job_ids:
+                    status = self._unpack(os.pread(fd, self.record.size, self._offset(job_id)))
+                    status.status = new_state
+                    # NOTE: the claim counts as the first heartbeat, so the job is not reaped before its runner starts
+                    status.ping()
+                    self._write(fd, counters, job_id, status)
+                self._write_counters(fd, counters)
+            finally:
+                os.close(fd)
+        return job_ids
+
+    def touch(self, job_id : int):
+        """
+        Write a heartbeat: only the last time of the record is replaced.
+
+        The field is written with a single pwrite and without the lock, so
+        heartbeats stay cheap and never wait for other writers.
+        """
+        if job_id >= len(self):
+            return
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, struct.pack("<d", datetime.now().timestamp()), self._offset(job_id) + self.record.size - 8)
+        finally:
+            os.close(fd)
+
+    def reap(self, timeout : float, states : Tuple[State, ...]=(State.PENDING, State.RUNNING)) -> List[int]:
+        """
+        Atomically fail the jobs whose heartbeat is older than timeout.
+
+        The jobs are marked FAILED with the LOST reason under the task lock, so
+        a job finishing at the same time keeps its own final status.
+
+        Parameters:
+        ----------
+        timeout : float
+            The age in seconds after which a heartbeat is stale.
+        states : Tuple[State, ...]
+            The states of the jobs that are expected to send heartbeats.
+
+        Returns:
+            List[int]: The ids of the lost jobs.
+        """
+        if len(self) == 0:
+            return []
+        dtype = np.dtype([("state", np.uint8), ("reason", np.uint8), ("attempt", "<u2"),
+                          ("exit_code", "<i4"), ("start_time", "<f8"), ("last_time", "<f8")])
+        with FileLock(self.lock_path):
+            fd = self._open()
+            try:
+                count = (os.fstat(fd).st_size - self.header_size) // self.record.size
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                    data  = np.frombuffer(mm, dtype=dtype, count=count, offset=self.header_size)
+                    alive = np.isin(data["state"], [state_codes.index(state) for state in states])
+                    stale = data["last_time"] < datetime.now().timestamp() - timeout
+                    job_ids = np.flatnonzero(alive & stale).tolist()
+                    del data, alive, stale
+                counters = self._read_counters(fd)
+                for job_id in job_ids:
+                    status = self._unpack(os.pread(fd, self.record.size, self._offset(job_id)))
+                    status.status, status.reason = State.FAILED, Reason.LOST
+                    self._write(fd, counters, job_id, status)
+                self._write_counters(fd, counters)
+            finally:
+                os.close(fd)
+        return job_ids
+
+    #
+    # bulk access
+    #
+
+    def scan(self) -> Iterator[Tuple[int, Status]]:
+        """Iterate over all records of the table through a single memory map."""
+        if len(self) == 0:
+            return
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = self._offset(len(self))
+                for job_id, fields in enumerate(self.record.iter_unpack(mm[self.header_size:end])):
+                    yield job_id, self._status(fields)
+
+    def codes(self) -> np.ndarray:
+        """
+        Return the state code of every job as a numpy array indexed by job id.
+
+        The state column is read with a strided view over the memory map and
+        copied out, so filters and counts can run as vectorized operations.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                column = np.frombuffer(mm, dtype=np.uint8, count=len(self) * self.record.size, offset=self.header_size)
+                codes = column[::self.record.size].copy()
+                del column
+        return codes
+
+    def states(self) -> List[State]:
+        """
+        Return the state of every job, indexed by job id.
+
+        Only the state byte of each record is touched, using a strided slice
+        over the memory map, so this is the cheapest way to read the whole task.
+        """
+        if len(self) == 0:
+            return []
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                codes = mm[self.header_size:self._offset(len(self)):self.record.size]
+        return [state_codes[code] if code < len(state_codes) else State.UNKNOWN for code in codes]
+
+    def counts(self) -> Dict[State, int]:
+        """
+        Return the number of jobs in each state from the header rollup.
+
+        This only reads the table header, so it costs the same regardless of
+        the number of jobs in the task.
+        """
+        if len(self) == 0 and not os.path.exists(self.path):
+            return { state : 0 for state in state_codes }
+        with open(self.path, 'rb') as f:
+            _, version, _ = self.header.unpack(os.pread(f.fileno(), self.header.size, 0))
+            if version < self.version:
+                return self.recount()
+            counters = self._read_counters(f.fileno())
+        return { state : counters[code] for code, state in enumerate(state_codes) }
+
+    def recount(self) -> Dict[State, int]:
+        """Rebuild the header rollup from the records, e.g. after an interrupted write."""
+        with FileLock(self.lock_path):
+            fd = self._open()
+            try:
+                counters = self._recount(fd)
+                self._write_counters(fd, counters)
+            finally:
+                os.close(fd)
+        return { state : counters[code] for code, state in enumerate(state_codes) }
+
+    def clear(self):
+        """Remove the table from disk."""
+        with FileLock(self.lock_path):
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def migrate(self, status_dir : str) -> int:
+        """
+        One-shot migration from the legacy ``jobs/status/job_N.json`` layout.
+
+        Parameters:
+        ----------
+        status_dir : str
+            The directory holding the legacy per-job status files.
+
+        Returns:
+            int: The number of migrated records.
+        """
+        statuses = {}
+        for filename in os.listdir(status_dir):
+            if not (filename.startswith("job_") and filename.endswith(".json")):
+                continue
+            job_id = int(filename[len("job_"):-len(".json")])
+            with open(f"{status_dir}/{filename}", 'r') as f:
+                statuses[job_id] = Status.from_dict(json.load(f))
+        self.extend(statuses)
+        logger.info(f"migrated {len(statuses)} job status files from {status_dir} into {self.path}.")
+        return len(statuses)
+
+
+__tables__ = {}
+
+def get_status_table(task_path : str) -> StatusTable:
+    """
+    Return the status table of the task located at task_path.
+
+    Tables are cached per process. The first time a task without table is
+    opened, any legacy per-job status file is migrated into the table.
+    """
+    global __tables__
+    if task_path not in __tables__:
+        table = StatusTable(f"{task_path}/jobs/status.table")
+        status_dir = f"{task_path}/jobs/status"
+        if not os.path.exists(table.path) and os.path.isdir(status_dir):
+            table.migrate(status_dir)
+        __tables__[task_path] = table
+    return __tables__[task_path]
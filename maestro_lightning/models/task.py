@@ -20,17 +20,24 @@ __all__ = [
     "Task",
 ]
 
-import os, json
+import os, json, math, hashlib, shutil
+import numpy as np
 
 from typing                  import Union, Dict, List
-from expand_folders          import expand_folders
 from filelock                import FileLock
 from loguru                  import logger
 
-from maestro_lightning.models         import get_context, Job, Status, State, job_status
+from maestro_lightning.models         import get_context, Job, JobTable, Status, State, Reason, job_status
+from maestro_lightning.models.table   import StatusTable, get_status_table, state_codes
+from maestro_lightning.models.index   import JobIndex
+from maestro_lightning.models.metrics import MetricsTable, get_metrics_table
+from maestro_lightning.models.profile import Profile, get_profile_store
+from maestro_lightning.models.history import History, get_history
+from maestro_lightning.models.manifest import JobManifest, get_job_manifest
 from maestro_lightning.models.image   import Image 
 from maestro_lightning.models.dataset import Dataset
-from maestro_lightning                import sbatch
+from maestro_lightning                import sbatch, split_array
+from maestro_lightning.storage.results import get_result_cache
 from maestro_lightning.exceptions     import *
 
 
@@ -49,6 +56,22 @@ class Task:
                      binds          : Dict[str, str] = {},
                      envs           : Dict[str, str] = {},
                      reservation    : str=None, 
+                     cpus           : int=None,
+                     pack           : int=None,
+                     throttle       : int=None,
+                     pilot          : Union[int, float]=None,
+                     headroom       : float=1.5,
+                     max_attempts   : int=3,
+                     memory_factor  : float=2.0,
+                     time_factor    : float=2.0,
+                     heartbeat      : float=60,
+                     scratch        : str=None,
+                     cache          : str=None,
+                     cache_size     : float=None,
+                     cache_age      : float=None,
+                     stage_image    : bool=False,
+                     reuse          : bool=False,
+                     task_id        : int=None,
             ):
             """
             Initializes a new task with the given parameters.
@@ -62,6 +85,29 @@ class Task:
             - partition (str): The partition to which the task belongs.
             - secondary_data (Dict[str, Union[str, Dataset]], optional): A dictionary of secondary data for the task, defaults to an empty dictionary.
             - binds (Dict[str, str], optional): A dictionary of binds for the task, defaults to an empty dictionary.
+            - cpus (int, optional): The number of CPUs of each job. When not given, SLURM jobs take the whole node and local jobs a single CPU.
+            - pack (int, optional): Run up to this number of jobs concurrently inside each SLURM array element, instead of one job per element.
+            - throttle (int, optional): The maximum number of array elements of the task running at the same time ('%N'), shared
+              by the arrays of a task split over the cluster 'max_array_size'.
+            - pilot (Union[int, float], optional): Run this number (or this fraction, when below 1) of jobs first, on exclusive nodes, and
+              submit the others with the memory, cpus and time learned from them. Skipped when the task already has a learned profile.
+            - headroom (float, optional): The factor applied to the learned memory and time when requesting resources, defaults to 1.5.
+            - max_attempts (int, optional): The number of times a job killed by the memory or time limit, or by a signal, is run before
+              it counts as failed, defaults to 3. Jobs exiting with an error are never retried.
+            - memory_factor (float, optional): The factor applied to the memory of a job retried after running out of memory, defaults to 2.
+            - time_factor (float, optional): The factor applied to the time limit of a job retried after running out of time, defaults to 2.
+            - heartbeat (float, optional): The interval, in seconds, between two heartbeats of a running job, defaults to 60. A job
+              missing five heartbeats in a row is considered lost.
+            - scratch (str, optional): Run each job in a node-local folder under this path (e.g. '$TMPDIR' or '/scratch'), expanded on
+              the node, instead of the shared workarea. Outputs and logs are copied out and verified at the end.
+            - cache (str, optional): A node-local folder (e.g. '$TMPDIR/maestro') caching the secondary data, shared by the jobs of a node.
+            - cache_size (float, optional): The maximum size of the node-local cache, in GB. Defaults to half of its filesystem.
+            - cache_age (float, optional): Evict node-local cache entries not used for this many hours. Defaults to no limit.
+            - stage_image (bool, optional): Copy the image once per node into the node-local cache (default '$TMPDIR/maestro'), checked
+              against a digest taken when the task is initialized, instead of running every job from the shared image file.
+            - reuse (bool, optional): Take the outputs of jobs identical to one already run, in this or another flow, from the
+              result cache (MAESTRO_RESULTS) instead of running them, and store the outputs of the jobs which do run.
+            - task_id (int, optional): The id of the task, as stored in the flow file. New tasks take the id after the last one.
 
             Raises:
             - ValueError: If the command does not contain the required placeholders for input, output, or secondary data.
@@ -100,11 +146,27 @@ class Task:
             if self.name in ctx.tasks:
                 raise TaskExistsError(self.name)
             
-            self.task_id = len(ctx.tasks)
+            # NOTE: ids of a loaded flow are kept, since tasks removed from it leave gaps
+            self.task_id = task_id if task_id is not None else max( (task.task_id for task in ctx.tasks.values()), default=-1 ) + 1
             ctx.tasks[self.name] = self   
             self.input_data = input_data            
             self.partition = partition
             self.reservation = reservation
+            self.cpus = cpus
+            self.pack = pack
+            self.throttle = throttle
+            self.pilot = pilot
+            self.headroom = headroom
+            self.max_attempts = max_attempts
+            self.memory_factor = memory_factor
+            self.time_factor = time_factor
+            self.heartbeat = heartbeat
+            self.scratch = scratch
+            self.cache = cache
+            self.cache_size = cache_size
+            self.cache_age = cache_age
+            self.stage_image = stage_image
+            self.reuse = reuse
             self.binds = binds
             self._next = []
             self._prev = []
@@ -138,17 +200,52 @@ class Task:
             self.secondary_data = secondary_data
             self.path = f"{ctx.path}/tasks/{self.name}"
             
-            self.jobs   = []
-            if os.path.exists(f"{self.path}/jobs/inputs"):
-                for job_path in expand_folders(f"{self.path}/jobs/inputs/*"):
-                    logger.info(f"Task {self.name}: loading existing job from {job_path}.")
-                    with open( job_path , 'r') as f:
-                        job = Job.from_dict(json.load(f))
-                        self.jobs.append(job)
-                    
+            self._index = None
+            self._jobs  = None
+            self._reuse_checked = set()
             self.task_status_path = f"{self.path}/status"
 
                     
+    @property
+    def jobs(self) -> JobTable:
+        """
+        The jobs of the task, loaded on first access.
+
+        Constructing a task does not read any job file, so loading a flow only
+        pays for the tasks whose jobs are actually used by the command. Jobs
+        are kept in a compact `JobTable` and Job objects are created on access.
+        """
+        if self._jobs is None:
+            self._jobs = self._load_jobs()
+        return self._jobs
+
+    def _load_jobs(self) -> JobTable:
+            """
+            Load all existing jobs of the task from the job manifest.
+
+            The manifest is read sequentially in a single pass; the fields shared
+            by all jobs are stored once in its header and in the job table.
+            """
+            jobs = JobTable.from_manifest(self.manifest) if os.path.isdir(f"{self.path}/jobs") else None
+            if jobs is None:
+                return self._new_table()
+            logger.info(f"Task {self.name}: loaded {len(jobs)} existing jobs from {self.manifest.path}.")
+            return jobs
+
+    def _new_table(self) -> JobTable:
+        outputs = {key: (value.name.replace(f"{self.name}.",""),value) for key, value in self.outputs_data.items()}
+        return JobTable(task_path      = self.path,
+                        outputs        = outputs,
+                        secondary_data = self.secondary_data,
+                        image          = self.image,
+                        command        = self.command,
+                        binds          = self.binds,
+                        envs           = self.envs)
+
+    @property
+    def manifest(self) -> JobManifest:
+        return get_job_manifest(self.path)
+
     @property
     def next(self) -> List['Task']:
         return self._next
@@ -188,14 +285,42 @@ class Task:
             """
             
             os.makedirs(self.path + "/works"       , exist_ok=True)
-            os.makedirs(self.path + "/jobs/inputs" , exist_ok=True)
-            os.makedirs(self.path + "/jobs/status" , exist_ok=True)
+            os.makedirs(self.path + "/jobs"        , exist_ok=True)
             os.makedirs(self.path + "/scripts"     , exist_ok=True)
             os.makedirs(self.path + "/logs"        , exist_ok=True)
             os.makedirs(self.path + "/status"      , exist_ok=True)
             self._create_status()
             self._update_jobs()   
 
+    def reset(self, delete_workarea : bool=False, delete_outputs : bool=False):
+            """
+            Forget all jobs of the task and set it back to ASSIGNED.
+
+            The job manifest, index, status table, metrics and history are removed,
+            so the jobs are created again from the input dataset by `mkdir`.
+
+            Args:
+                delete_workarea (bool): Also remove the job folders of the task.
+                delete_outputs (bool): Also remove the files of the output datasets, so tasks
+                    reading them do not pick up outputs of the previous jobs.
+            """
+            self.status = State.ASSIGNED
+            self.table.clear()
+            self.index.clear()
+            self.manifest.clear()
+            self.metrics.clear()
+            self.history.clear()
+            self._jobs = None
+            self._reuse_checked = set()
+            if delete_workarea:
+                shutil.rmtree(f"{self.path}/works", ignore_errors=True)
+                os.makedirs(f"{self.path}/works", exist_ok=True)
+            if delete_outputs:
+                for dataset in self.outputs_data.values():
+                    logger.info(f"Task {self.name}: removing the files of output dataset {dataset.name}.")
+                    shutil.rmtree(dataset.path, ignore_errors=True)
+                    dataset.mkdir()
+
 
     
     def output(self, key: str) -> str:
@@ -219,16 +344,47 @@ class Task:
             Checks if the current task has any associated jobs.
 
             This method evaluates whether there are any jobs linked to the
-            current instance by checking the length of the jobs list.
+            current instance by checking the length of the jobs list. When the
+            task reuses results, assigned jobs found in the result cache are
+            completed first, so they are never submitted.
 
             Returns:
                 bool: True if there are jobs associated with the task, False otherwise.
             """
             self._update_jobs()   
+            if self.reuse:
+                self.reuse_results()
             return len(self.get_array_of_jobs_with_status()) > 0
 
+    def reuse_results(self) -> List[int]:
+            """
+            Complete the assigned jobs whose outputs are in the result cache.
+
+            Each job is looked up once per process. Jobs whose input file does not
+            exist yet are looked up again later, and also by the job runner.
 
-    def submit(self, dry_run : bool=False ) -> int:
+            Returns:
+                List[int]: The ids of the reused jobs.
+            """
+            cache    = get_result_cache()
+            basepath = get_context().path
+            hits, cpu_hours = [], 0
+            for job_id in self.get_array_of_jobs_with_status():
+                if job_id in self._reuse_checked:
+                    continue
+                job  = self.jobs[job_id]
+                meta = job.reuse(cache, basepath)
+                if os.path.exists(job.input_file):
+                    self._reuse_checked.add(job_id)
+                if meta:
+                    hits.append(job_id)
+                    cpu_hours += meta["cpu_hours"]
+            if hits:
+                logger.info(f"Task {self.name}: reused {len(hits)} jobs from the result cache, saving {cpu_hours:.2f} cpu hours.")
+            return hits
+
+
+    def submit(self, dry_run : bool=False, dependency : str=None, job_ids : List[int]=None, resources : Dict[str, str]={} ) -> List[int]:
             """
             Submits a job to the job scheduler.
 
@@ -240,15 +396,53 @@ class Task:
             5. Prepares the njob command with necessary parameters.
             6. Submits the job and returns the job ID.
 
+            The array spec is compressed into ranges. When it does not fit the
+            cluster limits (the 'max_array_size' of the flow), the jobs are split
+            into several arrays which read their job ids from an indirection file.
+
+            The task throttle bounds all the arrays of a submission together: it is
+            divided between them and, when there are more arrays than slots, each
+            array beyond the first 'throttle' ones runs one element at a time after
+            (afterany) the array 'throttle' positions before it.
+
+            When the task has a learned profile, each element asks for the
+            memory, cpus and time it needs (with the task headroom) instead of
+            an exclusive node, which lets SLURM backfill and share nodes.
+
+            Args:
+                dry_run (bool): Write the script without submitting it.
+                dependency (str): An optional SLURM dependency (e.g. 'afterok:123'). The array
+                    is killed by SLURM if the dependency can never be satisfied.
+                job_ids (List[int]): Submit only these jobs (e.g. the pilot jobs), one per element. Defaults to all assigned jobs.
+                resources (Dict[str, str]): SLURM options replacing the ones of the profile (e.g. the escalated 'MEM' of a retry).
+
             Returns:
-                int: The ID of the submitted job.
+                List[int]: The IDs of the submitted arrays.
             """
             
             ctx = get_context()
             self._update_jobs()   
 
-            params = {
-                                "ARRAY"         : ",".join( [str(job_id) for job_id in self.get_array_of_jobs_with_status() ]),
+            pack    = self.pack if job_ids is None else None
+            job_ids = self.get_array_of_jobs_with_status() if job_ids is None else job_ids
+            profile = self.profile
+            if pack:
+                # NOTE: each element claims jobs from the task until none is left, so
+                # only enough elements to hold all jobs, pack by pack, are needed
+                job_ids = list(range(max(1, -(-len(job_ids) // pack))))
+            arrays = split_array(job_ids, max_size=ctx.extra_params.get("max_array_size", 1001))
+
+            virtualenv = ctx["virtualenv"]
+            condaenv   = ctx["condaenv"]
+
+            slurm_ids = []
+            chunk_ids = {}
+            for chunk, (spec, indices) in enumerate(arrays):
+                throttle = None
+                if self.throttle:
+                    throttle = max(1, self.throttle // len(arrays) + (1 if chunk < self.throttle % len(arrays) else 0))
+                params = {
+                                "ARRAY"         : spec + (f"%{throttle}" if throttle else ""),
                                 "OUTPUT_FILE"   : f"{self.path}/works/job_%a/output.out",
                                 "ERROR_FILE"    : f"{self.path}/works/job_%a/output.err",
                                 "PARTITION"     : self.partition,
@@ -257,25 +451,99 @@ class Task:
                                 "EXCLUSIVE"     : True
                             }
 
-            if self.reservation:
-                params["RESERVATION"] = self.reservation
+                if self.reservation:
+                    params["RESERVATION"] = self.reservation
+                if profile:
+                    params.update(profile.slurm_opts(self.headroom))
+                    del params["EXCLUSIVE"]
+                if self.cpus:
+                    params["CPUS_PER_TASK"] = self.cpus
+                if resources:
+                    params.update(resources)
+                    params.pop("EXCLUSIVE", None)
+                if pack:
+                    params["OUTPUT_FILE"] = f"{self.path}/logs/pack_%A_%a.out"
+                    params["ERROR_FILE"]  = f"{self.path}/logs/pack_%A_%a.err"
+                    if profile:
+                        # NOTE: an element runs jobs until none is left, so its runtime is not bounded by a single job
+                        params["MEM"] = f"{int(params['MEM'][:-1]) * pack}M"
+                        params["CPUS_PER_TASK"] = int(params["CPUS_PER_TASK"]) * pack
+                        del params["TIME"]
+                    elif self.cpus:
+                        params["CPUS_PER_TASK"] = self.cpus * pack
+                        del params["EXCLUSIVE"]
+                elif indices is not None:
+                    # NOTE: the array index is not the job id, so job logs are redirected by the script
+                    params["OUTPUT_FILE"] = f"{self.path}/logs/run_task_{self.task_id}_{chunk}_%a.out"
+                    params["ERROR_FILE"]  = f"{self.path}/logs/run_task_{self.task_id}_{chunk}_%a.err"
+                deps = [dependency] if dependency else []
+                if self.throttle and chunk >= self.throttle and chunk_ids.get(chunk - self.throttle):
+                    # NOTE: the slots are taken by earlier arrays, so this one waits for its turn
+                    deps.append(f"afterany:{chunk_ids[chunk - self.throttle]}")
+                if deps:
+                    params["DEPENDENCY"]          = ",".join(deps)
+                    params["KILL_ON_INVALID_DEP"] = "yes"
+
+                name = f"run_task_{self.task_id}" if len(arrays) == 1 else f"run_task_{self.task_id}_{chunk}"
+                script = sbatch( f"{self.path}/scripts/{name}.sh", 
+                                 opts=params, 
+                                 virtualenv=virtualenv, 
+                                 condaenv=condaenv
+                                )
+                if pack:
+                    cpus    = self.cpus or (profile.cpus if profile else None)
+                    command = f"maestro run pack -i {self.manifest.path} -k {pack} -b {self.heartbeat}"
+                    command+= f" -s '{self.scratch}'" if self.scratch else ""
+                    command+= self.cache_options()
+                    command+= f" -c {cpus}" if cpus else ""
+                elif indices is not None:
+                    ids_path = f"{self.path}/scripts/{name}.ids"
+                    with open(ids_path, 'w') as f:
+                        f.write("".join(f"{job_id}\n" for job_id in indices))
+                    script += f'JOB_ID=$(sed -n "$((SLURM_ARRAY_TASK_ID+1))p" {ids_path})'
+                    script += f"mkdir -p {self.path}/works/job_$JOB_ID"
+                    command = self.job_command("$JOB_ID")
+                    command+= f" > {self.path}/works/job_$JOB_ID/output.out 2> {self.path}/works/job_$JOB_ID/output.err"
+                else:
+                    command = self.job_command("$SLURM_ARRAY_TASK_ID")
+                print(command)
+                script += command
+                job_id = script.submit() if not dry_run else -1
+                if job_id is None:
+                    logger.error(f"Task {self.name}: array {name} was not submitted.")
+                    continue
+                chunk_ids[chunk] = int(job_id)
+                slurm_ids.append(int(job_id))
+            return slurm_ids
+ 
+ 
+    def job_command(self, job_id : Union[int, str]) -> str:
+            """
+            Build the command running a single job of the task.
 
-            virtualenv = ctx["virtualenv"]
-            condaenv   = ctx["condaenv"]
+            Args:
+                job_id (Union[int, str]): The job id or a shell variable holding it (e.g. '$SLURM_ARRAY_TASK_ID').
 
-            script = sbatch( f"{self.path}/scripts/run_task_{self.task_id}.sh", 
-                             opts=params, 
-                             virtualenv=virtualenv, 
-                             condaenv=condaenv
-                            )
-            command = f"maestro run job"
-            command+= f" -i {self.path}/jobs/inputs/job_$SLURM_ARRAY_TASK_ID.json"
-            command+= f" -o {self.path}/works/job_$SLURM_ARRAY_TASK_ID"
-            print(command)
-            script += command
-            job_id = script.submit() if not dry_run else -1
-            return int(job_id)
- 
+            Returns:
+                str: The 'maestro run job' command line.
+            """
+            command = "maestro run job"
+            command+= f" -i {self.manifest.path} -j {job_id}"
+            command+= f" -o {self.path}/works/job_{job_id}"
+            command+= f" -b {self.heartbeat}"
+            # NOTE: quoted, so variables like $TMPDIR are expanded by the job runner on the node
+            command+= f" -s '{self.scratch}'" if self.scratch else ""
+            command+= self.cache_options()
+            return command
+
+    def cache_options(self) -> str:
+            """Return the node and result cache options of 'maestro run job' and 'maestro run pack'."""
+            command = f" --cache '{self.cache}'" if self.cache else ""
+            command+= f" --cache-size {self.cache_size}" if self.cache_size else ""
+            command+= f" --cache-age {self.cache_age}" if self.cache_age else ""
+            command+= " --stage-image" if self.stage_image and self.image else ""
+            command+= " --reuse" if self.reuse else ""
+            return command
  
     def to_dict(self) -> Dict:
             """
@@ -300,6 +568,21 @@ class Task:
                 "outputs"           : { key : value.name.replace(self.name+'.',"") for key, value in self.outputs_data.items() },
                 "partition"         : self.partition,
                 "reservation"       : self.reservation,
+                "cpus"              : self.cpus,
+                "pack"              : self.pack,
+                "throttle"          : self.throttle,
+                "pilot"             : self.pilot,
+                "headroom"          : self.headroom,
+                "max_attempts"      : self.max_attempts,
+                "memory_factor"     : self.memory_factor,
+                "time_factor"       : self.time_factor,
+                "heartbeat"         : self.heartbeat,
+                "scratch"           : self.scratch,
+                "cache"             : self.cache,
+                "cache_size"        : self.cache_size,
+                "cache_age"         : self.cache_age,
+                "stage_image"       : self.stage_image,
+                "reuse"             : self.reuse,
                 "secondary_data"    : { key : value.name for key, value in self.secondary_data.items() },
                 "binds"             : self.binds,
                 "envs"              : self.envs,
@@ -318,43 +601,299 @@ class Task:
             outputs        = data["outputs"],
             partition      = data["partition"],
             reservation    = data["reservation"],
+            cpus           = data.get("cpus", None),
+            pack           = data.get("pack", None),
+            throttle       = data.get("throttle", None),
+            pilot          = data.get("pilot", None),
+            headroom       = data.get("headroom", 1.5),
+            max_attempts   = data.get("max_attempts", 3),
+            memory_factor  = data.get("memory_factor", 2.0),
+            time_factor    = data.get("time_factor", 2.0),
+            heartbeat      = data.get("heartbeat", 60),
+            scratch        = data.get("scratch", None),
+            cache          = data.get("cache", None),
+            cache_size     = data.get("cache_size", None),
+            cache_age      = data.get("cache_age", None),
+            stage_image    = data.get("stage_image", False),
+            reuse          = data.get("reuse", False),
             secondary_data = data["secondary_data"],
             binds          = data["binds"],
             envs           = data["envs"],
+            task_id        = data.get("task_id", None),
         )
         
     def _create_status(self):
         with open( self.task_status_path + "/status.json", 'w') as f:
             json.dump( Status(State.ASSIGNED).to_dict() , f , indent=2)
         
+    @property
+    def index(self) -> JobIndex:
+        if self._index is None:
+            self._index = JobIndex(f"{self.path}/jobs/index")
+            if not self._index.exists() and self.jobs:
+                # NOTE: tasks created before the index existed are indexed from their jobs
+                logger.info(f"Task {self.name}: indexing {len(self.jobs)} existing jobs.")
+                self._index.add([ self.jobs.input_file(job_id) for job_id in self.jobs.ids.tolist() ])
+        return self._index
+
     def _update_jobs(self):
-            
-            input_files  = [ job.input_file.split('/')[-1] for job in self.jobs ]
-            job_id = len(input_files)
+            """
+            Create a job for each input file that is not indexed yet.
+
+            The input dataset is only scanned when its stamp moved since the last
+            scan (the index high-water mark), and the new stamp is taken from
+            that same scan. New files get the next free job ids, in the order
+            they are found, and all their status records are written with a
+            single table update.
+            """
+            index = self.index
+            stamp = self.input_data.stamp(scan=False)
+            if stamp and stamp == index.hwm:
+                return
+
+            new_files = []
             for filepath in self.input_data:
-                filename = filepath.split('/')[-1]
-                if not filename in input_files:
-                    logger.info(f"Task {self.name}: preparing job {job_id} for input file {filename}.")
-                    outputs = {key: (value.name.replace(f"{self.name}.",""),value) for key, value in self.outputs_data.items()}
-                    job = Job(
-                        task_path = self.path,
-                        job_id = job_id,
-                        input_file = filepath,
-                        outputs = outputs,
-                        secondary_data = self.secondary_data,
-                        image = self.image,
-                        command = self.command,
-                        binds = self.binds,
-                        envs = self.envs,
-                    )
-                    job.dump()
-                    self.jobs.append( job )
-                    input_files.append( filename )
-                    job_id += 1
+                if filepath in index:
+                    continue
+                logger.info(f"Task {self.name}: preparing job {len(index) + len(new_files)} for input file {filepath.split('/')[-1]}.")
+                new_files.append( filepath )
+            # NOTE: the walk above rewrote the manifest summary, so this only checks that no
+            # folder moved since it was listed
+            stamp = self.input_data.stamp(scan=False)
+            if not new_files:
+                index.hwm = stamp
+                return
+
+            self._add_jobs( new_files )
+            index.hwm = stamp
                     
                     
-    def get_array_of_jobs_with_status(self, status: State=State.ASSIGNED) -> List[int]:
-        return [ job.job_id for job in self.jobs if job.status == status ]
+    def _add_jobs(self, new_files : List[str]) -> List[int]:
+            """
+            Create jobs for input files which are not in the index yet.
+
+            All records are written with a single append to the job manifest and
+            a single status table update, and the files get the next free job ids.
+            The index lock is held from the allocation of the ids to their append.
+
+            Returns:
+                List[int]: The ids of the new jobs.
+            """
+            shared   = self._new_table()
+            template = Job(
+                task_path = self.path,
+                job_id = -1,
+                input_file = "",
+                outputs = shared.outputs,
+                secondary_data = shared.secondary_data,
+                image = shared.image,
+                command = shared.command,
+                binds = shared.binds,
+                envs = shared.envs,
+            ).to_dict()
+            index = self.index
+            with index.lock:
+                # NOTE: another runner may have indexed files since this index was read, so the
+                # ids are allocated from the index reloaded under its lock
+                known = len(index)
+                index.refresh()
+                if len(index) != known:
+                    # NOTE: the jobs loaded so far miss the ones created by the other runner
+                    self._jobs = None
+                new_files = [ filepath for filepath in dict.fromkeys(new_files) if filepath not in index ]
+                if not new_files:
+                    return []
+                job_ids = list(range(len(index), len(index) + len(new_files)))
+                self.manifest.append([ dict(template, job_id=job_id, input_file=filepath) for job_id, filepath in zip(job_ids, new_files) ])
+                self.table.extend({ job_id : Status(State.ASSIGNED) for job_id in job_ids })
+                index.add( new_files )
+            if self._jobs is not None:
+                for job_id, filepath in zip(job_ids, new_files):
+                    self._jobs.append( job_id, filepath )
+            return job_ids
+
+    def plan_jobs(self) -> List[int]:
+            """
+            Create the jobs of the task before its input files exist.
+
+            When the input dataset is an output of another task, each job of that
+            task writes exactly one file into it, named '<name>.<job_id><ext>' by
+            the job runner. The input paths of this task are therefore known as
+            soon as the jobs of the upstream task are, which allows the whole
+            flow to be submitted at once. The files are indexed as usual when they
+            show up, so planned jobs are never created twice.
+
+            Returns:
+                List[int]: The ids of the planned jobs.
+            """
+            upstream = self.input_data.from_task
+            if not upstream:
+                return []
+            index = self.index
+            new_files = []
+            for job_id in range(len(upstream.index)):
+                filepath = self.upstream_input(job_id)
+                if filepath not in index:
+                    new_files.append( filepath )
+            logger.info(f"Task {self.name}: planning {len(new_files)} jobs from task {upstream.name}.")
+            return self._add_jobs( new_files )
+
+    def upstream_input(self, job_id : int) -> str:
+            """
+            The input file of this task written by job_id of the task producing its input dataset.
+
+            Args:
+                job_id (int): The job id in the upstream task.
+
+            Returns:
+                str: The path of the file, which may not exist yet.
+            """
+            upstream = self.input_data.from_task
+            filename = self.input_data.name.replace(f"{upstream.name}.", "")
+            filename, extension = os.path.splitext(filename)
+            return f"{os.path.normpath(self.input_data.path)}/{filename}.{job_id}{extension}"
+
+    def follow(self, job_id : int) -> Union[int, None]:
+            """
+            Create the job reading the output of a single upstream job, as soon as it exists.
+
+            This is the incremental counterpart of `_update_jobs` for streaming
+            chained tasks: instead of rescanning the whole input dataset, only
+            the file written by the upstream job is checked and indexed.
+
+            Args:
+                job_id (int): The job id in the upstream task.
+
+            Returns:
+                Union[int, None]: The id of the job of this task reading the file or
+                None if the upstream job did not write it.
+            """
+            filepath = self.upstream_input(job_id)
+            if filepath in self.index:
+                return self.index.get(filepath)
+            if not os.path.exists(filepath):
+                return None
+            logger.info(f"Task {self.name}: preparing job {len(self.index)} for input file {filepath.split('/')[-1]}.")
+            job_ids = self._add_jobs( [filepath] )
+            return job_ids[0] if job_ids else self.index.get(filepath)
+
+    @property
+    def table(self) -> StatusTable:
+        return get_status_table(self.path)
+
+    @property
+    def metrics(self) -> MetricsTable:
+        return get_metrics_table(self.path)
+
+    def fingerprint(self) -> str:
+        """
+        Hash what each job of the task runs: the command, the image, the secondary
+        data, the binds and the environment. Tasks with the same fingerprint are
+        expected to need the same resources, whatever flow they belong to.
+        """
+        data = {
+            "command"        : self.command,
+            "image"          : self.image.path if self.image else None,
+            "secondary_data" : { key : value.path for key, value in self.secondary_data.items() },
+            "binds"          : self.binds,
+            "envs"           : self.envs,
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+
+    @property
+    def profile(self) -> Union[Profile, None]:
+        """
+        The resource profile learned for this task, or for an identical task of
+        a previous flow. None when nothing was learned yet.
+        """
+        path = f"{self.path}/jobs/profile.json"
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return Profile.from_dict(json.load(f))
+        return get_profile_store().get(self.fingerprint())
+
+    def learn_profile(self) -> Union[Profile, None]:
+        """
+        Learn the resource profile from the metrics of the jobs which already ran
+        and store it within the task and in the profile store.
+
+        Returns:
+            Union[Profile, None]: The profile or None if no job has metrics.
+        """
+        profile = Profile.learn(self.metrics)
+        if profile is None:
+            logger.warning(f"Task {self.name}: no job metrics to learn a profile from.")
+            return None
+        logger.info(f"Task {self.name}: learned profile {profile.to_dict()} from {profile.samples} jobs.")
+        with open(f"{self.path}/jobs/profile.json", 'w') as f:
+            json.dump(profile.to_dict(), f, indent=2)
+        get_profile_store().put(self.fingerprint(), profile)
+        return profile
+
+    @property
+    def history(self) -> History:
+        return get_history(self.path)
+
+    def escalate(self, job_id : int, reason : Reason, history : List[Dict]=None) -> Dict[str, str]:
+        """
+        Build the SLURM requests of the next attempt of a failed job.
+
+        The memory and time given to the last attempt are kept (they may
+        already be escalated) and the one the job ran out of is multiplied by
+        the task factor. When the last attempt did not record what it was
+        given, the measured peak memory or runtime is used instead.
+
+        Parameters:
+        ----------
+        job_id : int
+            The failed job.
+        reason : Reason
+            Why the last attempt failed.
+        history : List[Dict]
+            The attempts of the job, when already read (see `History.by_job`).
+
+        Returns:
+            Dict[str, str]: The 'MEM' and 'TIME' options, when known.
+        """
+        history = self.history.read(job_id) if history is None else history
+        metrics = self.metrics.get(job_id) or {}
+        # NOTE: lost attempts do not know what they were given, so the last known request is kept
+        mem_mb  = next( (record["mem_mb"] for record in reversed(history) if record.get("mem_mb")), None )
+        time_s  = next( (record["time_s"] for record in reversed(history) if record.get("time_s")), None )
+        if reason == Reason.OOM:
+            mem_mb = (mem_mb or metrics.get("sys_memory_mb_peak", 0)) * self.memory_factor
+        elif reason == Reason.TIMEOUT:
+            time_s = (time_s or metrics.get("exec_time", 0)) * self.time_factor
+        resources = {}
+        if mem_mb:
+            resources["MEM"] = f"{math.ceil(mem_mb)}M"
+        if time_s:
+            resources["TIME"] = str(max(1, math.ceil(time_s / 60)))
+        return resources
+
+    @property
+    def stale_after(self) -> float:
+        """The age, in seconds, of the last heartbeat of a job considered lost."""
+        return 5 * self.heartbeat
+
+    def pilot_jobs(self) -> List[int]:
+        """
+        Choose the jobs to run as pilots, among the assigned ones.
+
+        Returns:
+            List[int]: The pilot job ids, empty when the task has no pilot or a known profile.
+        """
+        if not self.pilot or self.profile:
+            return []
+        job_ids = self.get_array_of_jobs_with_status()
+        count   = self.pilot if self.pilot >= 1 else max(1, int(len(job_ids) * self.pilot))
+        return job_ids[:int(count)]
+
+    def get_array_of_jobs_with_status(self, status: Union[State, List[State]]=State.ASSIGNED) -> List[int]:
+        """Return the ids of the jobs in any of the given states, read from the status table only."""
+        states = status if type(status) == list else [status]
+        codes  = self.table.codes()[:len(self.index)]
+        return np.flatnonzero( np.isin(codes, [state_codes.index(state) for state in states]) ).tolist()
         
         
     @property 
@@ -377,18 +916,20 @@ class Task:
             with open( f"{self.task_status_path}/status.json", 'w') as f:
                 json.dump( status.to_dict() , f , indent=2)
  
-    def count(self) -> Dict[str, int]:
+    def count(self, recount : bool=False) -> Dict[str, int]:
             """
             Counts the number of jobs in each status.
 
-            This method iterates through the jobs associated with the current instance
-            and counts how many jobs are in each possible status defined in `job_status`.
+            The counts come from the rollup kept in the header of the task status
+            table, which is updated on every job state transition, so this does
+            not depend on the number of jobs in the task.
+
+            Args:
+                recount (bool): Rebuild the rollup from the job records before reading it.
             
             Returns:
                 Dict[str, int]: A dictionary where the keys are job statuses and the values
                 are the counts of jobs in each status.
             """   
-            status_count = { state : 0 for state in job_status }
-            for job in self.jobs:
-                status_count[job.status.value] += 1
-            return status_count
+            counts = self.table.recount() if recount else self.table.counts()
+            return { state : counts.get(State(state), 0) for state in job_status }
@@ -2,7 +2,9 @@
 
 import typer
 from maestro_lightning.runners.job_runner import run_job
-from maestro_lightning.runners.task_runner import run_init, run_next
+from maestro_lightning.runners.task_runner import run_init, run_next, run_dag
+from maestro_lightning.runners.flow_runner import run_flow
+from maestro_lightning.runners.pack_runner import run_pack
 from .task import task_app, expert_app
 
 app = typer.Typer(help="Maestro Lightning Orchestrator")
@@ -10,8 +12,11 @@ run_group = typer.Typer(help="Commands to run jobs and tasks")
 
 # Register run subcommands
 run_group.command("job", help="Run job runner.")(run_job)
+run_group.command("pack", help="Run several jobs of a task in one allocation.")(run_pack)
 run_group.command("task", help="Run the task init")(run_init)
 run_group.command("next", help="Run the task finalizing")(run_next)
+run_group.command("dag", help="Submit all tasks of a flow with SLURM dependencies")(run_dag)
+run_group.command("flow", help="Run all tasks of a flow in a local process pool")(run_flow)
 
 # Add groups to main app
 app.add_typer(run_group, name="run")
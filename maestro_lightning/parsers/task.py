@@ -2,6 +2,7 @@ __all__ = ["task_app", "expert_app"]
 
 import os
 import typer
+import numpy as np
 try:
     from typing import Annotated
 except ImportError:
@@ -11,6 +12,7 @@ from loguru import logger
 from tabulate import tabulate
 
 from maestro_lightning.models.status import State
+from maestro_lightning.models.table import state_codes
 from maestro_lightning import get_context
 from maestro_lightning import setup_logs
 from maestro_lightning.models import Dataset, Image, Task, Context
@@ -60,13 +62,101 @@ def run_create(
 @task_app.command("list")
 def run_list(
     input_file      : Annotated[str, typer.Option("--input", "-i", help="The job input file")],
-    message_level   : Annotated[str, typer.Option("--message-level", help="Set the logging level")] = "ERROR"
+    message_level   : Annotated[str, typer.Option("--message-level", help="Set the logging level")] = "ERROR",
+    recount         : Annotated[bool, typer.Option("--recount", help="Rebuild the job counters of each task from the job records.")] = False
 ):
     """
     List tasks in the flow.
     """
     ctx = load_context(input_file, message_level, "task_list")
-    print_tasks(ctx)  
+    print_tasks(ctx, recount=recount)  
+
+@task_app.command("report")
+def run_report(
+    input_file      : Annotated[str, typer.Option("--input", "-i", help="The job input file")],
+    message_level   : Annotated[str, typer.Option("--message-level", help="Set the logging level")] = "ERROR",
+):
+    """
+    Report the resource usage and efficiency of each task.
+    """
+    ctx = load_context(input_file, message_level, "task_report")
+    rows = []
+    for task in ctx.tasks.values():
+        columns = task.metrics.columns()
+        if len(columns["job_id"]) == 0:
+            rows.append([task.name, task.task_id, 0] + ["-"] * 9)
+            continue
+        runtime   = columns["exec_time"]
+        rss       = columns["sys_memory_mb_peak"]
+        allocated = runtime * np.maximum(columns["cpus"], 1)
+        rows.append([
+            task.name,
+            task.task_id,
+            len(runtime),
+            f"{np.percentile(runtime, 50):.1f}",
+            f"{np.percentile(runtime, 95):.1f}",
+            f"{runtime.max():.1f}",
+            f"{np.percentile(rss, 50):.0f}",
+            f"{np.percentile(rss, 95):.0f}",
+            f"{rss.max():.0f}",
+            f"{100 * columns['cpu_time'].sum() / allocated.sum():.1f}" if allocated.sum() > 0 else "-",
+            f"{allocated.sum() / 3600:.2f}",
+            f"{columns['cpu_time'].sum() / 3600:.2f}",
+        ])
+    cols = ['taskname', 'task_id', 'jobs', 
+            'runtime_p50 (s)', 'runtime_p95 (s)', 'runtime_max (s)',
+            'rss_p50 (MB)', 'rss_p95 (MB)', 'rss_max (MB)',
+            'cpu_eff (%)', 'cpu_hours_alloc', 'cpu_hours_used']
+    table = tabulate(rows, headers=cols, tablefmt="psql")
+    print(table)
+
+@task_app.command("results")
+def run_results(
+    input_file      : Annotated[str, typer.Option("--input", "-i", help="The job input file")],
+    message_level   : Annotated[str, typer.Option("--message-level", help="Set the logging level")] = "ERROR",
+):
+    """
+    Report the jobs reused from the result cache and the cpu hours they saved.
+    """
+    from maestro_lightning.storage.results import get_result_cache
+    ctx = load_context(input_file, message_level, "task_results")
+    rows = []
+    for task in ctx.tasks.values():
+        records = [ record for record in task.history.read() if record.get("cached") ]
+        rows.append([task.name, task.task_id, len(task.jobs) if task.jobs else 0, len(records),
+                     f"{sum( record['cpu_hours'] for record in records ):.2f}"])
+    cols = ['taskname', 'task_id', 'jobs', 'cache_hits', 'cpu_hours_saved']
+    table = tabulate(rows, headers=cols, tablefmt="psql")
+    print(table)
+    cache   = get_result_cache()
+    entries = cache.entries()
+    print(f"result cache {cache.root}: {len(entries)} entries, "
+          f"{sum( meta['size'] for meta in entries )/1024**3:.2f} of {cache.capacity/1024**3:.2f} GB.")
+
+@task_app.command("reap")
+def run_reap(
+    input_file      : Annotated[str, typer.Option("--input", "-i", help="The job input file")],
+    task_id         : Annotated[Optional[int], typer.Option("--task-id", help="Only scan this task. Defaults to all running tasks.")] = None,
+    timeout         : Annotated[Optional[float], typer.Option("--timeout", help="The age, in seconds, of a stale heartbeat. Defaults to five heartbeats of each task.")] = None,
+    message_level   : Annotated[str, typer.Option("--message-level", help="Set the logging level")] = "ERROR",
+):
+    """
+    Mark running jobs which stopped sending heartbeats as lost.
+
+    Lost jobs are requeued when their task is closed, within the task max_attempts.
+    """
+    from maestro_lightning.runners.task_runner import reap_jobs
+    ctx = load_context(input_file, message_level, "task_reap")
+    rows = []
+    for task in ctx.tasks.values():
+        if (task_id is not None and task.task_id != task_id) or (task_id is None and task.status != State.RUNNING):
+            continue
+        for job_id in reap_jobs(task, timeout=timeout):
+            status = task.table.get(job_id)
+            rows.append([task.name, task.task_id, job_id, status.attempt, status.last_time.isoformat()])
+    cols = ['taskname', 'task_id', 'job_id', 'attempt', 'last_heartbeat']
+    table = tabulate(rows, headers=cols, tablefmt="psql")
+    print(table)
 
 @task_app.command("retry")
 def run_retry(
@@ -81,10 +171,10 @@ def run_retry(
     logger.info(f"Retrying failed tasks in the flow: {ctx.path}")
     for task in ctx.tasks.values():
         if task.status != State.COMPLETED:
-            for job in task.jobs:
-                logger.info(f"Retrying job {job.job_id} of task {task.name}.")
-                if job.status != State.COMPLETED:
-                    job.status = State.ASSIGNED
+            retry = [ state for state in state_codes if state != State.COMPLETED ]
+            for job_id in task.jobs.filter(retry):
+                logger.info(f"Retrying job {job_id} of task {task.name}.")
+                task.table.update(job_id, status=State.ASSIGNED, attempt=task.table.get(job_id).attempt + 1)
             task.status = State.ASSIGNED
     
     for task in ctx.tasks.values():
@@ -103,21 +193,27 @@ def run_retry(
 def list_jobs(
     input_file      : Annotated[str, typer.Option("--input", "-i", help="The job input file")],
     message_level   : Annotated[str, typer.Option("--message-level", help="Set the logging level")] = "ERROR",
-    filter_status   : Annotated[Optional[str], typer.Option("--filter-status", help="A comma separated list of status to be printed (e.g, failed,completed ).")] = None
+    filter_status   : Annotated[Optional[str], typer.Option("--filter-status", help="A comma separated list of status to be printed (e.g, failed,completed ).")] = None,
+    recount         : Annotated[bool, typer.Option("--recount", help="Rebuild the job counters of each task from the job records.")] = False
 ):
     """
     List jobs for tasks.
     """
     ctx = load_context(input_file, message_level, "list_jobs")
     rows = []
+    status_list = filter_status.split(',') if filter_status else []
     for task in ctx.tasks.values():
-        for job in task.jobs:
-            status_list = filter_status.split(',') if filter_status else []
-            row = [task.name, task.task_id, job.job_id, job.status.value]
-            ok = job.status.value in status_list if len(status_list) > 0 else True
+        if recount:
+            task.count(recount=True)
+        njobs = len(task.index)
+        for job_id, status in task.table.scan():
+            if job_id >= njobs:
+                break
+            row = [task.name, task.task_id, job_id, status.status.value, status.attempt, status.reason.value]
+            ok = status.status.value in status_list if len(status_list) > 0 else True
             if ok:
                 rows.append(row)
-    cols = ['taskname', 'task_id', 'job_id', 'status']
+    cols = ['taskname', 'task_id', 'job_id', 'status', 'attempt', 'reason']
     table = tabulate(rows, headers=cols, tablefmt="psql")
     print(table)   
 
@@ -136,12 +232,9 @@ def change_jobs_status(
     rows = []
     for task in ctx.tasks.values():
         if task.task_id == task_id:
-            for job in task.jobs:
-                if job.status.value == from_status:
-                    row = [task.name, task.task_id, job.job_id, job.status.value]
-                    job.status = State(to_status)
-                    row.append(job.status.value)
-                    rows.append(row)
+            for job_id in task.jobs.filter(State(from_status)):
+                status = task.table.update(job_id, status=State(to_status))
+                rows.append([task.name, task.task_id, job_id, from_status, status.status.value])
     cols = ['taskname', 'task_id', 'job_id', 'old_status', 'new_status']
     table = tabulate(rows, headers=cols, tablefmt="psql")
     print(table)     
@@ -189,16 +282,13 @@ def reset_task(
                 raise Exception(message)
             
             row = [task.name, task.task_id, task.status.value]
-            for job in task.jobs:
-                job.status = State.ASSIGNED
             task.status = State.ASSIGNED
             row.append(task.status.value)
             rows.append(row)
             logger.info(f"clear job input file in {task.path}/jobs/inputs")
             os.system(f"rm -rf {task.path}/jobs/inputs/*")
             os.system(f"rm -rf {task.path}/jobs/status/*")
-            if delete_workarea:
-                os.system(f"rm -rf {task.path}/works/*")
+            task.reset(delete_workarea=delete_workarea)
 
     cols = ['taskname', 'task_id', 'old_status', 'new_status']
     table = tabulate(rows, headers=cols, tablefmt="psql")
@@ -8,4 +8,10 @@ from . import task_runner
 __all__.extend( task_runner.__all__ )
 from .task_runner import *
 
+from . import flow_runner
+__all__.extend( flow_runner.__all__ )
+from .flow_runner import *
 
+from . import pack_runner
+__all__.extend( pack_runner.__all__ )
+from .pack_runner import *
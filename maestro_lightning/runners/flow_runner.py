@@ -0,0 +1,185 @@
+__all__ = []
+
+import os
+import typer
+try:
+    from typing import Annotated
+except ImportError:
+    from typing_extensions import Annotated
+from collections import deque
+from loguru import logger
+from maestro_lightning import State, Reason, get_context
+from maestro_lightning import Pool, setup_logs
+from maestro_lightning.flow import load
+from maestro_lightning.runners.task_runner import close_task, reap_jobs, requeue_jobs
+
+
+def run_flow(
+    task_file       : Annotated[str, typer.Option("--task-file", "-t", help="The task file input")],
+    cpus            : Annotated[int, typer.Option("--cpus", "-c", help="The number of CPUs of the process pool. Defaults to the flow configuration.")] = None,
+    message_level   : Annotated[str, typer.Option("--message-level", help="The logging message level")] = "INFO",
+    dry_run         : Annotated[bool, typer.Option("--dry-run", help="Perform a dry run without executing any tasks.")] = False
+):
+    """
+    Run all tasks of a flow in a local process pool.
+
+    Tasks are started as soon as all the tasks they depend on are completed or
+    finalized and their assigned jobs are dispatched to the pool while there are
+    free CPUs. Each job is executed by 'maestro run job', as in a SLURM array,
+    and each task is closed with the same rules as 'maestro run next'.
+
+    When the flow streams, a task reading the outputs of a running task starts
+    with it, and each of its jobs is created and dispatched as soon as the
+    upstream job writing its input file completes.
+    """
+    setup_logs(name="flow_runner", level=message_level)
+    ctx = get_context(clear=True)
+    logger.info(f"Loading task file {task_file}.")
+    load(task_file, ctx)
+    tasks = {task.task_id: task for task in ctx.tasks.values()}
+
+    if dry_run:
+        for task in tasks.values():
+            job_ids = task.get_array_of_jobs_with_status() if task.has_jobs() else []
+            logger.info(f"Task {task.name} would run {len(job_ids)} jobs after {[prev.name for prev in task.prev]}.")
+            for job_id in job_ids:
+                print(task.job_command(job_id))
+        return
+
+    pool   = Pool(cpus=cpus or ctx.extra_params.get("cpus", None) or os.cpu_count())
+    stream = ctx.extra_params.get("stream", False)
+    logger.info(f"Running flow with a local pool of {pool.cpus} cpus.")
+
+    queues    = {} # task_id -> job ids waiting for a slot
+    running   = {} # task_id -> number of jobs in the pool
+    closed    = {} # task_id -> final task status
+    streaming = {} # task_id -> upstream task_id, for tasks fed job by job
+    queued    = {} # task_id -> ids of all jobs ever queued
+
+    for task in tasks.values():
+        if task.status in [State.COMPLETED, State.FINALIZED, State.FAILED, State.CANCELED]:
+            logger.info(f"Task {task.name} already {task.status.value}. Skipping.")
+            closed[task.task_id] = task.status
+
+    def done(task_id):
+        return closed.get(task_id) in [State.COMPLETED, State.FINALIZED]
+
+    def close(task):
+        closed[task.task_id] = close_task(task)
+        queues.pop(task.task_id, None)
+        running.pop(task.task_id, None)
+        for other in tasks.values():
+            if other.task_id not in closed and other.status == State.CANCELED:
+                closed[other.task_id] = State.CANCELED
+                queues.pop(other.task_id, None)
+                running.pop(other.task_id, None)
+                streaming.pop(other.task_id, None)
+        # tasks fed by this one get the files which were not streamed (e.g. from a previous run)
+        for task_id, upstream_id in list(streaming.items()):
+            if upstream_id == task.task_id:
+                del streaming[task_id]
+                if task_id in closed:
+                    continue
+                other = tasks[task_id]
+                other._update_jobs()
+                for job_id in other.get_array_of_jobs_with_status():
+                    enqueue(other, job_id)
+                try_close(other)
+
+    def try_close(task):
+        if task.task_id in queues and not queues[task.task_id] and running[task.task_id] == 0 and task.task_id not in streaming:
+            # NOTE: retries come first, as in 'maestro run next'
+            requeued = [ job_id for job_ids in requeue_jobs(task).values() for job_id in job_ids ]
+            if requeued:
+                queued[task.task_id].difference_update(requeued)
+                for job_id in requeued:
+                    enqueue(task, job_id)
+                return
+            close(task)
+
+    def start(task, upstream=None):
+        task.status = State.RUNNING
+        running[task.task_id] = 0
+        queues[task.task_id]  = deque()
+        queued[task.task_id]  = set()
+        # NOTE: nothing of this task runs in the pool yet, so running jobs were left by a previous runner
+        reap_jobs(task, timeout=0)
+        if upstream is None:
+            if not task.has_jobs():
+                logger.info(f"Task {task.name} has no assigned jobs. Closing it.")
+                close(task)
+                return
+            for job_id in task.get_array_of_jobs_with_status():
+                enqueue(task, job_id)
+            logger.info(f"Started task {task.name} with {len(queues[task.task_id])} jobs.")
+        else:
+            streaming[task.task_id] = upstream.task_id
+            for job_id in upstream.jobs.filter(State.COMPLETED):
+                feed(task, job_id)
+            logger.info(f"Started task {task.name} streaming from task {upstream.name}.")
+
+    def enqueue(task, job_id):
+        if job_id not in queued[task.task_id]:
+            queued[task.task_id].add(job_id)
+            queues[task.task_id].append(job_id)
+
+    def feed(task, upstream_job_id):
+        job_id = task.follow(upstream_job_id)
+        if job_id is not None and task.jobs[job_id].status == State.ASSIGNED:
+            enqueue(task, job_id)
+
+    while True:
+        # start every task whose dependencies are done
+        for task in tasks.values():
+            if task.task_id in closed or task.task_id in queues:
+                continue
+            if all( done(prev.task_id) for prev in task.prev ):
+                start(task)
+                continue
+            # NOTE: a task reading the outputs of a running task may follow it job by job
+            upstream = task.input_data.from_task
+            if stream and upstream and upstream.task_id in queues and upstream.task_id not in closed and \
+               all( done(prev.task_id) for prev in task.prev if prev is not upstream ):
+                start(task, upstream=upstream)
+
+        # dispatch jobs in task order while there are free cpus
+        for task_id, queue in queues.items():
+            task = tasks[task_id]
+            while queue:
+                job_id = queue[0]
+                workarea = f"{task.path}/works/job_{job_id}"
+                os.makedirs(workarea, exist_ok=True)
+                if not pool.submit( (task_id, job_id),
+                                    task.job_command(job_id),
+                                    cpus=task.cpus or 1,
+                                    stdout=f"{workarea}/output.out",
+                                    stderr=f"{workarea}/output.err" ):
+                    break
+                queue.popleft()
+                running[task_id] += 1
+
+        if len(pool) == 0:
+            break
+
+        for (task_id, job_id), exit_code in pool.wait():
+            task = tasks[task_id]
+            job  = task.jobs[job_id]
+            if job.status not in [State.COMPLETED, State.FAILED]:
+                # NOTE: the job runner died before recording the job result
+                logger.error(f"Job {job_id} of task {task.name} exited with code {exit_code} without a final status.")
+                job.fail(Reason.LOST, exit_code)
+            logger.info(f"Job {job_id} of task {task.name} finished with status {job.status.value}.")
+            if task_id not in running:
+                # NOTE: the task was canceled while this job was running
+                continue
+            running[task_id] -= 1
+            if job.status == State.COMPLETED:
+                for other_id, upstream_id in streaming.items():
+                    if upstream_id == task_id:
+                        feed(tasks[other_id], job_id)
+            try_close(task)
+
+    pending = [ task.name for task in tasks.values() if task.task_id not in closed ]
+    if pending:
+        logger.warning(f"Tasks {', '.join(pending)} were not executed.")
+    logger.info("Flow execution finished.")
@@ -2,6 +2,7 @@ __all__ = []
 
 import json
 import typer
+from typing import Optional
 try:
     from typing import Annotated
 except ImportError:
@@ -9,33 +10,162 @@ except ImportError:
 import traceback
 import multiprocessing
 import shutil
+import signal
+import socket
+import tempfile
 import os, sys
 
-from time import sleep
+from time import time
+from datetime import datetime
 from loguru import logger
 from pprint import pprint
-from maestro_lightning import setup_logs, Popen, symlink
-from maestro_lightning import Job, State
+from maestro_lightning import setup_logs, Popen, Heartbeat, symlink
+from maestro_lightning import Job, State, Reason, get_history
+from maestro_lightning import copy_files, NodeCache, get_result_cache
+from maestro_lightning.exceptions import TransferError
+
+
+#
+# NOTE: besides the outputs, files smaller than this left by the job in a
+# scratch folder (e.g. logs) are copied back into the shared workarea.
+#
+log_size_limit = 64 * 1024**2
+
+
+def requested_resources() -> dict:
+    """Return the memory (MB) and time (s) given to the job by SLURM, when known."""
+    mem_mb = os.environ.get("SLURM_MEM_PER_NODE", None)
+    start  = os.environ.get("SLURM_JOB_START_TIME", None)
+    end    = os.environ.get("SLURM_JOB_END_TIME", None)
+    return {
+        "mem_mb" : int(mem_mb) if mem_mb else None,
+        "time_s" : int(end) - int(start) if start and end else None,
+    }
+
+def classify(exit_code : int, oom_kills : int=0, terminated : float=None, memory_peak_mb : float=0) -> Reason:
+    """
+    Find out why a job failed from the exit code of its command and the signals received.
+
+    Parameters:
+    ----------
+    exit_code : int
+        The exit code of the command (negative when killed by a signal).
+    oom_kills : int
+        The number of processes killed by the memory limit of the job cgroup.
+    terminated : float
+        When the runner received SIGTERM from SLURM, if it did.
+    memory_peak_mb : float
+        The peak memory of the job, used when the cgroup is not available.
+
+    Returns:
+        Reason: OOM, TIMEOUT, SIGNAL or EXIT.
+    """
+    if oom_kills > 0:
+        return Reason.OOM
+    if terminated is not None:
+        # NOTE: SLURM sends SIGTERM at the end of the time limit, but also on scancel and preemption
+        end = os.environ.get("SLURM_JOB_END_TIME", None)
+        return Reason.TIMEOUT if end and terminated >= int(end) - 60 else Reason.SIGNAL
+    if exit_code < 0 or exit_code > 128:
+        signum = -exit_code if exit_code < 0 else exit_code - 128
+        mem_mb = requested_resources()["mem_mb"]
+        if signum == signal.SIGKILL and mem_mb and memory_peak_mb >= 0.9 * mem_mb:
+            return Reason.OOM
+        return Reason.SIGNAL
+    return Reason.EXIT
 
 def run_job(
-    input           : Annotated[str, typer.Option("--input", "-i", help="The job input file")],
+    input           : Annotated[str, typer.Option("--input", "-i", help="The job input file or the task job manifest")],
     output          : Annotated[str, typer.Option("--output", "-o", help="The job output")] = "circuit.json",
-    message_level   : Annotated[str, typer.Option("--message-level", "-m", help="The job message level (DEBUG, INFO, WARNING, ERROR)")] = "INFO"
+    job_id          : Annotated[Optional[int], typer.Option("--job-id", "-j", help="The job id to be read from the task job manifest")] = None,
+    message_level   : Annotated[str, typer.Option("--message-level", "-m", help="The job message level (DEBUG, INFO, WARNING, ERROR)")] = "INFO",
+    heartbeat       : Annotated[float, typer.Option("--heartbeat", "-b", help="The interval, in seconds, between two heartbeats of the job")] = 60,
+    scratch         : Annotated[Optional[str], typer.Option("--scratch", "-s", help="Run the job inside a node-local folder under this path (e.g. '$TMPDIR') and copy its outputs out at the end")] = None,
+    cache           : Annotated[Optional[str], typer.Option("--cache", help="Read the secondary data through a node-local cache in this folder (e.g. '$TMPDIR/maestro')")] = None,
+    cache_size      : Annotated[Optional[float], typer.Option("--cache-size", help="The maximum size of the node-local cache, in GB. Defaults to half of its filesystem.")] = None,
+    cache_age       : Annotated[Optional[float], typer.Option("--cache-age", help="Evict node-local cache entries not used for this many hours")] = None,
+    stage_image     : Annotated[bool, typer.Option("--stage-image", help="Copy the image into the node-local cache (default '$TMPDIR/maestro') and run from there")] = False,
+    reuse           : Annotated[bool, typer.Option("--reuse", help="Take the job outputs from the result cache when an identical job already ran, and store them otherwise")] = False,
 ):
     """
     Run a job.
+
+    With a scratch path, the command runs in a private folder on the node
+    instead of the shared workarea. At the end, outputs and small files
+    (e.g. logs) are copied out in parallel and verified against their
+    checksums before the job is marked as completed.
+
+    With a cache folder, secondary data are copied once per node into it
+    and shared by every job running there, instead of being read by each
+    job from the shared storage. With '--stage-image', the same is done for
+    the singularity image, checked against the digest taken by 'maestro run task'.
+
+    With '--reuse', a job identical to one found in the result cache is
+    completed with the cached outputs without running.
     """
     setup_logs(name="job_runner", level=message_level)
     workarea = output
+    rundir   = output
+    node_cache  = None
+    image_cache = None
 
-    logger.info(f"loaded job from input file {input}.")
-    with open(input, 'r') as f:    
-        job = Job.from_dict(json.load(f))
+    if job_id is not None:
+        logger.info(f"loaded job {job_id} from job manifest {input}.")
+        job = Job.from_manifest(input, job_id)
+    else:
+        logger.info(f"loaded job from input file {input}.")
+        with open(input, 'r') as f:    
+            job = Job.from_dict(json.load(f))
         
     logger.info(f"job id: {job.job_id}")
     logger.info("reset job status...")
     job.reset()
     job.status = State.PENDING
+
+    # NOTE: the flow folder keeps the digest of the image
+    basepath = os.path.dirname(os.path.dirname(job.task_path))
+    if reuse:
+        meta = job.reuse(get_result_cache(), basepath)
+        if meta:
+            logger.info(f"job outputs reused from the result cache, saving {meta['cpu_hours']:.2f} cpu hours.")
+            sys.exit(0)
+
+    start_time = datetime.now()
+    terminated = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(time()))
+    beats = Heartbeat(job.ping, interval=heartbeat)
+    beats.start()
+
+    def finish(status : State, reason : Reason=Reason.NONE, exit_code : int=0):
+        beats.stop()
+        if rundir != workarea:
+            shutil.rmtree(rundir, ignore_errors=True)
+        for c in (node_cache, image_cache):
+            if c:
+                c.release()
+        if status == State.FAILED:
+            logger.error(f"job failed ({reason.value}, exit code {exit_code}).")
+            job.fail(reason, exit_code)
+        else:
+            job.status = status
+        record = {
+            "job_id"       : job.job_id,
+            "attempt"      : job.attempt,
+            "status"       : status.value,
+            "reason"       : reason.value,
+            "exit_code"    : exit_code,
+            "start_time"   : start_time.isoformat(),
+            "end_time"     : datetime.now().isoformat(),
+            "slurm_job_id" : os.environ.get("SLURM_JOB_ID", None),
+            "node"         : socket.gethostname(),
+        }
+        record.update(requested_resources())
+        if node_cache:
+            record.update(node_cache.stats())
+        if image_cache:
+            record.update({ f"image_{key}" : value for key, value in image_cache.stats().items() })
+        get_history(job.task_path).append(record)
+        sys.exit(0)
     
     command = job.command
     job_id = job.job_id
@@ -43,50 +173,92 @@ def run_job(
     logger.info("starting...")
     os.makedirs(workarea, exist_ok=True)
     logger.info(f"workarea {workarea} created.")
+    if scratch:
+        base = os.path.expandvars(scratch)
+        if '$' not in base and os.path.isdir(base):
+            rundir = tempfile.mkdtemp(prefix=f"job_{job_id}_", dir=base)
+            logger.info(f"running inside the scratch folder {rundir}.")
+        else:
+            logger.warning(f"scratch path {scratch} not available. Running inside the workarea.")
     logger.info("preparing command...")
     print(command)
     
     logger.info(f"starting env builder for job {job_id}...")
     logger.info(f"workarea {workarea}...")
 
+    if cache or stage_image:
+        base = os.path.expandvars(cache or "$TMPDIR/maestro")
+        if '$' not in base:
+            capacity = cache_size * 1024**3 if cache_size else None
+            max_age  = cache_age * 3600 if cache_age else None
+            try:
+                node_cache  = NodeCache(base, capacity=capacity, max_age=max_age) if cache else None
+                image_cache = NodeCache(f"{base}/images", capacity=capacity, max_age=max_age) if stage_image else None
+            except Exception as e:
+                # NOTE: the caches only save reads, so a job never fails because of them
+                logger.warning(f"could not open the cache {base}: {e} Reading from the shared storage.")
+                node_cache = image_cache = None
+        else:
+            logger.warning(f"cache path {cache or '$TMPDIR/maestro'} not available. Reading from the shared storage.")
+
     if job.image:
         logger.info("preparing singularity image...")
         image = job.image.path
+        if image_cache:
+            try:
+                digest = job.image.digest(basepath)
+                if digest is None:
+                    # NOTE: an image staged without a digest could be a corrupted or changed copy
+                    logger.warning(f"image {image} has no up to date digest. Hashing it before staging it.")
+                    digest = job.image.prestage(basepath)
+                image = image_cache.get(image, digest=digest)
+            except Exception as e:
+                logger.warning(f"could not stage {image}: {e} Reading it from the shared storage.")
+                image = job.image.path
         imagename = image.split('/')[-1]
         logger.info(f"using singularity image with name {imagename}.")
-        linkpath = symlink(image, f"{workarea}/{imagename}")
+        linkpath = symlink(image, f"{rundir}/{imagename}")
         image = linkpath
         logger.info(f"singularity image linked to workarea at {linkpath}.")
-    
+
     logger.info("creating secondary data links inside of the job workarea...")
     for key, dataset in job.secondary_data.items():
         logger.info(f"creating secondary data link for {dataset.name} inside of the job workarea.")
-        linkpath = symlink(dataset.path, f"{workarea}/{dataset.name}")
+        path = dataset.path
+        if node_cache:
+            try:
+                path = node_cache.get(dataset.path)
+            except Exception as e:
+                logger.warning(f"could not cache {dataset.path}: {e} Reading it from the shared storage.")
+        linkpath = symlink(path, f"{rundir}/{dataset.name}")
         command = command.replace(f"%{key}", linkpath)
 
     logger.info("creating input data link inside of the job workarea...")
     input_data = job.input_file
+    if not os.path.exists(input_data):
+        # NOTE: jobs planned ahead of their inputs fail here when the upstream job failed
+        logger.error(f"input file {input_data} not found.")
+        finish(State.FAILED, Reason.EXIT)
     filename = input_data.split('/')[-1]
     dataset_name = input_data.split('/')[-2]
-    linkpath = symlink(input_data, f"{workarea}/{dataset_name}.{filename}")
+    linkpath = symlink(input_data, f"{rundir}/{dataset_name}.{filename}")
     command = command.replace("%IN", linkpath)
       
     logger.info("preparing output data locations...")
     outputs = []
-    outputs_data = job.outputs
-    for key, (filename, dataset) in outputs_data.items():
+    for key, targetpath in job.output_files().items():
+        filename, dataset = job.outputs[key]
         logger.info(f"preparing output file {filename} for dataset {dataset.name}...")
-        targetpath = dataset.path
-        filename, extension = os.path.splitext(filename)
-        filename = f"{filename}.{job_id}{extension}"
-        targetpath = f"{targetpath}/{filename}"
-        sourcepath = f"{workarea}/{filename}"
+        sourcepath = f"{rundir}/{os.path.basename(targetpath)}"
+        if os.path.islink(sourcepath):
+            # NOTE: a link left by a previous attempt would be moved over its own target
+            os.remove(sourcepath)
         command = command.replace(f"%{key}", sourcepath)
         outputs.append((sourcepath, targetpath))
         
     entrypoint = f"{workarea}/entrypoint.sh"
     with open(entrypoint, 'w') as f:
-        f.write(f"cd {workarea}\n")
+        f.write(f"cd {rundir}\n")
         f.write(command)
             
     try:
@@ -104,11 +276,12 @@ def run_job(
         envs = {}
         pprint(os.environ)
         envs["JOB_ID"] = f"{job_id}"
-        envs["JOB_WORKAREA"] = workarea 
+        envs["JOB_WORKAREA"] = rundir 
         envs["TF_CPP_MIN_LOG_LEVEL"] = "3"
         envs["CUDA_VISIBLE_ORDER"] = "PCI_BUS_ID"
         envs["CUDA_VISIBLE_DEVICES"] = os.environ.get("CUDA_VISIBLE_DEVICES", "-1")
-        envs["OMP_NUM_THREADS"] = str(multiprocessing.cpu_count())
+        # NOTE: use the cpus given to the job by the backend (local pool or SLURM) when known
+        envs["OMP_NUM_THREADS"] = os.environ.get("MAESTRO_CPUS", os.environ.get("SLURM_CPUS_PER_TASK", str(multiprocessing.cpu_count())))
         envs["SLURM_CPUS_PER_TASK"] = envs["OMP_NUM_THREADS"]
         envs["SLURM_MEM_PER_NODE"] = os.environ.get("SLURM_MEM_PER_NODE", '2048')
         envs.update(job.envs)
@@ -123,32 +296,60 @@ def run_job(
         
         logger.info("updating job status to running...")
         job.status = State.RUNNING
-        while proc.is_alive():
-            sleep(10)
+        proc.join()
+        metrics = proc.metrics()
+        metrics["cpus"] = int(envs["OMP_NUM_THREADS"])
+        logger.info(f"job metrics: {metrics}")
+        job.metrics = metrics
     except:
         traceback.print_exc()
         logger.error("error during the job execution.")
-        job.status = State.FAILED
-        sys.exit(0)
+        finish(State.FAILED, Reason.EXIT)
 
     logger.info("job execution completed.")
-    if proc.status() != "completed":
+    if proc.status() != "completed" or proc.exitcode or terminated:
         logger.error(f"something happing during the job execution. exiting with status {proc.status()}")
-        job.status = State.FAILED
-        sys.exit(0)
+        exit_code = proc.exitcode or 0
+        finish(State.FAILED, classify(exit_code, proc.oom_kills(), terminated[0] if terminated else None, metrics["sys_memory_mb_peak"]), exit_code)
     
     logger.info("uploading output files into the storage...")
     for filename, targetpath in outputs:
-        logger.info(f"uploading output file {filename} to storage location {targetpath}...")
-        if os.path.exists(filename):
+        if not os.path.exists(filename):
+            logger.error(f"output file {filename} not found in workarea {rundir}.")
+            finish(State.FAILED, Reason.EXIT)
+
+    if rundir == workarea:
+        for filename, targetpath in outputs:
+            logger.info(f"uploading output file {filename} to storage location {targetpath}...")
             shutil.move(filename, targetpath)
             symlink(targetpath, filename)
-        else:
-            logger.error(f"output file {filename} not found in workarea {workarea}.")
-            job.status = State.FAILED
-            sys.exit(0)
+    else:
+        files = list(outputs)
+        for name in os.listdir(rundir):
+            path = f"{rundir}/{name}"
+            if path not in [filename for filename, _ in outputs] and not os.path.islink(path) and \
+               os.path.isfile(path) and os.path.getsize(path) < log_size_limit:
+                files.append((path, f"{workarea}/{name}"))
+        logger.info(f"copying {len(files)} files out of the scratch folder...")
+        try:
+            copy_files(files)
+        except TransferError as e:
+            logger.error(str(e))
+            finish(State.FAILED, Reason.TRANSFER)
+        for filename, targetpath in outputs:
+            symlink(targetpath, f"{workarea}/{os.path.basename(filename)}")
+        logger.info("all files copied out and verified.")
             
+    if node_cache:
+        logger.info(f"node cache: {node_cache.stats()}")
+    if image_cache:
+        logger.info(f"image cache: {image_cache.stats()}")
+    if reuse:
+        logger.info("storing the job outputs in the result cache...")
+        try:
+            job.store(get_result_cache(), basepath, cpu_hours=metrics["exec_time"] * metrics["cpus"] / 3600)
+        except Exception as e:
+            logger.warning(f"could not store the job outputs in the result cache: {e}")
     logger.info("job completed successfully.")
     job.ping()
-    job.status = State.COMPLETED
-    sys.exit(0)
+    finish(State.COMPLETED)
@@ -0,0 +1,72 @@
+__all__ = []
+
+import os
+import typer
+from typing import Optional
+try:
+    from typing import Annotated
+except ImportError:
+    from typing_extensions import Annotated
+from loguru import logger
+from maestro_lightning import State, Pool, setup_logs
+from maestro_lightning.models.table import get_status_table
+from maestro_lightning.models.manifest import JobManifest
+
+
+def run_pack(
+    input           : Annotated[str, typer.Option("--input", "-i", help="The task job manifest")],
+    jobs            : Annotated[int, typer.Option("--jobs", "-k", help="The number of jobs running at the same time")],
+    cpus            : Annotated[int, typer.Option("--cpus", "-c", help="The number of CPUs of each job. Defaults to an even share of the allocation.")] = None,
+    heartbeat       : Annotated[float, typer.Option("--heartbeat", "-b", help="The interval, in seconds, between two heartbeats of each job")] = 60,
+    scratch         : Annotated[Optional[str], typer.Option("--scratch", "-s", help="Run each job inside a node-local folder under this path")] = None,
+    cache           : Annotated[Optional[str], typer.Option("--cache", help="The node-local cache folder of the secondary data")] = None,
+    cache_size      : Annotated[Optional[float], typer.Option("--cache-size", help="The maximum size of the node-local cache, in GB")] = None,
+    cache_age       : Annotated[Optional[float], typer.Option("--cache-age", help="Evict node-local cache entries not used for this many hours")] = None,
+    stage_image     : Annotated[bool, typer.Option("--stage-image", help="Copy the image into the node-local cache")] = False,
+    reuse           : Annotated[bool, typer.Option("--reuse", help="Reuse and store job outputs in the result cache")] = False,
+    message_level   : Annotated[str, typer.Option("--message-level", "-m", help="The job message level (DEBUG, INFO, WARNING, ERROR)")] = "INFO"
+):
+    """
+    Run several jobs of a task inside a single allocation.
+
+    Jobs are claimed from the task status table, so concurrent packs never
+    run the same job, and each one is executed by 'maestro run job' pinned to
+    its own cores. A new job is claimed whenever a slot frees up, until no
+    assigned job is left in the task.
+    """
+    setup_logs(name="pack_runner", level=message_level)
+    task_path = JobManifest(input).header["task_path"]
+    table     = get_status_table(task_path)
+    cores     = len(os.sched_getaffinity(0))
+    cpus      = min(cores, cpus or max(1, cores // jobs))
+    pool      = Pool(cpus=min(cores, cpus * jobs), pin=True)
+    logger.info(f"running up to {pool.cpus // cpus} jobs of task {task_path} with {cpus} cpus each.")
+    options = f" -b {heartbeat}"
+    options+= f" -s '{scratch}'" if scratch else ""
+    options+= f" --cache '{cache}'" if cache else ""
+    options+= f" --cache-size {cache_size}" if cache_size else ""
+    options+= f" --cache-age {cache_age}" if cache_age else ""
+    options+= " --stage-image" if stage_image else ""
+    options+= " --reuse" if reuse else ""
+
+    while True:
+        for job_id in table.claim(pool.free // cpus):
+            workarea = f"{task_path}/works/job_{job_id}"
+            os.makedirs(workarea, exist_ok=True)
+            logger.info(f"claimed job {job_id}.")
+            pool.submit( job_id,
+                         f"maestro run job -i {input} -j {job_id} -o {workarea}{options}",
+                         cpus=cpus,
+                         stdout=f"{workarea}/output.out",
+                         stderr=f"{workarea}/output.err" )
+        if len(pool) == 0:
+            break
+        for job_id, exit_code in pool.wait():
+            status = table.get(job_id)
+            if status.status not in [State.COMPLETED, State.FAILED]:
+                # NOTE: the job runner died before recording the job result
+                logger.error(f"job {job_id} exited with code {exit_code} without a final status.")
+                table.update(job_id, status=State.FAILED, exit_code=exit_code)
+            logger.info(f"job {job_id} finished with status {table.get(job_id).status.value}.")
+
+    logger.info("no assigned jobs left.")
@@ -1,13 +1,17 @@
 __all__ = []
 
+import sys
+import math
 import typer
+from time import sleep
+from typing import Dict, List, Tuple
 try:
     from typing import Annotated
 except ImportError:
     from typing_extensions import Annotated
 from loguru import logger
-from maestro_lightning import State, get_context 
-from maestro_lightning import sbatch, setup_logs 
+from maestro_lightning import State, retryable, get_context 
+from maestro_lightning import sbatch, split_array, scancel, squeue, setup_logs 
 from maestro_lightning.flow import load
 from maestro_lightning.models import Task
 
@@ -15,10 +19,16 @@ def run_init(
     index           : Annotated[int, typer.Option("--index", "-i", help="The task index")],
     task_file       : Annotated[str, typer.Option("--task-file", "-t", help="The task file input")],
     message_level   : Annotated[str, typer.Option("--message-level", help="The logging message level")] = "INFO",
-    dry_run         : Annotated[bool, typer.Option("--dry-run", help="Perform a dry run without executing any tasks.")] = False
+    dry_run         : Annotated[bool, typer.Option("--dry-run", help="Perform a dry run without executing any tasks.")] = False,
+    learn           : Annotated[bool, typer.Option("--learn", help="Learn the task profile from the pilot jobs before submitting the others.")] = False,
 ):
     """
     Initialize a task.
+
+    When the task has pilot jobs and no learned profile, only the pilots are
+    submitted, followed by this same command with '--learn', which learns the
+    resource profile from their metrics and submits the remaining jobs with
+    right-sized requests.
     """
     setup_logs(name=f"task_runner:{index}", level=message_level)
     ctx = get_context(clear=True)
@@ -32,30 +42,104 @@ def run_init(
     virtualenv = ctx["virtualenv"]
     condaenv = ctx["condaenv"]
     slurm_ops = {
-        "OUTPUT_FILE": f"{task.path}/logs/task_end_{task.task_id}.out",
-        "ERROR_FILE": f"{task.path}/logs/task_end_{task.task_id}.err",
-        "JOB_NAME": f"next-{task.task_id}",
         "PARTITION": partition,
     }
     
     if task.has_jobs():
         logger.info(f"Fetched task {task.name} for initialization.")
         task.status = State.RUNNING  
+        if task.stage_image and task.image and not dry_run:
+            logger.info(f"Pre-staging image {task.image.name} for task {task.name}.")
+            task.image.prestage(ctx.path)
+        if learn:
+            task.learn_profile()
+        pilots = [] if learn else task.pilot_jobs()
+        if pilots:
+            logger.info(f"Submitting {len(pilots)} pilot jobs for task {task.name}.")
+            job_ids = task.submit(dry_run=dry_run, job_ids=pilots)
+            if not job_ids:
+                fail_submission(task, dry_run=dry_run)
+                return
+            slurm_ops["OUTPUT_FILE"] = f"{task.path}/logs/task_scale_{task.task_id}.out"
+            slurm_ops["ERROR_FILE"]  = f"{task.path}/logs/task_scale_{task.task_id}.err"
+            slurm_ops["JOB_NAME"]    = f"scale-{task.task_id}"
+            slurm_ops["DEPENDENCY"]  = f"afterany:{':'.join(str(job_id) for job_id in job_ids)}"
+            script = sbatch(f"{task.path}/scripts/scale_task_{task.task_id}.sh", 
+                            opts=slurm_ops, 
+                            virtualenv=virtualenv, 
+                            condaenv=condaenv
+                           )
+            command = f"maestro run task -t {ctx.path}/flow.json -i {task.task_id} --learn"
+            script += command
+            logger.info(f"Submitting scaling script for task {task.name}.")
+            print(command)
+            if not dry_run:
+                script.submit()
+            return
         # create the main script
         logger.info(f"Submitting main script for task {task.name}.")
         if task.has_jobs():
-            job_id = task.submit(dry_run=dry_run)
-            logger.info(f"Submitted task {task.name} with job ID {job_id}.")
-            slurm_ops["DEPENDENCY"] = f"afterok:{job_id}"
+            job_ids = task.submit(dry_run=dry_run)
+            if not job_ids:
+                fail_submission(task, dry_run=dry_run)
+                return
+            logger.info(f"Submitted task {task.name} with job IDs {job_ids}.")
+            # NOTE: afterany, since elements killed by SLURM (e.g. time limit) must still be retried or counted
+            submit_closing(task, f"afterany:{':'.join(str(job_id) for job_id in job_ids)}", dry_run=dry_run)
+            return
     else:
         logger.info(f"Task {task.name} already completed. Skipping initialization.")
+    submit_closing(task, dry_run=dry_run)
+
+def cancel_next(task : Task):
+    """Cancel every task depending, directly or not, on a failed task."""
+    for next_task in task.next:
+        logger.info(f"Canceling dependent task {next_task.name}.")
+        next_task.status = State.CANCELED
+        cancel_next(next_task)
+
+def fail_submission(task : Task, dry_run : bool=False):
+    """
+    Fail a task none of whose arrays was accepted by SLURM, instead of chaining
+    a closing script on an empty dependency.
+    """
+    logger.error(f"No array of task {task.name} was submitted. Marking the task as failed.")
+    task.status = State.FAILED
+    if not dry_run:
+        cancel_next(task)
 
+def submit_closing(task : Task, dependency : str=None, begin : str=None, dry_run : bool=False):
+    """
+    Submit the script running 'maestro run next' for a task.
+
+    Parameters:
+    ----------
+    task : Task
+        The task to be closed.
+    dependency : str
+        The SLURM dependency of the script (e.g. 'afterok:123').
+    begin : str
+        Do not start the script before this time (e.g. 'now+300').
+    dry_run : bool
+        Write the script without submitting it.
+    """
+    ctx = get_context()
+    slurm_ops = {
+        "OUTPUT_FILE": f"{task.path}/logs/task_end_{task.task_id}.out",
+        "ERROR_FILE": f"{task.path}/logs/task_end_{task.task_id}.err",
+        "JOB_NAME": f"next-{task.task_id}",
+        "PARTITION": ctx["partition"],
+    }
+    if dependency:
+        slurm_ops["DEPENDENCY"] = dependency
+    if begin:
+        slurm_ops["BEGIN"] = begin
     # create the closing script
     logger.info(f"Creating closing script for task {task.name}.")
     script = sbatch(f"{task.path}/scripts/close_task_{task.task_id}.sh", 
                      opts=slurm_ops, 
-                     virtualenv=virtualenv, 
-                     condaenv=condaenv
+                     virtualenv=ctx["virtualenv"], 
+                     condaenv=ctx["condaenv"]
                     )    
     command = f"maestro run next -t {ctx.path}/flow.json -i {task.task_id}"
     script += command
@@ -64,11 +148,137 @@ def run_init(
     if not dry_run:
         script.submit()
 
+def reap_jobs(task : Task, timeout : float=None) -> List[int]:
+    """
+    Mark as lost the running jobs of a task which stopped sending heartbeats.
+
+    Lost jobs are FAILED with the LOST reason, which is retryable, so they are
+    requeued by the task closing within the task max_attempts.
+
+    Parameters:
+    ----------
+    task : Task
+        The task to be scanned.
+    timeout : float
+        The age in seconds of a stale heartbeat. Defaults to the task stale_after.
+
+    Returns:
+        List[int]: The ids of the lost jobs.
+    """
+    job_ids = task.table.reap(task.stale_after if timeout is None else timeout)
+    for job_id in job_ids:
+        status = task.table.get(job_id)
+        logger.warning(f"Job {job_id} of task {task.name} is lost (last heartbeat at {status.last_time.isoformat()}).")
+        task.history.append({
+            "job_id"     : job_id,
+            "attempt"    : status.attempt,
+            "status"     : State.FAILED.value,
+            "reason"     : status.reason.value,
+            "exit_code"  : status.exit_code,
+            "start_time" : status.start_time.isoformat(),
+            "end_time"   : status.last_time.isoformat(),
+        })
+    return job_ids
+
+def requeue_jobs(task : Task) -> Dict[Tuple[Tuple[str, str], ...], List[int]]:
+    """
+    Assign again the failed jobs of a task which may succeed on a new attempt.
+
+    Jobs killed by the memory limit, by the time limit or by a signal, and
+    lost jobs, are retried until the task max_attempts, with more memory or
+    time when they ran out of it. Their attempt is counted and they are moved
+    back to ASSIGNED, and the others count as failed when the task is closed.
+
+    Parameters:
+    ----------
+    task : Task
+        The task with failed jobs.
+
+    Returns:
+        Dict[Tuple[Tuple[str, str], ...], List[int]]: The requeued jobs, grouped
+        by the SLURM options of their next attempt.
+    """
+    groups = {}
+    # NOTE: only the status table is read, the manifest is never loaded here
+    failed   = { job_id : task.table.get(job_id) for job_id in task.get_array_of_jobs_with_status(State.FAILED) }
+    failed   = { job_id : status for job_id, status in failed.items() if status.reason in retryable and status.attempt + 1 < task.max_attempts }
+    attempts = task.history.by_job(failed.keys()) if failed else {}
+    for job_id, status in failed.items():
+        resources = task.escalate(job_id, status.reason, history=attempts[job_id])
+        logger.info(f"Retrying job {job_id} of task {task.name} ({status.reason.value}, attempt {status.attempt + 1}) with {resources}.")
+        task.table.update(job_id, status=State.ASSIGNED, attempt=status.attempt + 1)
+        groups.setdefault(tuple(sorted(resources.items())), []).append(job_id)
+    return groups
+
+def retry_jobs(task : Task, dry_run : bool=False) -> List[int]:
+    """
+    Resubmit the failed jobs of a task which may succeed on a new attempt.
+
+    The jobs are requeued by `requeue_jobs` and the jobs with the same
+    requests are submitted together.
+
+    Parameters:
+    ----------
+    task : Task
+        The task with failed jobs.
+    dry_run : bool
+        Write the scripts without submitting them.
+
+    Returns:
+        List[int]: The IDs of the submitted arrays, empty when nothing was retried.
+    """
+    slurm_ids = []
+    for resources, job_ids in requeue_jobs(task).items():
+        submitted = task.submit(dry_run=dry_run, job_ids=job_ids, resources=dict(resources))
+        if not submitted:
+            # NOTE: jobs left assigned would never run, so they count as failed again
+            for job_id in job_ids:
+                status = task.table.get(job_id)
+                task.table.update(job_id, status=State.FAILED, attempt=status.attempt - 1)
+        slurm_ids += submitted
+    return slurm_ids
+
+def close_task(task : Task, dry_run : bool=False) -> State:
+    """
+    Decide the final status of a task from the status of its jobs.
+
+    The task is COMPLETED when all jobs completed, FAILED when more than 10% of
+    the jobs failed (in this case all tasks depending on it are CANCELED) and
+    FINALIZED otherwise. This is shared by every backend, so a flow ends with
+    the same task states whether it runs on SLURM or in a local process pool.
+
+    Parameters:
+    ----------
+    task : Task
+        The task to be finalized.
+    dry_run : bool
+        If True, the dependent tasks are not canceled.
+
+    Returns:
+        State: The new task status.
+    """
+    count = task.count()
+    total = sum(count.values())
+    if count[State.COMPLETED.value] == total:
+        logger.info(f"All jobs for task {task.name} completed successfully.")
+        task.status = State.COMPLETED
+    elif count[State.FAILED.value] / total > 0.1:
+        logger.info(f"More than 10% of jobs for task {task.name} failed.")
+        task.status = State.FAILED
+        logger.info(f"Task {task.name} failed. Canceling dependent tasks.")
+        if not dry_run:
+            cancel_next(task)
+    else:
+        logger.info(f"Some jobs for task {task.name} failed, but within acceptable limits.")
+        task.status = State.FINALIZED
+    return task.status
+
 def run_next(
     index           : Annotated[int, typer.Option("--index", "-i", help="The task index")],
     task_file       : Annotated[str, typer.Option("--task-file", "-t", help="The task file input")],
     message_level   : Annotated[str, typer.Option("--message-level", help="The logging message level")] = "INFO",
-    dry_run         : Annotated[bool, typer.Option("--dry-run", help="Perform a dry run without executing any tasks.")] = False
+    dry_run         : Annotated[bool, typer.Option("--dry-run", help="Perform a dry run without executing any tasks.")] = False,
+    chain           : Annotated[bool, typer.Option("--chain/--no-chain", help="Submit the tasks depending on this one. Disabled when the whole flow was submitted at once.")] = True,
 ):
     """
     Finalize a task.
@@ -82,26 +292,49 @@ def run_next(
     task = tasks.get(index)
     logger.info(f"Fetched task {task.name} for finalization.")
     
-    # update task status 
-    job_status = [job.status for job in task.jobs]
-    if all([status == State.COMPLETED for status in job_status]):
-        logger.info(f"All jobs for task {task.name} completed successfully.")
-        task.status = State.COMPLETED
-    elif sum([status == State.FAILED for status in job_status]) / len(job_status) > 0.1:
-        logger.info(f"More than 10% of jobs for task {task.name} failed.")
-        task.status = State.FAILED
+    reap_jobs(task)
+    if not chain:
+        def wait_runners():
+            # NOTE: the arrays of the task ended, so running jobs with a fresh heartbeat are
+            # runners being killed; wait until they finish or their heartbeat gets stale
+            while task.get_array_of_jobs_with_status([State.PENDING, State.RUNNING]) and not dry_run:
+                sleep(task.heartbeat)
+                reap_jobs(task)
+        wait_runners()
+        # NOTE: the downstream arrays are already queued behind this finalizer, with
+        # afterok, so a non-zero exit code makes SLURM kill them
+        if task.status == State.CANCELED or any( prev.status not in [State.COMPLETED, State.FINALIZED] for prev in task.prev ):
+            logger.info(f"Task {task.name} was canceled by a failed dependency.")
+            task.status = State.CANCELED
+            sys.exit(1)
+        # NOTE: the downstream arrays wait for this finalizer, so it also waits for the retried jobs,
+        # including the lost ones, which were failed by reap_jobs
+        while not dry_run:
+            slurm_ids = retry_jobs(task)
+            if not slurm_ids:
+                break
+            logger.info(f"Waiting for the retried jobs of task {task.name} before closing it.")
+            while squeue(slurm_ids):
+                sleep(task.heartbeat)
+            reap_jobs(task)
+            wait_runners()
+        if close_task(task, dry_run=dry_run) == State.FAILED:
+            sys.exit(1)
+        return
 
-        def cancel_task(task: Task):
-            for next_task in task.next:
-                logger.info(f"Canceling dependent task {next_task.name}.")
-                next_task.status = State.CANCELED
-                cancel_task(next_task)
-        logger.info(f"Task {task.name} failed. Canceling dependent tasks.")
-        if not dry_run:
-            cancel_task(task)      
-    else:
-        logger.info(f"Some jobs for task {task.name} failed, but within acceptable limits.")
-        task.status = State.FINALIZED
+    if task.get_array_of_jobs_with_status([State.PENDING, State.RUNNING]):
+        logger.info(f"Task {task.name} still has running jobs. Checking it again in {task.stale_after} seconds.")
+        submit_closing(task, begin=f"now+{math.ceil(task.stale_after)}", dry_run=dry_run)
+        return
+
+    # NOTE: retries come first, so jobs which only ran out of resources do not count towards the failure threshold
+    slurm_ids = retry_jobs(task, dry_run=dry_run)
+    if slurm_ids:
+        logger.info(f"Waiting for the retried jobs of task {task.name} before closing it.")
+        submit_closing(task, f"afterany:{':'.join(str(job_id) for job_id in slurm_ids)}", dry_run=dry_run)
+        return
+
+    close_task(task, dry_run=dry_run)
         
     # if the current task is failed, we need to cancel the entire graph
     if task.status in [State.COMPLETED, State.FINALIZED]:
@@ -129,3 +362,112 @@ def run_next(
             logger.info(f"Submitting initialization script for task {task.name}.")
             if not dry_run:
                 script.submit()
+
+def run_dag(
+    task_file       : Annotated[str, typer.Option("--task-file", "-t", help="The task file input")],
+    message_level   : Annotated[str, typer.Option("--message-level", help="The logging message level")] = "INFO",
+    dry_run         : Annotated[bool, typer.Option("--dry-run", help="Perform a dry run without executing any tasks.")] = False
+):
+    """
+    Submit all tasks of a flow at once.
+
+    The array of each task depends (afterok) on the finalizers of the tasks it
+    depends on and the finalizer of each task depends (afterany) on its array.
+    Finalizers exit with an error when their task fails or is canceled, so SLURM
+    kills everything queued behind them. Jobs reading the outputs of another
+    task are planned from the job ids of that task before its files exist.
+
+    When the flow streams, the array of a task reading the outputs of another
+    task depends (aftercorr) on the upstream array instead, so each job starts
+    as soon as the upstream job writing its input ends.
+    """
+    setup_logs(name="dag_runner", level=message_level)
+    ctx = get_context(clear=True)
+    logger.info(f"Loading task file {task_file}.")
+    load(task_file, ctx)
+    tasks = {task.task_id: task for task in ctx.tasks.values()}
+
+    partition  = ctx["partition"]
+    virtualenv = ctx["virtualenv"]
+    condaenv   = ctx["condaenv"]
+    stream     = ctx.extra_params.get("stream", False)
+    max_size   = ctx.extra_params.get("max_array_size", 1001)
+    finalizers = {}
+    arrays     = {}
+    submitted  = []
+
+    def abort(task : Task, what : str):
+        # NOTE: a half submitted flow would run with dangling or invalid dependencies
+        logger.error(f"Could not submit the {what} of task {task.name}. Canceling the {len(submitted)} jobs already submitted.")
+        scancel(submitted)
+        for other in tasks.values():
+            if other.status not in [State.COMPLETED, State.FINALIZED]:
+                other.status = State.FAILED if other is task else State.CANCELED
+        sys.exit(1)
+
+    # NOTE: tasks can only depend on tasks created before them, so ids are a topological order
+    for task_id in sorted(tasks.keys()):
+        task = tasks[task_id]
+        if task.status in [State.COMPLETED, State.FINALIZED]:
+            logger.info(f"Task {task.name} already {task.status.value}. Skipping.")
+            continue
+
+        task.plan_jobs()
+        job_ids  = task.get_array_of_jobs_with_status() if task.has_jobs() else []
+        upstream = task.input_data.from_task
+        # NOTE: only a single array indexed by job id can be followed element by element
+        chunks   = split_array(job_ids, max_size=max_size)
+        direct   = not task.pack and len(chunks) == 1 and chunks[0][1] is None
+        # NOTE: a 1:1 link is followed element by element (aftercorr) when job i of this task
+        # reads the output of job i of the upstream array, which is always true for planned jobs
+        follow = stream and direct and upstream is not None and upstream.task_id in arrays and \
+                 set(job_ids) <= arrays[upstream.task_id][1] and \
+                 all( task.index.get(task.upstream_input(job_id)) == job_id for job_id in job_ids )
+
+        deps = [ f"afterok:{finalizers[prev.task_id]}" for prev in task.prev 
+                 if finalizers.get(prev.task_id) and not (follow and prev is upstream) ]
+        if follow:
+            logger.info(f"Task {task.name} follows the array of task {upstream.name} job by job.")
+            deps.append( f"aftercorr:{arrays[upstream.task_id][0]}" )
+        dependency = ",".join(deps) or None
+
+        closing = dependency
+        if job_ids:
+            task.status = State.RUNNING
+            if task.pilot and not task.profile:
+                # NOTE: the whole flow is queued at once, so there is no step to learn a profile in between
+                logger.warning(f"Task {task.name} has no learned profile. Pilot jobs are not run when submitting the whole flow.")
+            logger.info(f"Submitting main script for task {task.name}.")
+            slurm_ids = task.submit(dry_run=dry_run, dependency=dependency)
+            if not slurm_ids:
+                abort(task, "arrays")
+            submitted += slurm_ids
+            logger.info(f"Submitted task {task.name} with job IDs {slurm_ids}.")
+            arrays[task_id] = (slurm_ids[0], set(job_ids) if direct else set())
+            closing = f"afterany:{':'.join(str(job_id) for job_id in slurm_ids)}"
+            if follow and finalizers.get(upstream.task_id):
+                # NOTE: the finalizer decides whether this task was canceled by its upstream task
+                closing += f",afterany:{finalizers[upstream.task_id]}"
+
+        slurm_ops = {
+            "OUTPUT_FILE": f"{task.path}/logs/task_end_{task.task_id}.out",
+            "ERROR_FILE": f"{task.path}/logs/task_end_{task.task_id}.err",
+            "JOB_NAME": f"next-{task.task_id}",
+            "PARTITION": partition,
+        }
+        if closing:
+            slurm_ops["DEPENDENCY"] = closing
+            slurm_ops["KILL_ON_INVALID_DEP"] = "yes"
+        logger.info(f"Creating closing script for task {task.name}.")
+        script = sbatch(f"{task.path}/scripts/close_task_{task.task_id}.sh", 
+                         opts=slurm_ops, 
+                         virtualenv=virtualenv, 
+                         condaenv=condaenv
+                        )
+        command = f"maestro run next -t {ctx.path}/flow.json -i {task.task_id} --no-chain"
+        script += command
+        print(command)
+        finalizers[task_id] = script.submit() if not dry_run else -1
+        if finalizers[task_id] is None:
+            abort(task, "closing script")
+        submitted.append(finalizers[task_id])
@@ -0,0 +1,17 @@
+__all__ = []
+
+from . import transfer
+__all__.extend( transfer.__all__ )
+from .transfer import *
+
+from . import cache
+__all__.extend( cache.__all__ )
+from .cache import *
+
+from . import digest
+__all__.extend( digest.__all__ )
+from .digest import *
+
+from . import results
+__all__.extend( results.__all__ )
+from .results import *
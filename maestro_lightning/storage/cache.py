@@ -0,0 +1,210 @@
+__all__ = ["NodeCache"]
+
+import os
+import json
+import fcntl
+import time
+import shutil
+import hashlib
+
+from typing import Dict, List, Tuple
+from loguru import logger
+from filelock import FileLock
+from maestro_lightning.storage.transfer import copy_files
+from maestro_lightning.exceptions import TransferError
+
+
+class NodeCache:
+    """
+    Node-local LRU cache of shared read-only files and folders.
+
+    Entries live in ``{root}/data/{key}``, where the key is made of the
+    source path plus the size and modification time of every file under it,
+    so a changed source is never served from an old copy. The first process
+    asking for an entry copies it under a per-entry file lock while the
+    others wait and reuse it.
+
+    Each process holds a shared `flock` on ``{key}.use`` while it may read an
+    entry, and the modification time of that file tells when the entry was
+    last used. When a new entry does not fit in the capacity, the least
+    recently used entries which no process holds are evicted first, along
+    with those not used for longer than the maximum age.
+    """
+
+    def __init__(self, root : str, capacity : float=None, max_age : float=None):
+        """
+        Initializes the cache.
+
+        Parameters:
+        ----------
+        root : str
+            The node-local folder of the cache. It is created if needed.
+        capacity : float
+            The maximum size of the cache in bytes. Defaults to half of the filesystem holding the root.
+        max_age : float
+            Entries not used for longer than this, in seconds, are evicted. Defaults to no limit.
+        """
+        self.root     = root
+        self.data     = f"{root}/data"
+        os.makedirs(self.data, exist_ok=True)
+        self.capacity = capacity or shutil.disk_usage(root).total // 2
+        self.max_age  = max_age
+        self.hits     = 0
+        self.misses   = 0
+        self.bypassed = 0
+        self.__held   = []
+
+    @staticmethod
+    def _files(path : str) -> List[Tuple[str, int, int]]:
+        """List the (relative path, size, mtime) of every file under path, or of path itself."""
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            return [(os.path.basename(path), stat.st_size, stat.st_mtime_ns)]
+        files = []
+        for folder, _, names in os.walk(path, followlinks=True):
+            for name in names:
+                stat = os.stat(f"{folder}/{name}")
+                files.append((os.path.relpath(f"{folder}/{name}", path), stat.st_size, stat.st_mtime_ns))
+        return sorted(files)
+
+    def key(self, path : str, files : List[Tuple[str, int, int]]=None) -> str:
+        """
+        Return the cache key of path, which changes whenever a file under it changes.
+
+        Parameters:
+        ----------
+        path : str
+            The shared file or folder.
+        files : List[Tuple[str, int, int]]
+            The files under path, when already listed by `_files`.
+
+        Returns:
+            str: The key of the entry.
+        """
+        path  = os.path.realpath(path)
+        files = self._files(path) if files is None else files
+        return hashlib.sha256(json.dumps([path, files]).encode()).hexdigest()[:32]
+
+    def get(self, path : str, digest : str=None) -> str:
+        """
+        Return a node-local copy of path, filling the cache on a miss.
+
+        Parameters:
+        ----------
+        path : str
+            The shared file or folder.
+        digest : str
+            The expected sha256 digest of path, when it is a file. A copy not
+            matching it is discarded.
+
+        Returns:
+            str: The path of the copy, or path itself when it does not fit in the cache.
+        """
+        source = os.path.realpath(path)
+        files  = self._files(source)
+        key    = self.key(source, files)
+        entry  = f"{self.data}/{key}"
+        target = entry if os.path.isdir(source) else f"{entry}/{os.path.basename(source)}"
+
+        # NOTE: hold the entry before looking at it, so it can not be evicted while this process runs
+        fd = os.open(f"{entry}.use", os.O_CREAT | os.O_RDWR, 0o664)
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        self.__held.append(fd)
+
+        with FileLock(f"{entry}.lock"):
+            if os.path.isdir(entry):
+                self.hits += 1
+                os.utime(f"{entry}.use")
+                logger.info(f"cache hit for {path}.")
+                return target
+            size = sum( size for _, size, _ in files )
+            if size > self.capacity or not self.evict(size):
+                self.bypassed += 1
+                logger.warning(f"{path} does not fit in the cache {self.root}. Reading it from the shared storage.")
+                return path
+            logger.info(f"cache miss for {path}. Copying {size/1024**2:.1f} MB into {entry}.")
+            partial = f"{entry}.part.{os.getpid()}"
+            try:
+                os.makedirs(partial, exist_ok=True)
+                pairs = []
+                for name, _, _ in files:
+                    os.makedirs(os.path.dirname(f"{partial}/{name}"), exist_ok=True)
+                    pairs.append((f"{source}/{name}" if os.path.isdir(source) else source, f"{partial}/{name}"))
+                digests = copy_files(pairs)
+                if digest and list(digests.values()) != [digest]:
+                    raise TransferError(source, entry, "digest mismatch")
+                with open(f"{entry}.json", 'w') as f:
+                    json.dump({ "source" : source, "size" : size }, f)
+                os.rename(partial, entry)
+            except Exception as e:
+                shutil.rmtree(partial, ignore_errors=True)
+                self.bypassed += 1
+                logger.warning(f"could not cache {path}: {e} Reading it from the shared storage.")
+                return path
+            self.misses += 1
+            os.utime(f"{entry}.use")
+            return target
+
+    def entries(self) -> List[Dict]:
+        """List the cached entries, least recently used first."""
+        entries = []
+        for name in os.listdir(self.data):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            try:
+                with open(f"{self.data}/{name}", 'r') as f:
+                    entry = json.load(f)
+                entry["key"]       = key
+                entry["last_used"] = os.path.getmtime(f"{self.data}/{key}.use")
+            except (OSError, ValueError):
+                continue
+            entries.append(entry)
+        return sorted(entries, key=lambda entry: entry["last_used"])
+
+    def size(self) -> int:
+        """The total size of the cached entries, in bytes."""
+        return sum( entry["size"] for entry in self.entries() )
+
+    def evict(self, needed : int) -> bool:
+        """
+        Remove least recently used entries until needed bytes fit in the capacity,
+        and the entries older than the maximum age.
+
+        Entries held by any process are skipped.
+
+        Returns:
+            bool: True if there is room for needed bytes.
+        """
+        with FileLock(f"{self.root}/cache.lock"):
+            entries = self.entries()
+            used    = sum( entry["size"] for entry in entries )
+            now     = time.time()
+            for entry in entries:
+                expired = self.max_age is not None and now - entry["last_used"] > self.max_age
+                if not expired and used + needed <= self.capacity:
+                    break
+                path = f"{self.data}/{entry['key']}"
+                fd = os.open(f"{path}.use", os.O_RDWR)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    logger.info(f"evicting {entry['source']} ({entry['size']/1024**2:.1f} MB) from the cache.")
+                    os.remove(f"{path}.json")
+                    shutil.rmtree(path, ignore_errors=True)
+                    used -= entry["size"]
+                finally:
+                    os.close(fd)
+            return used + needed <= self.capacity
+
+    def stats(self) -> Dict[str, int]:
+        """The hit, miss and bypass counters of this process."""
+        return { "cache_hits" : self.hits, "cache_misses" : self.misses, "cache_bypassed" : self.bypassed }
+
+    def release(self):
+        """Release the entries held by this process, so they can be evicted."""
+        for fd in self.__held:
+            os.close(fd)
+        self.__held = []
@@ -0,0 +1,253 @@
+__all__ = ["DigestService", "get_digest_service", "path_digest"]
+
+import os
+import json
+import mmap
+import hashlib
+import threading
+
+from typing import Dict, List, Union
+from loguru import logger
+from filelock import FileLock
+from concurrent.futures import ThreadPoolExecutor
+from maestro_lightning.storage.transfer import file_digest, buffer_size
+
+
+#
+# NOTE: hashing small files is cheaper than keeping track of them, so only
+# files larger than this go through the cache.
+#
+min_size = 1024**2
+
+#
+# NOTE: the log is compacted, keeping only the records of files not changed
+# since they were hashed, once it holds this many times the records kept by
+# the last compaction (and at least compact_min lines).
+#
+compact_factor = 2
+compact_min    = 10000
+
+xattr_name = "user.maestro.sha256"
+
+
+class DigestService:
+    """
+    Computes sha256 digests of files, each file being read only once.
+
+    Digests are kept in an append-only log keyed by the inode, size and
+    modification time of the file, so a file is read again only when it
+    changes. The device is left out of the key, since the same shared file
+    may have a different device number on each node. The log is compacted
+    when it grows, dropping the records of files changed since.
+
+    When enabled, the digest is also stored in an extended attribute of the
+    file itself, which follows the file when it is renamed and is visible
+    from every node.
+
+    Large files are hashed through mmap in large blocks, and several files
+    are hashed at the same time by a thread pool (hashlib releases the GIL
+    while hashing large blocks).
+    """
+
+    def __init__(self, path : str, xattr : bool=False, workers : int=8):
+        """
+        Initializes the service.
+
+        Parameters:
+        ----------
+        path : str
+            The file path of the digest log. The file is created on the first append.
+        xattr : bool
+            Also read and write digests as extended attributes of the files.
+        workers : int
+            The number of files hashed at the same time by `digests`.
+        """
+        self.path      = path
+        self.lock_path = f"{path}.lock"
+        self.xattr     = xattr and hasattr(os, "setxattr")
+        self.workers   = workers
+        self.hits      = 0
+        self.misses    = 0
+        self.__entries = {}
+        self.__paths   = {}
+        self.__offset  = 0
+        self.__inode   = None
+        self.__lines   = 0
+        self.__live    = 0
+        self.__lock    = threading.Lock()
+
+    @staticmethod
+    def _key(stat : os.stat_result) -> str:
+        return f"{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _refresh(self):
+        """Read the entries appended to the log, by any process, since the last read."""
+        if not os.path.exists(self.path):
+            return
+        with self.__lock, open(self.path, 'r') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self.__inode or stat.st_size < self.__offset:
+                # NOTE: the log was replaced by a compaction, so it is read again from the start
+                self.__inode  = stat.st_ino
+                self.__offset = 0
+                self.__lines  = 0
+            f.seek(self.__offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    # NOTE: a line still being written is read next time
+                    break
+                self.__offset += len(line.encode())
+                self.__lines  += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "compacted" in record:
+                    self.__live = record["compacted"]
+                    continue
+                self.__entries[record["key"]] = record["digest"]
+                self.__paths[record["key"]]   = record.get("path")
+
+    def _append(self, key : str, digest : str, path : str):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with FileLock(self.lock_path):
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({ "key" : key, "digest" : digest, "path" : os.path.abspath(path) }) + "\n")
+            self._refresh()
+            if self.__lines > compact_factor * max(self.__live, compact_min):
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the log with the records of the files not changed since they were hashed. Called under the file lock."""
+        live = {}
+        for key, path in list(self.__paths.items()):
+            try:
+                if path and self._key(os.stat(path)) == key:
+                    live[key] = (self.__entries[key], path)
+            except OSError:
+                continue
+        partial = f"{self.path}.{os.getpid()}"
+        with open(partial, 'w') as f:
+            f.write(json.dumps({ "compacted" : len(live) }) + "\n")
+            for key, (digest, path) in live.items():
+                f.write(json.dumps({ "key" : key, "digest" : digest, "path" : path }) + "\n")
+        os.replace(partial, self.path)
+        logger.debug(f"compacted the digest log {self.path} from {self.__lines} to {len(live)} records.")
+        with self.__lock:
+            self.__entries = { key : digest for key, (digest, _) in live.items() }
+            self.__paths   = { key : path for key, (_, path) in live.items() }
+            self.__inode   = os.stat(self.path).st_ino
+            self.__offset  = os.path.getsize(self.path)
+            self.__lines   = len(live) + 1
+            self.__live    = len(live)
+
+    def _read_xattr(self, path : str, stat : os.stat_result) -> Union[str, None]:
+        try:
+            size, mtime, digest = os.getxattr(path, xattr_name).decode().split(":")
+        except (OSError, ValueError):
+            return None
+        return digest if int(size) == stat.st_size and int(mtime) == stat.st_mtime_ns else None
+
+    def _write_xattr(self, path : str, stat : os.stat_result, digest : str):
+        try:
+            os.setxattr(path, xattr_name, f"{stat.st_size}:{stat.st_mtime_ns}:{digest}".encode())
+        except OSError:
+            # NOTE: read-only files and filesystems without user attributes keep using the log
+            pass
+
+    @staticmethod
+    def compute(path : str) -> str:
+        """Hash a file, mapping it in memory when possible."""
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    data.madvise(mmap.MADV_SEQUENTIAL)
+                hasher = hashlib.sha256()
+                view   = memoryview(data)
+                try:
+                    for start in range(0, len(data), buffer_size):
+                        hasher.update(view[start:start + buffer_size])
+                finally:
+                    view.release()
+                return hasher.hexdigest()
+        except (OSError, ValueError):
+            # NOTE: empty files and special files can not be mapped
+            return file_digest(path)
+
+    def digest(self, path : str) -> str:
+        """
+        Return the sha256 digest of a file, reading it only if it changed since it was last hashed.
+
+        Parameters:
+        ----------
+        path : str
+            The file to be hashed.
+
+        Returns:
+            str: The hexadecimal digest.
+        """
+        stat = os.stat(path)
+        if stat.st_size < min_size:
+            return file_digest(path)
+        key = self._key(stat)
+        if key not in self.__entries:
+            self._refresh()
+        digest = self.__entries.get(key) or (self._read_xattr(path, stat) if self.xattr else None)
+        if digest:
+            self.hits += 1
+            self.__entries[key] = digest
+            return digest
+        self.misses += 1
+        logger.debug(f"hashing {path} ({stat.st_size/1024**2:.1f} MB).")
+        digest = self.compute(path)
+        # NOTE: a file changed while being hashed is not recorded
+        if self._key(os.stat(path)) == key:
+            self.__entries[key] = digest
+            self._append(key, digest, path)
+            if self.xattr:
+                self._write_xattr(path, stat, digest)
+        return digest
+
+    def digests(self, paths : List[str]) -> Dict[str, str]:
+        """Return the digest of each file, hashing the changed ones in parallel."""
+        if not paths:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(paths))) as pool:
+            return dict(zip(paths, pool.map(self.digest, paths)))
+
+    def path_digest(self, path : str) -> str:
+        """
+        Return the digest of a file, or of every file under a folder.
+
+        The digest of a folder covers the relative path and the content of each
+        file, in a stable order.
+        """
+        if os.path.isfile(path):
+            return self.digest(path)
+        files = []
+        for folder, dirs, names in os.walk(path, followlinks=True):
+            dirs.sort()
+            files.extend( f"{folder}/{name}" for name in sorted(names) )
+        hasher = hashlib.sha256()
+        for filepath, digest in self.digests(files).items():
+            hasher.update(f"{os.path.relpath(filepath, path)}:{digest}\n".encode())
+        return hasher.hexdigest()
+
+
+__service__ = None
+
+def get_digest_service() -> DigestService:
+    """
+    Return the digest service of this process, logging to MAESTRO_DIGESTS
+    (default '~/.maestro/digests.jsonl'). Extended attributes are used when
+    MAESTRO_DIGEST_XATTR is set to 1.
+    """
+    global __service__
+    if __service__ is None:
+        __service__ = DigestService(os.environ.get("MAESTRO_DIGESTS", os.path.expanduser("~/.maestro/digests.jsonl")),
+                                    xattr=os.environ.get("MAESTRO_DIGEST_XATTR", "0") == "1")
+    return __service__
+
+def path_digest(path : str) -> str:
+    """Return the digest of a file, or of every file under a folder, through the digest service."""
+    return get_digest_service().path_digest(path)
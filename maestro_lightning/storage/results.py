@@ -0,0 +1,203 @@
+__all__ = ["ResultCache", "get_result_cache"]
+
+import os
+import json
+import glob
+import shutil
+
+from time import time
+from typing import Dict, List, Union
+from loguru import logger
+from filelock import FileLock
+from maestro_lightning.storage.transfer import copy_file, partial_path
+
+
+def link_file(source : str, target : str):
+    """Hard link source at target, or copy it when they are on different filesystems."""
+    partial = partial_path(target)
+    try:
+        os.link(source, partial)
+        os.replace(partial, target)
+    except OSError:
+        if os.path.lexists(partial):
+            os.remove(partial)
+        copy_file(source, target)
+
+
+class ResultCache:
+    """
+    Content-addressed store of job outputs shared between flows.
+
+    Each entry holds the output files of a job under ``{root}/{key[:2]}/{key}``,
+    where the key is a digest of everything the job depends on (command,
+    image, environment, binds, input and secondary data). A job with a key
+    already in the store gets its outputs linked from there instead of
+    being run again.
+
+    Files are hard linked in and out of the store when possible, so outputs
+    must not be modified in place. Entries are evicted least recently used
+    first when the store grows over its capacity. The size of the store is
+    kept in a ledger ('{root}/usage'), so the entries are only listed when
+    a new one does not fit.
+    """
+
+    def __init__(self, root : str, capacity : float):
+        """
+        Initializes the store.
+
+        Parameters:
+        ----------
+        root : str
+            The folder of the store, on a filesystem shared by the nodes.
+        capacity : float
+            The maximum size of the store, in bytes.
+        """
+        self.root     = root
+        self.capacity = capacity
+        self.lock     = f"{root}/results.lock"
+        self.ledger   = f"{root}/usage"
+
+    def _entry(self, key : str) -> str:
+        return f"{self.root}/{key[:2]}/{key}"
+
+    def get(self, key : str) -> Union[Dict, None]:
+        """
+        Look up an entry, marking it as used.
+
+        Returns:
+            Union[Dict, None]: The entry metadata (its 'path', 'outputs', 'size' and
+            'cpu_hours') or None if the key is not in the store.
+        """
+        entry = self._entry(key)
+        try:
+            with open(f"{entry}/meta.json", 'r') as f:
+                meta = json.load(f)
+            os.utime(f"{entry}/meta.json")
+        except (OSError, ValueError):
+            return None
+        meta["path"] = entry
+        return meta
+
+    def put(self, key : str, files : Dict[str, str], cpu_hours : float=0) -> bool:
+        """
+        Store the outputs of a job.
+
+        Parameters:
+        ----------
+        key : str
+            The job key.
+        files : Dict[str, str]
+            The path of each output, by output name.
+        cpu_hours : float
+            The cpu hours the job took, saved by every later hit.
+
+        Returns:
+            bool: True if the outputs are in the store.
+        """
+        size = sum( os.path.getsize(path) for path in files.values() )
+        if size > self.capacity:
+            logger.warning(f"outputs of {size/1024**2:.1f} MB do not fit in the result cache {self.root}.")
+            return False
+        entry = self._entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with FileLock(f"{entry}.lock"):
+            if os.path.exists(f"{entry}/meta.json"):
+                return True
+            self.reserve(size)
+            partial = f"{entry}.part.{os.getpid()}"
+            try:
+                os.makedirs(partial, exist_ok=True)
+                for name, path in files.items():
+                    link_file(path, f"{partial}/{name}")
+                with open(f"{partial}/meta.json", 'w') as f:
+                    json.dump({ "outputs" : list(files.keys()), "size" : size, "cpu_hours" : cpu_hours, "created" : time() }, f)
+                os.rename(partial, entry)
+            except Exception as e:
+                shutil.rmtree(partial, ignore_errors=True)
+                self.reserve(-size)
+                logger.warning(f"could not store outputs in the result cache: {e}")
+                return False
+        return True
+
+    def restore(self, meta : Dict, targets : Dict[str, str]):
+        """
+        Link the outputs of an entry to their targets.
+
+        Parameters:
+        ----------
+        meta : Dict
+            The entry, as returned by `get`.
+        targets : Dict[str, str]
+            The target path of each output, by output name.
+        """
+        for name, target in targets.items():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            link_file(f"{meta['path']}/{name}", target)
+
+    def entries(self) -> List[Dict]:
+        """List the entries, least recently used first."""
+        entries = []
+        for path in glob.glob(f"{self.root}/*/*/meta.json"):
+            try:
+                with open(path, 'r') as f:
+                    meta = json.load(f)
+                meta["path"]      = os.path.dirname(path)
+                meta["last_used"] = os.path.getmtime(path)
+            except (OSError, ValueError):
+                continue
+            entries.append(meta)
+        return sorted(entries, key=lambda meta: meta["last_used"])
+
+    def _read_usage(self) -> Union[int, None]:
+        try:
+            with open(self.ledger, 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write_usage(self, used : int):
+        with open(self.ledger, 'w') as f:
+            f.write(str(max(0, used)))
+
+    def _evict(self, needed : int) -> int:
+        entries = self.entries()
+        used    = sum( meta["size"] for meta in entries )
+        for meta in entries:
+            if used + needed <= self.capacity:
+                break
+            logger.info(f"evicting {os.path.basename(meta['path'])} ({meta['size']/1024**2:.1f} MB) from the result cache.")
+            # NOTE: the metadata goes first, so readers never see an entry without its files
+            os.remove(f"{meta['path']}/meta.json")
+            shutil.rmtree(meta["path"], ignore_errors=True)
+            used -= meta["size"]
+        return used
+
+    def reserve(self, size : int):
+        """
+        Account for an entry of size bytes (released when negative) in the ledger.
+
+        The entries are only listed, and the least recently used ones evicted,
+        when the ledger is missing or the new entry does not fit.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with FileLock(self.lock):
+            used = self._read_usage()
+            if used is None or (size > 0 and used + size > self.capacity):
+                used = self._evict(max(size, 0))
+            self._write_usage(used + size)
+
+    def evict(self, needed : int=0):
+        """Remove least recently used entries until needed bytes fit in the capacity, and rebuild the ledger."""
+        os.makedirs(self.root, exist_ok=True)
+        with FileLock(self.lock):
+            self._write_usage(self._evict(needed))
+
+
+def get_result_cache() -> ResultCache:
+    """
+    Return the result cache at MAESTRO_RESULTS (default '~/.maestro/results'),
+    with a capacity of MAESTRO_RESULTS_SIZE GB (default 100).
+    """
+    root     = os.environ.get("MAESTRO_RESULTS", os.path.expanduser("~/.maestro/results"))
+    capacity = float(os.environ.get("MAESTRO_RESULTS_SIZE", 100)) * 1024**3
+    return ResultCache(root, capacity)
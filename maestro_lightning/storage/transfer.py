@@ -0,0 +1,143 @@
+__all__ = ["copy_file", "copy_files", "file_digest", "partial_path"]
+
+import os
+import shutil
+import hashlib
+
+from typing import Dict, List, Tuple
+from loguru import logger
+from concurrent.futures import ThreadPoolExecutor
+from maestro_lightning.exceptions import TransferError
+
+
+#
+# NOTE: shared filesystems (NFS, Lustre) are much faster with few large
+# requests than with many small ones, so files are streamed in large blocks.
+#
+buffer_size = 16 * 1024**2
+
+
+def partial_path(target : str) -> str:
+    """
+    Return the hidden path a file is written to before being renamed to target.
+
+    Dataset scans skip hidden files, so a partial file left in a dataset
+    folder by a killed transfer is never taken as an input.
+    """
+    folder, name = os.path.split(target)
+    return os.path.join(folder, f".{name}.part.{os.getpid()}")
+
+
+def file_digest(path : str, drop_cache : bool=False, buffer_size : int=buffer_size) -> str:
+    """
+    Compute the sha256 digest of a file, reading it in large blocks.
+
+    Parameters:
+    ----------
+    path : str
+        The file to be hashed.
+    drop_cache : bool
+        Ask the kernel to drop the cached pages of the file first, so the
+        data is read back from the storage instead of from memory.
+    buffer_size : int
+        The size of each read.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb', buffering=0) as f:
+        if drop_cache and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        buffer = bytearray(buffer_size)
+        view   = memoryview(buffer)
+        while size := f.readinto(buffer):
+            hasher.update(view[:size])
+    return hasher.hexdigest()
+
+
+def copy_file(source : str, target : str, verify : bool=True, buffer_size : int=buffer_size) -> str:
+    """
+    Copy a file in large blocks, hashing it on the way, and verify the copy.
+
+    The data is written into a temporary file next to the target, synced to
+    the storage and read back to compare digests. Only then it is renamed
+    to the target, so a target never holds a partial or corrupted copy.
+
+    Parameters:
+    ----------
+    source : str
+        The file to be copied.
+    target : str
+        The destination path.
+    verify : bool
+        Read the copy back and compare its digest with the source one.
+    buffer_size : int
+        The size of each read and write.
+
+    Returns:
+        str: The sha256 digest of the file.
+
+    Raises:
+        TransferError: If the copy does not match the source.
+    """
+    partial = partial_path(target)
+    hasher  = hashlib.sha256()
+    try:
+        with open(source, 'rb', buffering=0) as fin, open(partial, 'wb', buffering=0) as fout:
+            buffer = bytearray(buffer_size)
+            view   = memoryview(buffer)
+            while size := fin.readinto(buffer):
+                hasher.update(view[:size])
+                written = 0
+                while written < size:
+                    written += fout.write(view[written:size])
+            os.fsync(fout.fileno())
+        shutil.copymode(source, partial)
+        digest = hasher.hexdigest()
+        if verify and file_digest(partial, drop_cache=True, buffer_size=buffer_size) != digest:
+            raise TransferError(source, target, "checksum mismatch")
+        os.replace(partial, target)
+    except OSError as e:
+        raise TransferError(source, target, str(e))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return digest
+
+
+def copy_files(files : List[Tuple[str, str]], workers : int=4, retries : int=2, verify : bool=True) -> Dict[str, str]:
+    """
+    Copy several files in parallel streams, each one verified.
+
+    Parameters:
+    ----------
+    files : List[Tuple[str, str]]
+        The (source, target) pairs.
+    workers : int
+        The number of files copied at the same time.
+    retries : int
+        The number of times a failed copy is tried again.
+    verify : bool
+        Verify each copy against the digest of its source.
+
+    Returns:
+        Dict[str, str]: The digest of each target.
+
+    Raises:
+        TransferError: If any file could not be copied after all retries.
+    """
+    def copy(source : str, target : str) -> str:
+        for attempt in range(retries + 1):
+            try:
+                return copy_file(source, target, verify=verify)
+            except TransferError as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"{e} Trying again.")
+
+    if not files:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(files))) as pool:
+        futures = { target : pool.submit(copy, source, target) for source, target in files }
+        return { target : future.result() for target, future in futures.items() }
@@ -0,0 +1,48 @@
+import os
+import time
+
+from maestro_lightning.storage.cache import NodeCache
+
+
+def write(path : str, size : int) -> str:
+    with open(path, 'wb') as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_hit_and_miss(tmp_path):
+    cache  = NodeCache(f"{tmp_path}/cache", capacity=1024)
+    source = write(f"{tmp_path}/a.bin", 100)
+    target = cache.get(source)
+    assert target != source and open(target, 'rb').read() == b"x" * 100
+    assert cache.get(source) == target
+    assert cache.stats() == { "cache_hits" : 1, "cache_misses" : 1, "cache_bypassed" : 0 }
+
+def test_changed_source_gets_a_new_key(tmp_path):
+    cache  = NodeCache(f"{tmp_path}/cache", capacity=1024)
+    source = write(f"{tmp_path}/a.bin", 100)
+    files  = cache._files(source)
+    assert cache.key(source, files) == cache.key(source)
+    write(source, 200)
+    assert cache.key(source, files) != cache.key(source)
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = NodeCache(f"{tmp_path}/cache", capacity=250)
+    first, second = cache.get(write(f"{tmp_path}/a.bin", 100)), cache.get(write(f"{tmp_path}/b.bin", 100))
+    cache.release()
+    past = time.time() - 10
+    os.utime(f"{os.path.dirname(second)}.use", (past, past))
+    third = cache.get(write(f"{tmp_path}/c.bin", 100))
+    assert os.path.exists(first) and os.path.exists(third)
+    assert not os.path.exists(second)
+    assert cache.size() == 200
+
+def test_held_entries_are_not_evicted(tmp_path):
+    cache  = NodeCache(f"{tmp_path}/cache", capacity=150)
+    first  = cache.get(write(f"{tmp_path}/a.bin", 100))
+    source = write(f"{tmp_path}/b.bin", 100)
+    assert cache.get(source) == source
+    assert os.path.exists(first)
+    cache.release()
+    assert cache.get(source) != source
+    assert not os.path.exists(first)
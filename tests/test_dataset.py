@@ -0,0 +1,48 @@
+import os
+import time
+
+from maestro_lightning import Flow, Dataset
+
+
+def create(basepath : str, count : int) -> Dataset:
+    os.makedirs(f"{basepath}/jobs/sub")
+    os.makedirs(f"{basepath}/flow/datasets")
+    for index in range(count):
+        open(f"{basepath}/jobs/sub/job_{index}.json", 'w').close()
+    Flow(name="test", path=f"{basepath}/flow", level="WARNING").__enter__()
+    return Dataset(name="jobs", path=f"{basepath}/jobs")
+
+def age(basepath : str):
+    # NOTE: folders changed in the last seconds are not trusted, so they are moved to the past
+    past = time.time() - 10
+    for folder in [f"{basepath}/jobs", f"{basepath}/jobs/sub"]:
+        os.utime(folder, (past, past))
+
+
+def test_len_and_stamp_use_the_summary(tmp_path, monkeypatch):
+    dataset = create(tmp_path, 3)
+    age(tmp_path)
+    assert len(dataset) == 3
+    stamp = dataset.stamp()
+    assert stamp is not None
+    # NOTE: while no folder moved, the file records are never read again
+    monkeypatch.setattr(Dataset, "walk", lambda self: iter(()))
+    assert len(dataset) == 3
+    assert dataset.stamp() == stamp
+    assert dataset.stamp(scan=False) == stamp
+
+def test_new_file_moves_the_stamp(tmp_path):
+    dataset = create(tmp_path, 2)
+    age(tmp_path)
+    stamp = dataset.stamp()
+    open(f"{tmp_path}/jobs/sub/job_2.json", 'w').close()
+    assert dataset.stamp(scan=False) is None
+    age(tmp_path)
+    assert len(dataset) == 3
+    assert dataset.stamp() not in [stamp, None]
+    assert list(dataset) == [ f"{tmp_path}/jobs/sub/job_{index}.json" for index in range(3) ]
+
+def test_recent_folders_have_no_stamp(tmp_path):
+    dataset = create(tmp_path, 1)
+    assert len(dataset) == 1
+    assert dataset.stamp() is None
@@ -0,0 +1,61 @@
+import os
+import hashlib
+
+from maestro_lightning.storage import digest
+from maestro_lightning.storage.digest import DigestService
+
+
+def write(path : str, data : bytes) -> str:
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_files_are_hashed_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(digest, "min_size", 0)
+    path    = write(f"{tmp_path}/data", b"x" * 1000)
+    service = DigestService(f"{tmp_path}/digests.jsonl")
+    assert service.digest(path) == hashlib.sha256(b"x" * 1000).hexdigest()
+    assert service.digest(path) == hashlib.sha256(b"x" * 1000).hexdigest()
+    assert (service.hits, service.misses) == (1, 1)
+    # NOTE: another process reads the digests from the log
+    other = DigestService(f"{tmp_path}/digests.jsonl")
+    other.digest(path)
+    assert (other.hits, other.misses) == (1, 0)
+
+def test_changed_files_are_hashed_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(digest, "min_size", 0)
+    path    = write(f"{tmp_path}/data", b"x" * 1000)
+    service = DigestService(f"{tmp_path}/digests.jsonl")
+    service.digest(path)
+    write(path, b"y" * 1000)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert service.digest(path) == hashlib.sha256(b"y" * 1000).hexdigest()
+    assert service.misses == 2
+
+def test_folder_digest(tmp_path, monkeypatch):
+    monkeypatch.setattr(digest, "min_size", 0)
+    os.makedirs(f"{tmp_path}/folder/sub")
+    write(f"{tmp_path}/folder/a", b"a")
+    write(f"{tmp_path}/folder/sub/b", b"b")
+    service = DigestService(f"{tmp_path}/digests.jsonl")
+    first = service.path_digest(f"{tmp_path}/folder")
+    assert service.path_digest(f"{tmp_path}/folder") == first
+    write(f"{tmp_path}/folder/sub/c", b"c")
+    assert service.path_digest(f"{tmp_path}/folder") != first
+
+def test_log_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(digest, "min_size", 0)
+    monkeypatch.setattr(digest, "compact_min", 2)
+    path    = write(f"{tmp_path}/data", b"0")
+    service = DigestService(f"{tmp_path}/digests.jsonl")
+    for index in range(6):
+        write(path, str(index).encode() * 10)
+        os.utime(path, ns=(0, 10**9 * (index + 1)))
+        service.digest(path)
+    # NOTE: only the record of the current version of the file survives a compaction
+    lines = open(f"{tmp_path}/digests.jsonl").read().splitlines()
+    assert len(lines) < 6
+    other = DigestService(f"{tmp_path}/digests.jsonl")
+    assert other.digest(path) == hashlib.sha256(b"5" * 10).hexdigest()
+    assert other.hits == 1
@@ -0,0 +1,42 @@
+import os
+
+from maestro_lightning import Flow, Task, Dataset
+from maestro_lightning.flow import dump, load
+from maestro_lightning.models import get_context
+
+
+def define(basepath : str, names):
+    session = Flow(name="test", path=f"{basepath}/flow", level="WARNING").__enter__()
+    jobs = Dataset(name="jobs", path=f"{basepath}/jobs")
+    for name in names:
+        Task(name=name, command="run %IN %OUT", input_data=jobs, outputs={'OUT':'output.json'}, partition='cpu')
+    return session
+
+def create(basepath : str, names):
+    session = define(basepath, names)
+    ctx = get_context()
+    session.mkdir()
+    dump( ctx, f"{basepath}/flow/flow.json" )
+    [dataset.mkdir() for dataset in ctx.datasets.values()]
+    [task.mkdir() for task in ctx.tasks.values()]
+
+def reload(basepath : str):
+    ctx = get_context(clear=True)
+    load( f"{basepath}/flow/flow.json", ctx )
+    return { task.name : task.task_id for task in ctx.tasks.values() }
+
+
+def test_ids_survive_reordering(tmp_path):
+    os.makedirs(f"{tmp_path}/jobs")
+    create(tmp_path, ["A", "B", "C"])
+    define(tmp_path, ["A", "C", "B"]).extend()
+    assert reload(tmp_path) == { "A" : 0, "B" : 1, "C" : 2 }
+
+def test_ids_survive_removal(tmp_path):
+    os.makedirs(f"{tmp_path}/jobs")
+    create(tmp_path, ["A", "B", "C"])
+    define(tmp_path, ["A", "C"]).extend()
+    assert reload(tmp_path) == { "A" : 0, "C" : 2 }
+    # NOTE: a task added after the load does not take the id of the last one
+    task = Task(name="D", command="run %IN %OUT", input_data="jobs", outputs={'OUT':'output.json'}, partition='cpu')
+    assert task.task_id == 3
@@ -0,0 +1,69 @@
+import os
+import time
+
+from maestro_lightning import Flow, Task, Dataset
+from maestro_lightning.flow import dump
+from maestro_lightning.models import get_context
+from maestro_lightning.models.index import JobIndex
+
+
+def age(basepath : str):
+    # NOTE: folders changed in the last seconds have no stamp, so they are moved to the past
+    past = time.time() - 10
+    os.utime(f"{basepath}/jobs", (past, past))
+
+def create(basepath : str, count : int) -> Task:
+    os.makedirs(f"{basepath}/jobs")
+    for index in range(count):
+        open(f"{basepath}/jobs/job_{index}.json", 'w').close()
+    age(basepath)
+    session = Flow(name="test", path=f"{basepath}/flow", level="WARNING").__enter__()
+    jobs = Dataset(name="jobs", path=f"{basepath}/jobs")
+    task = Task(name="A", command="run %IN %OUT", input_data=jobs, outputs={'OUT':'output.json'}, partition='cpu')
+    ctx = get_context()
+    session.mkdir()
+    dump( ctx, f"{basepath}/flow/flow.json" )
+    [dataset.mkdir() for dataset in ctx.datasets.values()]
+    [task.mkdir() for task in ctx.tasks.values()]
+    return task
+
+
+def test_hwm(tmp_path):
+    index = JobIndex(f"{tmp_path}/index")
+    assert index.hwm is None
+    index.hwm = "stamp"
+    assert JobIndex(f"{tmp_path}/index").hwm == "stamp"
+    index.add(["a"])
+    index.clear()
+    assert index.hwm is None and len(JobIndex(f"{tmp_path}/index")) == 0
+
+def test_unchanged_inputs_are_not_scanned(tmp_path, monkeypatch):
+    task = create(tmp_path, 2)
+    assert task.index.hwm is not None
+    def scan(self):
+        raise AssertionError("the dataset was scanned")
+    monkeypatch.setattr(Dataset, "__iter__", scan)
+    task._update_jobs()
+    monkeypatch.undo()
+    open(f"{tmp_path}/jobs/job_2.json", 'w').close()
+    age(tmp_path)
+    task._update_jobs()
+    assert task.index.get(f"{tmp_path}/jobs/job_2.json") == 2
+
+def test_refresh_reads_appended_paths(tmp_path):
+    first  = JobIndex(f"{tmp_path}/index")
+    second = JobIndex(f"{tmp_path}/index")
+    assert first.add(["a", "b"]) == [0, 1]
+    assert second.add(["c"]) == [2]
+    first.refresh()
+    assert first.get("c") == 2 and len(first) == 3
+
+def test_ids_are_allocated_from_the_reloaded_index(tmp_path):
+    task = create(tmp_path, 2)
+    assert len(task.index) == 2
+    # NOTE: another runner indexes a file after this index was read
+    other = JobIndex(task.index.path)
+    other.add([f"{tmp_path}/jobs/job_9.json"])
+    assert task._add_jobs([f"{tmp_path}/jobs/job_9.json", f"{tmp_path}/jobs/job_10.json"]) == [3]
+    assert task.index.get(f"{tmp_path}/jobs/job_9.json") == 2
+    assert task.index.get(f"{tmp_path}/jobs/job_10.json") == 3
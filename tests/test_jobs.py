@@ -0,0 +1,19 @@
+from maestro_lightning.models.job import JobTable
+
+
+def table() -> JobTable:
+    return JobTable(task_path="/flow/tasks/A", outputs={}, secondary_data={}, image=None, command="run %IN")
+
+
+def test_input_files_round_trip():
+    jobs = table()
+    jobs.append(0, "/data/a/job_0.json")
+    jobs.append(1, "/data/b/job_1.json")
+    jobs.append(3, "/data/a/job_3.json")
+    assert [ jobs.input_file(job_id) for job_id in [0, 1, 3] ] == ["/data/a/job_0.json", "/data/b/job_1.json", "/data/a/job_3.json"]
+
+def test_input_file_without_folder():
+    jobs = table()
+    jobs.append(0, "job_0.json")
+    assert jobs.input_file(0) == "job_0.json"
+    assert jobs[0].input_file == "job_0.json"
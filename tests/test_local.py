@@ -0,0 +1,38 @@
+from maestro_lightning.backends.local import Pool
+
+
+def wait_all(pool : Pool) -> dict:
+    done = {}
+    while len(pool):
+        done.update(pool.wait())
+    return done
+
+
+def test_slots_are_claimed_and_released():
+    pool = Pool(cpus=2)
+    assert pool.submit("a", "sleep 0.2", cpus=2)
+    assert not pool.submit("b", "true")
+    assert pool.free == 0
+    assert wait_all(pool) == { "a" : 0 }
+    assert pool.free == 2
+    assert pool.submit("b", "true")
+    wait_all(pool)
+
+def test_large_processes_take_the_whole_pool():
+    pool = Pool(cpus=2)
+    assert pool.submit("a", "true", cpus=8)
+    assert pool.used == 2
+    wait_all(pool)
+
+def test_exit_codes_and_environment(tmp_path):
+    pool = Pool(cpus=4)
+    pool.submit("ok", "test $MAESTRO_CPUS = 2 && test $NAME = value", cpus=2, envs={"NAME" : "value"})
+    pool.submit("fail", "echo failed >&2; exit 3", stderr=f"{tmp_path}/err")
+    assert wait_all(pool) == { "ok" : 0, "fail" : 3 }
+    assert open(f"{tmp_path}/err").read() == "failed\n"
+
+def test_kill():
+    pool = Pool(cpus=1)
+    pool.submit("a", "sleep 10")
+    pool.kill()
+    assert len(pool) == 0 and pool.free == 1
@@ -0,0 +1,42 @@
+import os
+import json
+
+from maestro_lightning.models import JobManifest
+
+
+def raw(job_id : int, **fields):
+    return dict({ "job_id" : job_id, "input_file" : f"/data/file_{job_id}.json", "command" : "run %IN", "envs" : {} }, **fields)
+
+
+def test_read_seeks_to_each_record(tmp_path):
+    manifest = JobManifest(f"{tmp_path}/manifest")
+    manifest.append([ raw(0), raw(1, envs={"X" : "1"}) ])
+    manifest.append([ raw(3) ])
+    assert len(manifest) == 4
+    assert manifest.header == { "command" : "run %IN", "envs" : {} }
+    assert manifest.read(1) == raw(1, envs={"X" : "1"})
+    assert manifest.read(3) == raw(3)
+    # NOTE: ids never appended have a zero offset, which is the header line
+    assert manifest.read(2) is None
+    assert manifest.read(4) is None
+
+def test_records_only_keep_what_differs_from_the_header(tmp_path):
+    manifest = JobManifest(f"{tmp_path}/manifest")
+    manifest.append([ raw(0), raw(1, envs={"X" : "1"}) ])
+    assert list(manifest.records()) == [
+        { "job_id" : 0, "input_file" : "/data/file_0.json" },
+        { "job_id" : 1, "input_file" : "/data/file_1.json", "envs" : {"X" : "1"} },
+    ]
+    assert list(manifest.scan()) == [ raw(0), raw(1, envs={"X" : "1"}) ]
+
+def test_migrate_legacy_input_files(tmp_path):
+    os.makedirs(f"{tmp_path}/inputs")
+    for job_id in [2, 0, 1]:
+        with open(f"{tmp_path}/inputs/job_{job_id}.json", 'w') as f:
+            json.dump(raw(job_id), f)
+    manifest = JobManifest(f"{tmp_path}/manifest")
+    assert manifest.migrate(f"{tmp_path}/inputs") == 3
+    assert [ job["job_id"] for job in manifest.scan() ] == [0, 1, 2]
+    assert manifest.read(2) == raw(2)
+    # NOTE: the legacy files are kept for 'maestro run job'
+    assert os.path.exists(f"{tmp_path}/inputs/job_0.json")
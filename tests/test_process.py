@@ -0,0 +1,14 @@
+from time import time
+
+from maestro_lightning.backends.process import Popen
+
+
+def test_join_returns_when_the_process_exits():
+    proc = Popen("sleep 0.5; exit 3")
+    start = time()
+    proc.run_async()
+    assert proc.join() == 3
+    # NOTE: the runner used to poll the process every 10 seconds
+    assert time() - start < 2
+    assert proc.status() == "failed"
+    assert proc.metrics()["exec_time"] > 0
@@ -0,0 +1,47 @@
+import os
+import time
+
+from maestro_lightning.storage.results import ResultCache
+
+
+def write(path : str, size : int) -> str:
+    with open(path, 'wb') as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_outputs_are_hard_linked(tmp_path):
+    cache  = ResultCache(f"{tmp_path}/results", capacity=1024)
+    output = write(f"{tmp_path}/output.json", 100)
+    assert cache.put("ab12", { "OUT" : output }, cpu_hours=2)
+    meta = cache.get("ab12")
+    assert meta["outputs"] == ["OUT"] and meta["size"] == 100 and meta["cpu_hours"] == 2
+    cache.restore(meta, { "OUT" : f"{tmp_path}/restored/output.json" })
+    assert os.stat(f"{tmp_path}/restored/output.json").st_ino == os.stat(output).st_ino
+    assert cache.get("cd34") is None
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = ResultCache(f"{tmp_path}/results", capacity=250)
+    for key in ["aa", "bb"]:
+        cache.put(key, { "OUT" : write(f"{tmp_path}/{key}.json", 100) })
+    past = time.time() - 10
+    os.utime(f"{cache.get('bb')['path']}/meta.json", (past, past))
+    cache.put("cc", { "OUT" : write(f"{tmp_path}/cc.json", 100) })
+    assert cache.get("bb") is None
+    assert cache.get("aa") and cache.get("cc")
+
+def test_outputs_larger_than_the_store(tmp_path):
+    cache = ResultCache(f"{tmp_path}/results", capacity=50)
+    assert not cache.put("aa", { "OUT" : write(f"{tmp_path}/aa.json", 100) })
+    assert cache.get("aa") is None
+
+def test_entries_are_listed_only_when_full(tmp_path, monkeypatch):
+    cache = ResultCache(f"{tmp_path}/results", capacity=250)
+    cache.put("aa", { "OUT" : write(f"{tmp_path}/aa.json", 100) })
+    listed = []
+    original = ResultCache.entries
+    monkeypatch.setattr(ResultCache, "entries", lambda self: listed.append(1) or original(self))
+    cache.put("bb", { "OUT" : write(f"{tmp_path}/bb.json", 100) })
+    assert not listed and open(cache.ledger).read() == "200"
+    cache.put("cc", { "OUT" : write(f"{tmp_path}/cc.json", 100) })
+    assert listed and open(cache.ledger).read() == "200"
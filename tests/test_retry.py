@@ -0,0 +1,67 @@
+import os
+
+from maestro_lightning import Flow, Task, Dataset, State, Reason
+from maestro_lightning.flow import dump
+from maestro_lightning.models import get_context
+from maestro_lightning.runners.job_runner import classify
+from maestro_lightning.runners.task_runner import reap_jobs, requeue_jobs, retry_jobs
+
+
+def create(basepath : str, count : int) -> Task:
+    os.makedirs(f"{basepath}/jobs")
+    for index in range(count):
+        open(f"{basepath}/jobs/job_{index}.json", 'w').close()
+    session = Flow(name="test", path=f"{basepath}/flow", level="WARNING").__enter__()
+    jobs = Dataset(name="jobs", path=f"{basepath}/jobs")
+    task = Task(name="A", command="run %IN %OUT", input_data=jobs, outputs={'OUT':'output.json'}, partition='cpu')
+    ctx = get_context()
+    session.mkdir()
+    dump( ctx, f"{basepath}/flow/flow.json" )
+    [dataset.mkdir() for dataset in ctx.datasets.values()]
+    [task.mkdir() for task in ctx.tasks.values()]
+    return task
+
+
+def test_classify(monkeypatch):
+    monkeypatch.setenv("SLURM_MEM_PER_NODE", "1000")
+    monkeypatch.setenv("SLURM_JOB_END_TIME", "10000")
+    assert classify(1) == Reason.EXIT
+    assert classify(-9, oom_kills=1) == Reason.OOM
+    # NOTE: without the cgroup, a job killed close to its memory limit ran out of memory
+    assert classify(-9, memory_peak_mb=950) == Reason.OOM
+    assert classify(137, memory_peak_mb=100) == Reason.SIGNAL
+    assert classify(-15, terminated=9990) == Reason.TIMEOUT
+    assert classify(-15, terminated=5000) == Reason.SIGNAL
+
+def test_oom_escalates_memory(tmp_path):
+    task = create(tmp_path, 2)
+    task.jobs[0].fail(Reason.OOM, 137)
+    task.history.append({ "job_id" : 0, "attempt" : 0, "status" : State.FAILED.value, "mem_mb" : 1000 })
+    assert requeue_jobs(task) == { (("MEM", "2000M"),) : [0] }
+    status = task.table.get(0)
+    assert status.status == State.ASSIGNED
+    assert status.attempt == 1
+    assert task.table.get(1).status == State.ASSIGNED
+
+def test_retries_stop_at_max_attempts(tmp_path):
+    task = create(tmp_path, 1)
+    task.table.update(0, status=State.FAILED, reason=Reason.OOM, attempt=task.max_attempts - 1)
+    assert requeue_jobs(task) == {}
+    assert task.table.get(0).status == State.FAILED
+
+def test_failed_submission_fails_again(tmp_path, monkeypatch):
+    task = create(tmp_path, 1)
+    task.jobs[0].fail(Reason.LOST)
+    monkeypatch.setattr(Task, "submit", lambda self, dry_run=False, job_ids=None, resources=None: [])
+    assert retry_jobs(task) == []
+    status = task.table.get(0)
+    assert status.status == State.FAILED
+    assert status.attempt == 0
+
+def test_lost_jobs_are_retried(tmp_path):
+    task = create(tmp_path, 2)
+    task.table.update(0, status=State.RUNNING)
+    assert reap_jobs(task, timeout=0) == [0]
+    assert task.table.get(0).reason == Reason.LOST
+    assert requeue_jobs(task) == { () : [0] }
+    assert task.table.get(0).attempt == 1
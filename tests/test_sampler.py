@@ -0,0 +1,56 @@
+import os
+import subprocess
+
+from maestro_lightning.backends.sampler import Sampler, get_cgroup
+
+
+def cgroup(path : str, memory : int) -> str:
+    os.makedirs(path, exist_ok=True)
+    files = {
+        "memory.current" : f"{memory}\n",
+        "memory.peak"    : f"{2 * memory}\n",
+        "cpu.stat"       : "usage_usec 2500000\nuser_usec 2000000\n",
+        "io.stat"        : "8:0 rbytes=100 wbytes=200 rios=1 wios=2\n8:16 rbytes=1 wbytes=2\n",
+        "memory.events"  : "low 0\noom 1\noom_kill 1\n",
+    }
+    for name, content in files.items():
+        with open(f"{path}/{name}", 'w') as f:
+            f.write(content)
+    return path
+
+
+def test_no_cgroup_outside_of_slurm(monkeypatch):
+    monkeypatch.delenv("SLURM_JOB_ID", raising=False)
+    assert get_cgroup(os.getpid()) is None
+
+def test_sample_from_cgroup(tmp_path):
+    sampler = Sampler(os.getpid())
+    sampler.gpus   = False
+    sampler.cgroup = cgroup(f"{tmp_path}/step_0", 1024)
+    values = sampler.sample()
+    assert values["memory"] == 1024 and values["memory_peak"] == 2048
+    assert values["cpu_time"] == 2.5
+    assert (values["io_read"], values["io_write"]) == (101, 202)
+    assert sampler.oom_kills() == 1
+
+def test_fall_back_to_proc(tmp_path):
+    process = subprocess.Popen(["sleep", "5"])
+    try:
+        sampler = Sampler(os.getpid())
+        sampler.gpus   = False
+        # NOTE: the cgroup of a finished step is removed while the job may still be sampled
+        sampler.cgroup = f"{tmp_path}/missing"
+        values = sampler.sample()
+        assert sampler.cgroup is None
+        assert process.pid in sampler.pids
+        assert values["memory"] > 0 and values["cpu_time"] >= 0
+        assert sampler.oom_kills() == 0
+    finally:
+        process.kill()
+        process.wait()
+
+def test_no_cgroup_for_pool_jobs(monkeypatch):
+    # NOTE: jobs of a local pool share the step of the allocation with the other jobs
+    monkeypatch.setenv("SLURM_JOB_ID", "123")
+    monkeypatch.setenv("MAESTRO_POOL", "1")
+    assert get_cgroup(os.getpid()) is None
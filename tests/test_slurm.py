@@ -0,0 +1,21 @@
+from maestro_lightning import array_ranges, split_array
+
+
+def test_array_ranges():
+    assert array_ranges([0, 1, 2, 5, 7, 8]) == "0-2,5,7-8"
+
+def test_split_array_uses_job_ids_as_indices():
+    assert split_array([3, 1, 2, 1]) == [("1-3", None)]
+    assert split_array([]) == []
+
+def test_split_array_chunks_large_ids():
+    ids    = list(range(1000, 1010))
+    chunks = split_array(ids, max_size=4)
+    assert [ spec for spec, _ in chunks ] == ["0-3", "0-3", "0-1"]
+    assert sum( (indices for _, indices in chunks), [] ) == ids
+
+def test_split_array_chunks_long_specs():
+    # NOTE: every other id makes a spec with one range per job
+    ids    = list(range(0, 400, 2))
+    chunks = split_array(ids, max_size=1001, max_length=100)
+    assert len(chunks) == 1 and chunks[0] == ("0-199", ids)
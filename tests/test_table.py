@@ -0,0 +1,52 @@
+import os
+import json
+
+from maestro_lightning.models import StatusTable, Status, State, Reason
+
+
+def test_rollup_follows_transitions(tmp_path):
+    table = StatusTable(f"{tmp_path}/status.table")
+    table.extend({ job_id : Status(State.ASSIGNED) for job_id in range(5) })
+    table.update(0, status=State.RUNNING)
+    table.update(1, status=State.RUNNING)
+    table.update(0, status=State.COMPLETED)
+    table.set(2, Status(State.FAILED, reason=Reason.OOM))
+    counts = table.counts()
+    assert counts[State.ASSIGNED]  == 2
+    assert counts[State.RUNNING]   == 1
+    assert counts[State.COMPLETED] == 1
+    assert counts[State.FAILED]    == 1
+    assert counts == table.recount()
+
+def test_rollup_counts_claims_and_growth(tmp_path):
+    table = StatusTable(f"{tmp_path}/status.table")
+    table.extend({ job_id : Status(State.ASSIGNED) for job_id in range(4) })
+    assert table.claim(3) == [0, 1, 2]
+    # NOTE: records skipped when the table grows are unknown jobs
+    table.set(9, Status(State.ASSIGNED))
+    counts = table.counts()
+    assert counts[State.PENDING]  == 3
+    assert counts[State.ASSIGNED] == 2
+    assert counts[State.UNKNOWN]  == 5
+    assert sum(counts.values()) == len(table) == 10
+
+def test_rollup_rebuilt_for_old_tables(tmp_path):
+    table = StatusTable(f"{tmp_path}/status.table")
+    table.extend({ 0 : Status(State.COMPLETED), 1 : Status(State.FAILED) })
+    # NOTE: version 1 tables have no counters in their header
+    with open(table.path, 'r+b') as f:
+        f.write(table.header.pack(table.magic, 1, table.record.size).ljust(table.header_size, b"\0"))
+    assert table.counts()[State.COMPLETED] == 1
+    table.update(1, status=State.ASSIGNED)
+    counts = table.counts()
+    assert counts[State.COMPLETED] == 1 and counts[State.ASSIGNED] == 1 and counts[State.FAILED] == 0
+
+def test_migrate_legacy_status_files(tmp_path):
+    os.makedirs(f"{tmp_path}/status")
+    for job_id, state in enumerate([State.COMPLETED, State.FAILED, State.COMPLETED]):
+        with open(f"{tmp_path}/status/job_{job_id}.json", 'w') as f:
+            json.dump(Status(state, attempt=job_id).to_dict(), f)
+    table = StatusTable(f"{tmp_path}/status.table")
+    assert table.migrate(f"{tmp_path}/status") == 3
+    assert table.get(1).status == State.FAILED and table.get(2).attempt == 2
+    assert table.counts()[State.COMPLETED] == 2
@@ -0,0 +1,32 @@
+import os
+
+from maestro_lightning import Flow, Task, Dataset
+from maestro_lightning.flow import dump, load
+from maestro_lightning.models import get_context
+
+
+def create(basepath : str, count : int):
+    os.makedirs(f"{basepath}/jobs")
+    for index in range(count):
+        open(f"{basepath}/jobs/job_{index}.json", 'w').close()
+    session = Flow(name="test", path=f"{basepath}/flow", level="WARNING").__enter__()
+    jobs = Dataset(name="jobs", path=f"{basepath}/jobs")
+    Task(name="A", command="run %IN %OUT", input_data=jobs, outputs={'OUT':'output.json'}, partition='cpu')
+    ctx = get_context()
+    session.mkdir()
+    dump( ctx, f"{basepath}/flow/flow.json" )
+    [dataset.mkdir() for dataset in ctx.datasets.values()]
+    [task.mkdir() for task in ctx.tasks.values()]
+
+
+def test_jobs_are_loaded_on_first_access(tmp_path):
+    create(tmp_path, 3)
+    ctx = get_context(clear=True)
+    load( f"{tmp_path}/flow/flow.json", ctx )
+    task = ctx.tasks["A"]
+    assert task._jobs is None
+    # NOTE: status queries only read the status table
+    assert task.get_array_of_jobs_with_status() == [0, 1, 2]
+    assert task._jobs is None
+    assert len(task.jobs) == 3
+    assert [ task.jobs[job_id].input_file for job_id in range(3) ] == [ f"{tmp_path}/jobs/job_{index}.json" for index in range(3) ]
@@ -0,0 +1,43 @@
+import os
+import pytest
+
+from maestro_lightning.storage import transfer
+from maestro_lightning.storage.transfer import copy_files, file_digest, partial_path
+from maestro_lightning.exceptions import TransferError
+
+
+def write(path : str, data : bytes) -> str:
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_copy_files(tmp_path):
+    files = [ (write(f"{tmp_path}/in_{index}", os.urandom(1000 * index)), f"{tmp_path}/out_{index}") for index in range(4) ]
+    digests = copy_files(files, workers=2)
+    for source, target in files:
+        assert open(target, 'rb').read() == open(source, 'rb').read()
+        assert digests[target] == file_digest(source)
+
+def test_corrupted_copy_is_tried_again(tmp_path, monkeypatch):
+    source = write(f"{tmp_path}/in", b"data")
+    calls  = []
+    def corrupted_once(path, **kwargs):
+        calls.append(path)
+        return "bad" if len(calls) == 1 else file_digest(path, **kwargs)
+    monkeypatch.setattr(transfer, "file_digest", corrupted_once)
+    copy_files([(source, f"{tmp_path}/out")])
+    assert len(calls) == 2
+    assert open(f"{tmp_path}/out", 'rb').read() == b"data"
+
+def test_corrupted_copy_is_never_renamed(tmp_path, monkeypatch):
+    source = write(f"{tmp_path}/in", b"data")
+    monkeypatch.setattr(transfer, "file_digest", lambda path, **kwargs: "bad")
+    with pytest.raises(TransferError):
+        copy_files([(source, f"{tmp_path}/out")], retries=1)
+    assert os.listdir(tmp_path) == ["in"]
+
+def test_partial_files_are_hidden(tmp_path):
+    # NOTE: dataset scans skip hidden files, so a killed copy is never taken as an input
+    folder, name = os.path.split(partial_path(f"{tmp_path}/out.json"))
+    assert folder == str(tmp_path) and name.startswith(".out.json.part.")